@@ -72,11 +72,31 @@ class Conf():
             'plotWeightsFlag' : False,
             'plotActivations' : True,
             'showValidPred' : False,
+            'predict_batch_size' : 256,
+            'predict_chunk_size' : 4096,
+            'stream_training' : False,
+            'shuffle_buffer' : 16384,
+            'prefetch_batches' : 8,
             }
 
     def sysDef(self):
         self.conf['System'] = {
             'useTFKeras' : False,
+            'server_port' : 5050,
+            'server_batch_wait' : 0.005,
+            }
+
+    def augDef(self):
+        self.conf['Augmentation'] = {
+            'augment' : False,
+            'aug_shift_prob' : 0.5,
+            'aug_shift' : 2,
+            'aug_noise_prob' : 0.5,
+            'aug_noise' : 0.01,
+            'aug_offset_prob' : 0.5,
+            'aug_offset' : 0.02,
+            'aug_background_prob' : 0.5,
+            'aug_background' : 0.02,
             }
 
     def readConfig(self,configFile):
@@ -104,7 +124,23 @@ class Conf():
             self.plotWeightsFlag = self.conf.getboolean('Parameters','plotWeightsFlag')
             self.plotActivations = self.conf.getboolean('Parameters','plotActivations')
             self.showValidPred = self.conf.getboolean('Parameters','showValidPred')
+            self.predict_batch_size = self.conf.getint('Parameters','predict_batch_size', fallback=256)
+            self.predict_chunk_size = self.conf.getint('Parameters','predict_chunk_size', fallback=4096)
+            self.stream_training = self.conf.getboolean('Parameters','stream_training', fallback=False)
+            self.shuffle_buffer = self.conf.getint('Parameters','shuffle_buffer', fallback=16384)
+            self.prefetch_batches = self.conf.getint('Parameters','prefetch_batches', fallback=8)
             self.useTFKeras = self.conf.getboolean('System','useTFKeras')
+            self.server_port = self.conf.get('System','server_port', fallback='5050')
+            self.server_batch_wait = self.conf.getfloat('System','server_batch_wait', fallback=0.005)
+            self.augment = self.conf.getboolean('Augmentation','augment', fallback=False)
+            self.aug_shift_prob = self.conf.getfloat('Augmentation','aug_shift_prob', fallback=0.5)
+            self.aug_shift = self.conf.getfloat('Augmentation','aug_shift', fallback=2)
+            self.aug_noise_prob = self.conf.getfloat('Augmentation','aug_noise_prob', fallback=0.5)
+            self.aug_noise = self.conf.getfloat('Augmentation','aug_noise', fallback=0.01)
+            self.aug_offset_prob = self.conf.getfloat('Augmentation','aug_offset_prob', fallback=0.5)
+            self.aug_offset = self.conf.getfloat('Augmentation','aug_offset', fallback=0.02)
+            self.aug_background_prob = self.conf.getfloat('Augmentation','aug_background_prob', fallback=0.5)
+            self.aug_background = self.conf.getfloat('Augmentation','aug_background', fallback=0.02)
         except:
             print(" Error in reading configuration file. Please check it\n")
 
@@ -113,6 +149,7 @@ class Conf():
         try:
             self.SKDef()
             self.sysDef()
+            self.augDef()
             with open(self.configFile, 'w') as configfile:
                 self.conf.write(configfile)
         except:
@@ -126,7 +163,7 @@ def main():
     dP = Conf()
     try:
         opts, args = getopt.getopt(sys.argv[1:],
-                                   "tnpbh:", ["train", "net", "predict", "batch", "help"])
+                                   "tnpbsh:", ["train", "net", "predict", "batch", "server", "help"])
     except:
         usage()
         sys.exit(2)
@@ -170,6 +207,16 @@ def main():
                 usage()
                 sys.exit(2)
 
+        if o in ("-s" , "--server"):
+            try:
+                if len(sys.argv)<3:
+                    server(dP.server_port)
+                else:
+                    server(sys.argv[2])
+            except:
+                usage()
+                sys.exit(2)
+
     total_time = time.clock() - start_time
     print(" Total time: {0:.1f}s or {1:.1f}m or {2:.1f}h".format(total_time,
                             total_time/60, total_time/3600),"\n")
@@ -198,13 +245,15 @@ def train(learnFile, testFile, flag):
 
     learnFileRoot = os.path.splitext(learnFile)[0]
 
-    En, A, Cl = readLearnFile(learnFile)
+    # Training batches come from LearnStream when streaming or augmenting
+    useStream = dP.stream_training or dP.augment
+
+    # Streamed spectra are normalized per batch, after augmentation
+    En, A, Cl = readLearnFile(learnFile, dP, lazy=dP.stream_training, raw=useStream)
     if testFile != None:
-        En_test, A_test, Cl_test = readLearnFile(testFile)
-        totA = np.vstack((A, A_test))
+        En_test, A_test, Cl_test = readLearnFile(testFile, dP)
         totCl = np.append(Cl, Cl_test)
     else:
-        totA = A
         totCl = Cl
 
     if flag == False:
@@ -216,6 +265,7 @@ def train(learnFile, testFile, flag):
     
     if dP.regressor:
         Cl2 = np.copy(Cl)
+        numClasses = None
         if testFile != None:
             Cl2_test = np.copy(Cl_test)
     else:
@@ -249,7 +299,10 @@ def train(learnFile, testFile, flag):
                 f.write(pickle.dumps(le))
 
         #totCl2 = keras.utils.to_categorical(totCl2, num_classes=np.unique(totCl).size)
-        Cl2 = keras.utils.to_categorical(Cl2, num_classes=np.unique(totCl).size+1)
+        numClasses = np.unique(totCl).size+1
+        # LearnStream encodes one batch at a time
+        if not useStream:
+            Cl2 = keras.utils.to_categorical(Cl2, num_classes=numClasses)
         if testFile != None:
             Cl2_test = keras.utils.to_categorical(Cl2_test, num_classes=np.unique(totCl).size+1)
 
@@ -264,7 +317,9 @@ def train(learnFile, testFile, flag):
     # CNN specific
     # Format spectra as images for loading
     #************************************
-    x_train = formatForCNN(A,En)
+    # LearnStream formats batches as they are generated
+    if not useStream:
+        x_train = formatForCNN(A,En)
     if testFile != None:
         x_test = formatForCNN(A_test,En)
 
@@ -284,7 +339,7 @@ def train(learnFile, testFile, flag):
     for i in range(len(dP.CL_filter)):
         model.add(keras.layers.Conv2D(dP.CL_filter[i], (1, dP.CL_size[i]),
             activation='relu',
-            input_shape=x_train[0].shape))
+            input_shape=formatForCNN(A[:1],En)[0].shape))
         model.add(keras.layers.Dropout(dP.dropCNN[i]))
         try:
             model.add(keras.layers.MaxPooling2D(pool_size=(1, dP.max_pooling[i])))
@@ -333,7 +388,37 @@ def train(learnFile, testFile, flag):
     if flag:
         return
     
-    if testFile != None:
+    if useStream:
+        #************************************
+        # Batches read from disk in blocks
+        # (stream_training) and/or augmented
+        # on the fly (augment)
+        #************************************
+        norm = Normalizer() if dP.normalize else None
+        if testFile != None:
+            stop = A.shape[0]
+            validation = (x_test, Cl2_test)
+        else:
+            # Hold out the last cv_split fraction, as validation_split does
+            stop = A.shape[0] - int(A.shape[0]*dP.cv_split)
+            A_valid = np.asarray(A[stop:])
+            if norm is not None:
+                A_valid = norm.transform_matrix(A_valid)
+            Cl2_valid = Cl2[stop:]
+            if numClasses is not None:
+                Cl2_valid = keras.utils.to_categorical(Cl2_valid, num_classes=numClasses)
+            validation = (formatForCNN(A_valid,En), Cl2_valid)
+        stream = LearnStream(A, Cl2, dP.batch_size, En, numClasses=numClasses,
+            norm=norm, aug=SpectraAugmenter(dP, En) if dP.augment else None,
+            formatInput=formatForCNN, stop=stop, bufferRows=dP.shuffle_buffer)
+        log = model.fit_generator(iter(stream),
+            steps_per_epoch=len(stream),
+            epochs=dP.epochs,
+            callbacks = tbLogs,
+            verbose=2,
+            validation_data=validation,
+            max_queue_size=dP.prefetch_batches)
+    elif testFile != None:
         log = model.fit(x_train, Cl2,
             epochs=dP.epochs,
             batch_size=dP.batch_size,
@@ -434,15 +519,11 @@ def train(learnFile, testFile, flag):
 #************************************
 def predict(testFile):
     dP = Conf()
-    if dP.useTFKeras:
-        import tensorflow.keras as keras  #tf.keras
-    else:
-        import keras   # pure Keras
-    
-    model = keras.models.load_model(dP.modelName)
+    mB = ModelBundle(dP)
+    model = mB.loadModel()
 
     try:
-        R = readTestFile(testFile)
+        R = readTestFile(testFile, mB)
     except:
         print('\033[1m' + '\n Sample data file not found \n ' + '\033[0m')
         return
@@ -457,7 +538,7 @@ def predict(testFile):
         print('  ========================================================\n')
         
     else:
-        le = pickle.loads(open(dP.model_le, "rb").read())
+        le = mB.le
         predictions = model.predict(R, verbose=0)
         pred_class = np.argmax(predictions)
         predProb = round(100*predictions[0][pred_class],2)
@@ -496,135 +577,99 @@ def predict(testFile):
 #************************************
 def batchPredict():
     dP = Conf()
-    if dP.useTFKeras:
-        import tensorflow.keras as keras  #tf.keras
-    else:
-        import keras   # pure Keras
-
-    model = keras.models.load_model(dP.modelName)
-
-    predictions = np.zeros((0,0))
-    fileName = []
-    for file in glob.glob('*.txt'):
-        R = readTestFile(file)
-        try:
-            predictions = np.vstack((predictions,model.predict(R).flatten()))
-        except:
-            predictions = np.array([model.predict(R).flatten()])
-        fileName.append(file)
-
+    mB = ModelBundle(dP)
+    model = mB.loadModel()
+
+    # Files are read and preprocessed in chunks of predict_chunk_size,
+    # each chunk is scored with a single call to model.predict
+    fileName = glob.glob('*.txt')
+    numFiles = len(fileName)
+    if numFiles == 0:
+        print(" No sample files found for batch prediction\n")
+        return
+    predictions = None
+    for start in range(0, numFiles, dP.predict_chunk_size):
+        chunk = fileName[start:start+dP.predict_chunk_size]
+        R = readTestFile(chunk[0], mB)
+        x = np.empty((len(chunk),)+R.shape[1:])
+        x[0] = R[0]
+        for i in range(1, len(chunk)):
+            x[i] = readTestFile(chunk[i], mB)[0]
+        pred = model.predict(x, batch_size=dP.predict_batch_size)
+        if predictions is None:
+            predictions = np.empty((numFiles, pred.shape[1]))
+        predictions[start:start+len(chunk)] = pred
+
+    summaryFile = np.empty((numFiles+2, 3), dtype=object)
+    summaryFile[2:,0] = fileName
     if dP.regressor:
-        summaryFile = np.array([['SpectraKeras_CNN','Regressor','',],['File name','Prediction','']])
+        summaryFile[:2] = [['SpectraKeras_CNN','Regressor','',],['File name','Prediction','']]
+        predValue = predictions[:,0]
+        summaryFile[2:,1] = predValue
+        summaryFile[2:,2] = ''
         print('\n  ========================================================')
         print('  \033[1mKeras CNN - Regressor\033[0m - Prediction')
         print('  ========================================================')
-        for i in range(predictions.shape[0]):
-            predValue = predictions[i][0]
-            print('  {0:s}:\033[1m\n   Predicted value = {1:.2f}\033[0m\n'.format(fileName[i],predValue))
-            summaryFile = np.vstack((summaryFile,[fileName[i],predValue,'']))
+        for i in range(numFiles):
+            print('  {0:s}:\033[1m\n   Predicted value = {1:.2f}\033[0m\n'.format(fileName[i],predValue[i]))
         print('  ========================================================\n')
 
     else:
-        le = pickle.loads(open(dP.model_le, "rb").read())
-        summaryFile = np.array([['SpectraKeras_CNN','Classifier',''],['File name','Predicted Class', 'Probability']])
+        le = mB.le
+        summaryFile[:2] = [['SpectraKeras_CNN','Classifier',''],['File name','Predicted Class', 'Probability']]
+        pred_class = np.argmax(predictions, axis=1)
+        predProb = np.round(100*predictions[np.arange(numFiles), pred_class],2)
+        predValue = le.inverse_transform(pred_class)
+        summaryFile[2:,1] = predValue
+        summaryFile[2:,2] = predProb
         print('\n  ========================================================')
         print('  \033[1mKeras CNN - Classifier\033[0m - Prediction')
         print('  ========================================================')
-        for i in range(predictions.shape[0]):
-            pred_class = np.argmax(predictions[i])
-            predProb = round(100*predictions[0][pred_class],2)
-            rosterPred = np.where(predictions[i][0]>0.1)[0]
-        
-            if pred_class.size >0:
-                predValue = le.inverse_transform(pred_class)[0]
-                print('  {0:s}:\033[1m\n   Predicted value = {1:.2f} (probability = {2:.2f}%)\033[0m\n'.format(fileName[i],predValue, predProb))
-            else:
-                predValue = 0
-                print('  {0:s}:\033[1m\n   No predicted value (probability = {1:.2f}%)\033[0m\n'.format(fileName[i],predProb))
-            summaryFile = np.vstack((summaryFile,[fileName[i], predValue,predProb]))
+        for i in range(numFiles):
+            print('  {0:s}:\033[1m\n   Predicted value = {1:.2f} (probability = {2:.2f}%)\033[0m\n'.format(fileName[i],predValue[i], predProb[i]))
         print('  ========================================================\n')
     df = pd.DataFrame(summaryFile)
     df.to_csv(dP.summaryFileName, index=False, header=False)
     print(" Prediction summary saved in:",dP.summaryFileName,"\n")
 
 #************************************
-# Open Learning Data
+# Prediction server
 #************************************
-def readLearnFile(learnFile):
-    print("\n  Opening learning file: ",learnFile)
-    try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
-    except:
-        print("\033[1m Learning file not found\033[0m")
-        return
-
+def server(address):
     dP = Conf()
-    En = M[0,dP.numLabels:]
-    A = M[1:,dP.numLabels:]
-    
-    if dP.normalize:
-        norm = Normalizer()
-        A = norm.transform_matrix(A)
-
-    if dP.numLabels == 1:
-        Cl = M[1:,0]
-    else:
-        Cl = M[1:,[0,dP.numLabels-1]]
-
-    return En, A, Cl
+    mB = ModelBundle(dP)
+    PredictionServer(mB, formatForCNN).serve(address)
 
 #************************************
 # Open Testing Data
 #************************************
-def readTestFile(testFile):
+def readTestFile(testFile, mB=None):
     with open(testFile, 'r') as f:
         print('\n  Opening sample data for prediction:\n  ',testFile)
         Rtot = np.loadtxt(f, unpack =True)
-    R = preProcess(Rtot)
+    R = preProcess(Rtot, mB)
     return R
 
 #****************************************************
 # Check Energy Range and convert to fit training set
 #****************************************************
-def preProcess(Rtot):
-    dP = Conf()
-    En = pickle.loads(open(dP.spectral_range, "rb").read())
-    R = np.array([Rtot[1,:]])
-    Rx = np.array([Rtot[0,:]])
-    
-    if dP.normalize:
-        norm = Normalizer()
-        R = norm.transform_single(R)
-    
-    if(R.shape[1] != len(En)):
-        print('  Rescaling x-axis from',str(R.shape[1]),'to',str(len(En)))
-        R = np.interp(En, Rx[0], R[0])
-        R = R.reshape(1,-1)
+def preProcess(Rtot, mB=None):
+    if mB is None:
+        mB = ModelBundle(Conf())
+    R = mB.resample(Rtot)
 
     #R = np.array([np.dstack([np.dstack([np.ones(len(En)), En]), R])])
-    R = formatForCNN(R,En)
+    R = formatForCNN(R,mB.En)
     return R
 
 #****************************************************
 # Format data for CNN
 #****************************************************
 def formatForCNN(A,En):
-    listmatrix = []
-    for i in range(A.shape[0]):
-        #spectra = np.dstack([np.ones(En.shape[0]), En])
-        #spectra = np.dstack([spectra, A[i]])
-        #spectra = np.dstack([En, A[i]])
-        spectra = np.dstack([A[i]])
-        listmatrix.append(spectra)
-    x = np.stack(listmatrix, axis=0)
-    return x
+    # (N,P) -> (N,1,P,1): a view, no copy for contiguous float32 A.
+    # Other inputs are converted once, as keras would do anyway.
+    A = np.ascontiguousarray(A, dtype=np.float32)
+    return A.reshape(A.shape[0], 1, A.shape[1], 1)
 
 #************************************
 # Print NN Info
@@ -756,6 +801,8 @@ def usage():
     print('  python3 SpectraKeras_CNN.py -p <testFile>\n')
     print(' Batch predict:')
     print('  python3 SpectraKeras_CNN.py -b\n')
+    print(' Prediction server (HTTP port or unix socket path):')
+    print('  python3 SpectraKeras_CNN.py -s <port | socket>\n')
     print(' Display Neural Netwrok Configuration:')
     print('  python3 SpectraKeras_CNN.py -n <learningFile>\n')
     print(' Requires python 3.x. Not compatible with python 2.x\n')
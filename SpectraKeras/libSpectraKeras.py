@@ -8,8 +8,150 @@
 ***********************************************************
 '''
 import numpy as np
-import pickle
-from bisect import bisect_left
+import os.path, pickle, h5py, json, time, threading, queue
+import socketserver, http.server
+from collections import OrderedDict
+from numpy.lib.stride_tricks import sliding_window_view
+
+#************************************
+# Open Learning Data
+#************************************
+def readLearnFile(learnFile, dP, lazy=False, raw=False):
+    print("\n  Opening learning file: ",learnFile)
+    try:
+        if isLearnFileV2(learnFile):
+            En, Cl, A = readLearnFileV2(learnFile, dP.numLabels, lazy)
+        else:
+            M = openLearnFile(learnFile)
+            if isinstance(M, LazyMatrix):
+                # Read En and labels only; A stays on disk
+                En = M.dset[0,dP.numLabels:]
+                Cl = M.dset[1:,:dP.numLabels]
+                A = M.offset(1,dP.numLabels)
+                if not lazy:
+                    A = A[:]
+            else:
+                En = np.asarray(M[0,dP.numLabels:])
+                A = M[1:,dP.numLabels:]
+                Cl = np.asarray(M[1:,:dP.numLabels])
+            if dP.numLabels == 1:
+                Cl = Cl[:,0]
+    except:
+        print("\033[1m Learning file not found\033[0m")
+        return
+
+    if dP.numLabels > 1 and Cl.ndim == 2:
+        Cl = Cl[:,[0,dP.numLabels-1]]
+
+    # Lazy or raw data is normalized batch by batch (see LearnStream)
+    if dP.normalize and not (lazy or raw):
+        norm = Normalizer()
+        # A read from HDF5 or text is already a private copy
+        if isinstance(A, np.ndarray) and A.flags.writeable and not isinstance(A, np.memmap):
+            A = norm.transform_matrix(A, out=A)
+        else:
+            A = norm.transform_matrix(A)
+
+    return En, A, Cl
+
+#************************************
+# HDF5 v2 learning files store En, Cl
+# and a row-chunked, compressed A as
+# separate datasets (v1 has a single M).
+# Cl is (N,) or (N, numLabels), as
+# recorded in the numLabels attribute.
+#************************************
+def isLearnFileV2(learnFile):
+    if os.path.splitext(learnFile)[1] != ".h5":
+        return False
+    with h5py.File(learnFile, 'r') as hf:
+        return "A" in hf
+
+def readLearnFileV2(learnFile, numLabels=1, lazy=False):
+    hf = h5py.File(learnFile, 'r')
+    fileLabels = int(hf.attrs.get('numLabels', 1))
+    if fileLabels != numLabels:
+        hf.close()
+        print("\033[1m Learning file has", fileLabels, "labels, numLabels is", numLabels, "\033[0m")
+        raise ValueError("numLabels mismatch")
+    En, Cl = hf["En"][:], hf["Cl"][:]
+    if numLabels == 1 and Cl.ndim == 2:
+        Cl = Cl[:,0]
+    if lazy:
+        return En, Cl, LazyMatrix(hf["A"], hf=hf)
+    A = hf["A"][:]
+    hf.close()
+    return En, Cl, A
+
+#************************************
+# Open learning file without copying:
+# .npy is memory-mapped (read-only, shared
+# through the OS page cache), .h5 is lazy.
+# Text is parsed only as a last resort.
+#************************************
+def openLearnFile(learnFile):
+    ext = os.path.splitext(learnFile)[1]
+    if ext == ".npy":
+        return np.load(learnFile, mmap_mode='r')
+    elif ext == ".h5":
+        hf = h5py.File(learnFile, 'r')
+        return LazyMatrix(hf["M"], hf=hf)
+    else:
+        with open(learnFile, 'r') as f:
+            return np.loadtxt(f, unpack =False)
+
+#************************************
+# LazyMatrix
+# Read-only view on an HDF5 dataset:
+# only indexed rows are read from disk
+#************************************
+class LazyMatrix(object):
+    def __init__(self, dset, rowOffset=0, colOffset=0, hf=None):
+        self.dset = dset
+        self.hf = hf
+        self.rowOffset = rowOffset
+        self.colOffset = colOffset
+        self.shape = (dset.shape[0]-rowOffset, dset.shape[1]-colOffset)
+        self.dtype = dset.dtype
+        self.ndim = 2
+        self.size = self.shape[0]*self.shape[1]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows = key[0]
+            cols = key[1] if len(key) > 1 else slice(None)
+        else:
+            rows = key
+            cols = slice(None)
+
+        if isinstance(rows, (int, np.integer)):
+            ind = range(self.shape[0])[rows] + self.rowOffset
+            return self.dset[ind, self.colOffset:][cols]
+
+        if isinstance(rows, slice) and (rows.step is None or rows.step > 0):
+            start, stop, step = rows.indices(self.shape[0])
+            sel = slice(start+self.rowOffset, max(start, stop)+self.rowOffset, step)
+            return self.dset[sel, self.colOffset:][:, cols]
+
+        # HDF5 point selections must be sorted and unique
+        ind = np.arange(self.shape[0])[rows]
+        if ind.size == 0:
+            return np.empty((0, self.shape[1]), dtype=self.dtype)[:, cols]
+        uniq, inv = np.unique(ind, return_inverse=True)
+        return self.dset[uniq+self.rowOffset, self.colOffset:][inv][:, cols]
+
+    def __array__(self, dtype=None, copy=None):
+        M = self[:]
+        if dtype is not None:
+            M = M.astype(dtype, copy=False)
+        return M
+
+    def offset(self, rowOffset, colOffset):
+        return LazyMatrix(self.dset, self.rowOffset+rowOffset,
+            self.colOffset+colOffset, self.hf)
 
 #************************************
 # Normalizer
@@ -19,15 +161,21 @@ class Normalizer(object):
         self.YnormTo = 1
         print("  Normalizing spectra between 0 and 1 \n")
 
-    def transform_matrix(self,y):
-        yn = np.copy(y)
-        for i in range(0,y.shape[0]):
-            if np.amax(y[i,:]) - np.amin(y[i,:]) == 0:
-                pass
-            else:
-                yn[i,:] = np.multiply(y[i,:] - np.amin(y[i,:]),
-                    self.YnormTo/(np.amax(y[i,:]) - np.amin(y[i,:])))
-        return yn
+    # Row-wise min/max scaling. Flat rows are left untouched.
+    # With out=y the matrix is normalized in place.
+    def transform_matrix(self, y, out=None):
+        if out is None:
+            out = np.array(y, dtype=np.result_type(y.dtype, np.float32))
+        elif out is not y:
+            out[...] = y
+        ymin = np.amin(out, axis=1, keepdims=True)
+        yrange = np.amax(out, axis=1, keepdims=True) - ymin
+        flat = yrange == 0
+        ymin[flat] = 0
+        yrange[flat] = self.YnormTo
+        out -= ymin
+        out *= self.YnormTo/yrange
+        return out
     
     def transform_single(self,y):
         yn = np.copy(y)
@@ -69,20 +217,21 @@ class NormalizeLabel(object):
             self.min[i] = np.amin(self.M[1:,i])
             self.max[i] = np.amax(self.M[1:,i])
     
-    def transform_matrix(self,y):
-        Mn = np.copy(y)
+    def transform_matrix(self, y, out=None):
+        if out is None:
+            out = np.array(y, copy=True)
+        elif out is not y:
+            out[...] = y
         if self.normalizeLabel:
-            Mn[1:,0] = np.multiply(y[1:,0] - self.min[0],
-                self.YnormTo/(self.max[0] - self.min[0]))
+            out[1:,0] -= self.min[0]
+            out[1:,0] *= self.YnormTo/(self.max[0] - self.min[0])
             if self.useCustomRound:
                 customData = CustomRound(self.data)
-                for i in range(1,y.shape[0]):
-                    Mn[i,0] = customData(Mn[i,0])
+                out[1:,0] = customData(out[1:,0])
 
-        for i in range(1,y.shape[1]):
-            Mn[1:,i] = np.multiply(y[1:,i] - self.min[i],
-                self.YnormTo/(self.max[i] - self.min[i]))
-        return Mn
+        out[1:,1:] -= self.min[1:]
+        out[1:,1:] *= self.YnormTo/(self.max[1:] - self.min[1:])
+        return out
     
     def transform_valid(self,V):
         Vn = np.copy(V)
@@ -101,27 +250,27 @@ class NormalizeLabel(object):
 
 #************************************
 # CustomRound
+# Round to the nearest value in iterable.
+# Works on scalars and whole arrays.
 #************************************
 class CustomRound:
     def __init__(self,iterable):
-        self.data = sorted(iterable)
+        self.data = np.sort(np.asarray(iterable, dtype=float))
 
     def __call__(self,x):
         data = self.data
-        ndata = len(data)
-        idx = bisect_left(data,x)
-        if idx <= 0:
-            return data[0]
-        elif idx >= ndata:
-            return data[ndata-1]
+        if data.size == 1:
+            return np.full_like(np.asarray(x, dtype=float), data[0])[()]
+        idx = np.clip(np.searchsorted(data, x, side='left'), 1, data.size-1)
         x0 = data[idx-1]
         x1 = data[idx]
-        if abs(x-x0) < abs(x-x1):
-            return x0
-        return x1
+        return np.where(np.abs(x-x0) < np.abs(x-x1), x0, x1)[()]
 
 #************************************
 # MultiClassReductor
+# Only totalClass is pickled: the sorted
+# lookup table is rebuilt on loading, so
+# existing keras_le.pkl files still work.
 #************************************
 class MultiClassReductor():
     def __self__(self):
@@ -129,15 +278,496 @@ class MultiClassReductor():
     
     def fit(self,tc):
         self.totalClass = tc.tolist()
-    
+        self.makeLookup()
+
+    def makeLookup(self):
+        self.classes = np.asarray(self.totalClass, dtype=float)
+        keys = self.rowKeys(self.classes)
+        self.order = np.argsort(keys, kind='stable')
+        self.sortedKeys = keys[self.order]
+
+    # Multi-label rows are compared as single
+    # opaque (void) items, so that one
+    # searchsorted covers both cases.
+    def rowKeys(self, y):
+        y = np.asarray(y, dtype=float) + 0.0
+        if y.ndim < 2:
+            return y.reshape(-1)
+        y = np.ascontiguousarray(y)
+        return y.view(np.dtype((np.void, y.dtype.itemsize*y.shape[1]))).reshape(-1)
+
     def transform(self,y):
-        Cl = np.zeros(y.shape[0])
-        for j in range(len(y)):
-            Cl[j] = self.totalClass.index(np.array(y[j]).tolist())
-        return Cl
+        keys = self.rowKeys(y)
+        idx = np.searchsorted(self.sortedKeys, keys)
+        idx[idx == self.sortedKeys.size] = 0
+        if not np.all(self.sortedKeys[idx] == keys):
+            raise ValueError("Label not in the list of classes of the encoder")
+        return self.order[idx].astype(float)
     
     def inverse_transform(self,a):
-        return [self.totalClass[int(a)]]
+        if np.ndim(a) == 0:
+            return [self.totalClass[int(a)]]
+        return self.classes[np.asarray(a, dtype=int)]
+
+    def __getstate__(self):
+        return {'totalClass' : self.totalClass}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.makeLookup()
 
     def classes_(self):
         return self.totalClass
+
+#************************************
+# ModelBundle
+# Model, spectral range, label encoder,
+# normalizer and configuration loaded
+# once and shared by all predictions.
+#************************************
+class ModelBundle(object):
+    maxPlans = 8    # x-axes kept in the plan cache
+
+    def __init__(self, dP):
+        self.dP = dP
+        self.model = None
+        self.En = pickle.loads(open(dP.spectral_range, "rb").read())
+        if dP.regressor:
+            self.le = None
+        else:
+            self.le = pickle.loads(open(dP.model_le, "rb").read())
+        if dP.normalize:
+            self.norm = Normalizer()
+        else:
+            self.norm = None
+        self.plans = OrderedDict()
+        self.plansLock = threading.Lock()
+        # Per-spectrum messages (off when serving)
+        self.verbose = True
+
+    def loadModel(self):
+        if self.model is None:
+            if self.dP.useTFKeras:
+                import tensorflow.keras as keras  #tf.keras
+            else:
+                import keras   # pure Keras
+            self.model = keras.models.load_model(self.dP.modelName)
+        return self.model
+
+    # Interpolation plans are cached per x-axis:
+    # spectra from the same instrument share one.
+    # Least recently used plans beyond maxPlans
+    # are dropped, as clients may post any axis.
+    def getPlan(self, Rx):
+        key = np.asarray(Rx, dtype=float).tobytes()
+        with self.plansLock:
+            plan = self.plans.pop(key, None)
+            if plan is None:
+                if not self.verbose:
+                    print('  New x-axis: rescaling from',str(len(Rx)),'to',str(len(self.En)))
+                plan = InterpPlan(Rx, self.En)
+                if len(self.plans) >= self.maxPlans:
+                    self.plans.popitem(last=False)
+            self.plans[key] = plan
+        return plan
+
+    # Rtot as read by np.loadtxt(unpack=True): x-axis in row 0,
+    # intensities in row 1. Returns a (1, len(En)) spectrum.
+    def resample(self, Rtot):
+        R = np.array([Rtot[1,:]])
+        if self.norm is not None:
+            R = self.norm.transform_single(R)
+        if(R.shape[1] != len(self.En)):
+            if self.verbose:
+                print('  Rescaling x-axis from',str(R.shape[1]),'to',str(len(self.En)))
+            R = self.getPlan(Rtot[0,:])(R)
+        return R
+
+#************************************
+# InterpPlan
+# Index/weight tables for linear
+# interpolation from Rx onto En. Same
+# result as np.interp (end values held),
+# applied to one or many spectra at once.
+#************************************
+class InterpPlan(object):
+    def __init__(self, Rx, En):
+        Rx = np.asarray(Rx, dtype=float)
+        En = np.asarray(En, dtype=float)
+        if Rx.size < 2:
+            self.idx0 = np.zeros(En.size, dtype=int)
+            self.idx1 = self.idx0
+            self.w = np.zeros(En.size)
+            return
+        self.idx0 = np.clip(np.searchsorted(Rx, En, side='right')-1, 0, Rx.size-2)
+        self.idx1 = self.idx0+1
+        dx = Rx[self.idx1] - Rx[self.idx0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w = np.where(dx > 0, (En - Rx[self.idx0])/dx, 0)
+        self.w = np.clip(w, 0, 1)
+
+    def __call__(self, R):
+        R = np.asarray(R)
+        return R[...,self.idx0]*(1-self.w) + R[...,self.idx1]*self.w
+
+#************************************
+# PredictionServer
+# Keeps a ModelBundle warm and serves
+# predictions over HTTP (TCP port) or
+# a Unix socket (path). Spectra from
+# concurrent requests are grouped into
+# micro-batches: the first request waits
+# at most server_batch_wait seconds for
+# others, up to predict_batch_size.
+#************************************
+class PredictionServer(object):
+    def __init__(self, mB, formatInput=None):
+        self.mB = mB
+        mB.verbose = False
+        self.formatInput = formatInput
+        self.maxBatch = mB.dP.predict_batch_size
+        self.maxWait = mB.dP.server_batch_wait
+        self.requests = queue.Queue()
+        self.ready = threading.Event()
+        self.error = None
+
+    def serve(self, address):
+        worker = threading.Thread(target=self.batchWorker)
+        worker.daemon = True
+        worker.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+
+        handler = makePredictionHandler(self)
+        if str(address).isdigit():
+            server = ThreadingHTTPServer(('127.0.0.1', int(address)), handler)
+            print(" Prediction server listening on http://127.0.0.1:"+str(address)+"\n")
+        else:
+            if os.path.exists(address):
+                os.remove(address)
+            server = ThreadingUnixHTTPServer(address, handler)
+            print(" Prediction server listening on unix socket:", address, "\n")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\n Prediction server stopped\n")
+        finally:
+            server.server_close()
+            if not str(address).isdigit() and os.path.exists(address):
+                os.remove(address)
+
+    # Called from the request threads: queue
+    # the spectra and wait for the worker.
+    def predict(self, spectra):
+        x = np.vstack([self.mB.resample(Rtot) for Rtot in spectra])
+        job = {'x' : x, 'done' : threading.Event()}
+        self.requests.put(job)
+        # A dead worker will not serve the job
+        while not job['done'].wait(1):
+            if self.error is not None:
+                raise self.error
+        if 'error' in job:
+            raise job['error']
+        return self.formatResults(job['pred'])
+
+    # Single thread owning the model: Keras
+    # models are not safe to share across threads.
+    def batchWorker(self):
+        try:
+            model = self.mB.loadModel()
+        except Exception as e:
+            self.error = e
+            return
+        finally:
+            self.ready.set()
+        jobs = []
+        try:
+            self.batchLoop(model, jobs)
+        except BaseException as e:
+            self.error = RuntimeError("Prediction worker stopped: " + repr(e))
+            self.failPending(jobs)
+
+    def batchLoop(self, model, jobs):
+        while True:
+            jobs[:] = [self.requests.get()]
+            size = jobs[0]['x'].shape[0]
+            deadline = time.time() + self.maxWait
+            while size < self.maxBatch:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    jobs.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                size += jobs[-1]['x'].shape[0]
+            try:
+                x = np.vstack([job['x'] for job in jobs])
+                if self.formatInput is not None:
+                    x = self.formatInput(x, self.mB.En)
+                pred = model.predict(x, batch_size=self.maxBatch)
+                start = 0
+                for job in jobs:
+                    job['pred'] = pred[start:start+job['x'].shape[0]]
+                    start += job['x'].shape[0]
+            except Exception as e:
+                for job in jobs:
+                    job['error'] = e
+            for job in jobs:
+                job['done'].set()
+
+    # Fail jobs held by the worker or still queued
+    def failPending(self, jobs):
+        while True:
+            for job in jobs:
+                job['error'] = self.error
+                job['done'].set()
+            try:
+                jobs = [self.requests.get_nowait()]
+            except queue.Empty:
+                break
+
+    def formatResults(self, pred):
+        if self.mB.le is None:
+            return [{'value' : float(p[0])} for p in pred]
+        results = []
+        top = np.argsort(pred, axis=1)[:,::-1][:,:5]
+        for i in range(pred.shape[0]):
+            classes = self.mB.le.inverse_transform(top[i])
+            results.append({'class' : float(classes[0]),
+                'probability' : float(100*pred[i,top[i,0]]),
+                'top' : [[float(c), float(100*pred[i,j])] for c, j in zip(classes, top[i])]})
+        return results
+
+    def info(self):
+        return {'model' : self.mB.dP.modelName,
+            'regressor' : self.mB.dP.regressor,
+            'points' : int(len(self.mB.En)),
+            'maxBatch' : self.maxBatch}
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+#************************************
+# HTTP request handler
+# POST /predict with JSON:
+#   {"x": [...], "y": [...]} or
+#   {"spectra": [{"x": [...], "y": [...]}, ...]}
+# x can be omitted if y is already on the
+# training grid. GET /info describes the model.
+#************************************
+def makePredictionHandler(pS):
+    class PredictionHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') == '/info':
+                self.reply(200, pS.info())
+            else:
+                self.reply(404, {'error' : 'Unknown path: '+self.path})
+
+        def do_POST(self):
+            if self.path.rstrip('/') != '/predict':
+                self.reply(404, {'error' : 'Unknown path: '+self.path})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                data = json.loads(self.rfile.read(length).decode())
+                spectra = data['spectra'] if 'spectra' in data else [data]
+                Rtot = []
+                for s in spectra:
+                    y = np.asarray(s['y'], dtype=float)
+                    x = np.asarray(s['x'], dtype=float) if 'x' in s else pS.mB.En
+                    Rtot.append(np.vstack((x, y)))
+            except Exception as e:
+                self.reply(400, {'error' : 'Malformed request: '+str(e)})
+                return
+            try:
+                self.reply(200, {'predictions' : pS.predict(Rtot)})
+            except Exception as e:
+                self.reply(500, {'error' : str(e)})
+
+        def reply(self, code, obj):
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # Unix socket clients have no address
+        def address_string(self):
+            return str(self.client_address[0]) if self.client_address else 'local'
+
+        def log_message(self, format, *args):
+            pass
+
+    return PredictionHandler
+
+#************************************
+# SpectraAugmenter
+# Random variants of a batch of spectra,
+# generated while training (LearnStream)
+# instead of stored in augmented files.
+# Each effect (horizontal shift, noise,
+# vertical offset, linear background)
+# is applied to a spectrum with its own
+# probability; amplitudes are relative
+# to the maximum of each spectrum.
+#************************************
+class SpectraAugmenter(object):
+    def __init__(self, dP, En, seed=None):
+        self.dP = dP
+        self.En = np.asarray(En, dtype=float)
+        self.rng = np.random.default_rng(seed)
+        span = self.En[-1] - self.En[0]
+        self.slope = (self.En - self.En[0])/span if span != 0 else np.zeros(self.En.size)
+
+    def select(self, prob, n):
+        if prob <= 0:
+            return np.zeros(n, dtype=bool)
+        return self.rng.random(n) < prob
+
+    def __call__(self, A):
+        dP = self.dP
+        A = np.array(A, dtype=float)
+        n = A.shape[0]
+        rmax = np.amax(A, axis=1, keepdims=True)
+
+        sel = self.select(dP.aug_shift_prob, n)
+        if sel.any():
+            shifts = dP.aug_shift*self.rng.uniform(-1, 1, sel.sum())
+            A[sel] = shiftSpectra(A[sel], self.En, shifts)
+
+        sel = self.select(dP.aug_noise_prob, n)
+        if sel.any():
+            A[sel] += dP.aug_noise*rmax[sel]*self.rng.uniform(-1, 1, (sel.sum(), A.shape[1]))
+
+        sel = self.select(dP.aug_offset_prob, n)
+        if sel.any():
+            A[sel] += dP.aug_offset*rmax[sel]*self.rng.uniform(-1, 1, (sel.sum(), 1))
+
+        sel = self.select(dP.aug_background_prob, n)
+        if sel.any():
+            A[sel] += dP.aug_background*rmax[sel]*self.rng.uniform(-1, 1, (sel.sum(), 1))*self.slope
+        return A
+
+#************************************
+# Shift each spectrum along En by its
+# own amount (zero outside the range),
+# as np.interp(En, En+shift, R) per row.
+# On a regular axis each row needs an
+# integer offset and a weight only, so
+# rows are resampled at once from a
+# padded window view.
+#************************************
+def shiftSpectra(A, En, shifts, out=None, chunkRows=4096):
+    En = np.asarray(En, dtype=float)
+    shifts = np.broadcast_to(np.asarray(shifts, dtype=float), (A.shape[0],))
+    if out is None:
+        out = np.empty(A.shape, dtype=np.result_type(A.dtype, np.float32))
+    P = En.size
+    dE = (En[-1] - En[0])/(P-1)
+    if not np.allclose(np.diff(En), dE, rtol=1e-9, atol=0):
+        # Irregular energy axis: interpolate row by row
+        for i in range(A.shape[0]):
+            out[i] = np.interp(En, En+shifts[i], A[i], left = 0, right = 0)
+        return out
+    cols = np.arange(P)
+    for i in range(0, A.shape[0], chunkRows):
+        # Tables: whole-point offset k, weight f, valid columns [lo,hi)
+        q = -shifts[i:i+chunkRows]/dE
+        k = np.clip(np.floor(q), -P, P).astype(int)
+        f = (q - k)[:,None]
+        lo = np.clip(np.ceil(-q), 0, P)[:,None]
+        hi = np.clip(np.floor(P-1-q)+1, 0, P)[:,None]
+        K = int(np.abs(k).max())+1
+        Ap = np.zeros((k.size, P+2*K), dtype=out.dtype)
+        Ap[:,K:K+P] = A[i:i+chunkRows]
+        V = sliding_window_view(Ap, P, axis=1)
+        rows = np.arange(k.size)
+        S = V[rows,K+k]
+        S1 = V[rows,K+k+1]
+        S1 -= S
+        S1 *= f
+        S += S1
+        S[(cols < lo) | (cols >= hi)] = 0
+        out[i:i+chunkRows] = S
+    return out
+
+#************************************
+# LearnStream
+# Endless generator of training batches
+# for fit_generator. A can be a memmap or
+# a LazyMatrix: rows [0,stop) are read in
+# contiguous blocks of chunkRows, taken in
+# random order and shuffled within a
+# buffer of bufferRows, so only the buffer
+# is held in memory. Labels are one-hot
+# encoded per batch when numClasses is
+# given; augmentation, normalization and
+# formatInput are applied per batch too.
+#************************************
+class LearnStream(object):
+    def __init__(self, A, Cl, batch_size, En, numClasses=None, norm=None, aug=None,
+            formatInput=None, stop=None, bufferRows=16384, chunkRows=4096, seed=None):
+        self.A = A
+        self.Cl = np.asarray(Cl)
+        self.batch_size = batch_size
+        self.En = En
+        self.numClasses = numClasses
+        self.norm = norm
+        self.aug = aug
+        self.formatInput = formatInput
+        self.rows = A.shape[0] if stop is None else stop
+        self.chunkRows = min(chunkRows, max(bufferRows, 1))
+        self.bufferRows = max(bufferRows, batch_size)
+        self.rng = aug.rng if aug is not None else np.random.default_rng(seed)
+
+    def __len__(self):
+        return int(np.ceil(self.rows/self.batch_size))
+
+    def __iter__(self):
+        while True:
+            for batch in self.epoch():
+                yield batch
+
+    def epoch(self):
+        starts = self.rng.permutation(np.arange(0, self.rows, self.chunkRows))
+        bufA = []
+        bufCl = []
+        nBuf = 0
+        for n, i in enumerate(starts):
+            j = min(i+self.chunkRows, self.rows)
+            bufA.append(np.asarray(self.A[i:j]))
+            bufCl.append(self.Cl[i:j])
+            nBuf += j-i
+            if nBuf < self.bufferRows and n < starts.size-1:
+                continue
+            A = np.concatenate(bufA)
+            Cl = np.concatenate(bufCl)
+            order = self.rng.permutation(nBuf)
+            # Rows short of a full batch are carried to the next buffer
+            full = nBuf if n == starts.size-1 else nBuf - nBuf % self.batch_size
+            for k in range(0, full, self.batch_size):
+                ind = order[k:min(k+self.batch_size, full)]
+                yield self.batch(A[ind], Cl[ind])
+            bufA = [A[order[full:]]]
+            bufCl = [Cl[order[full:]]]
+            nBuf -= full
+
+    # Augmented before normalizing, as prediction inputs are
+    def batch(self, A, Cl):
+        if self.aug is not None:
+            A = self.aug(A)
+        if self.norm is not None:
+            A = self.norm.transform_matrix(A, out=A if A.dtype.kind == 'f' else None)
+        if self.formatInput is not None:
+            A = self.formatInput(A, self.En)
+        if self.numClasses is not None:
+            Y = np.zeros((Cl.shape[0], self.numClasses), dtype=np.float32)
+            Y[np.arange(Cl.shape[0]), Cl.astype(int)] = 1
+            Cl = Y
+        return A, Cl
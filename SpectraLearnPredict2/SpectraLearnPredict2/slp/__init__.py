@@ -25,4 +25,6 @@ from .slp_svm import *
 from .slp_pca import *
 from .slp_kmeans import *
 from .slp_dnntf import *
+from .slp_predict import *
+from .slp_cache import *
 
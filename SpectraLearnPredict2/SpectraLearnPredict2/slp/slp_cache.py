@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+**********************************************************
+*
+* SpectraLearnPredict2 - model cache
+* Perform Machine Learning on Spectroscopy Data.
+*
+* Uses: Deep Neural Networks, TensorFlow, SVM, PCA, K-Means
+*
+* By: Nicola Ferralis <feranick@hotmail.com>
+*
+***********************************************************
+'''
+
+import numpy as np
+import os, time, json, shutil, hashlib
+from contextlib import contextmanager
+
+from .slp_config import *
+
+#**********************************************
+''' Content-addressed model cache
+    Trained models are stored in sysDef.modelCacheDir,
+    one entry (directory) per key: a hash of the
+    training data, the preprocessing settings and
+    the backend hyperparameters. Identical runs
+    reuse the entry, any change trains a new one.
+    manifest.json records size and last use of the
+    entries; the least recently used are removed
+    beyond sysDef.modelCacheSize (MB). '''
+#**********************************************
+class ModelCache():
+    def __init__(self, directory=None, maxSize=None):
+        if directory is None:
+            directory = sysDef.modelCacheDir
+        if maxSize is None:
+            maxSize = sysDef.modelCacheSize
+        self.directory = directory
+        self.maxSize = maxSize * 2**20
+        self.manifestFile = os.path.join(directory, 'manifest.json')
+        os.makedirs(directory, exist_ok=True)
+
+    # Entry directory for key. Entries missing from the
+    # manifest (interrupted runs) or fresh ones start empty.
+    def entry(self, backend, key, fresh=False):
+        path = os.path.join(self.directory, backend + '-' + key[:24])
+        with self.manifest() as m:
+            if fresh or key not in m:
+                m.pop(key, None)
+                shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    # Record the entry as used once its model is saved
+    def commit(self, backend, key, path, info=''):
+        with self.manifest() as m:
+            now = time.time()
+            e = m.setdefault(key, {'backend' : backend, 'path' : os.path.basename(path),
+                'created' : now, 'info' : info})
+            e['size'] = entrySize(path)
+            e['lastUsed'] = now
+            self.evict(m, key)
+
+    def evict(self, m, keep):
+        total = sum(e['size'] for e in m.values())
+        for key in sorted(m, key=lambda k: m[k]['lastUsed']):
+            if total <= self.maxSize:
+                break
+            if key != keep:
+                print('  Model cache: removing ' + m[key]['path'])
+                shutil.rmtree(os.path.join(self.directory, m[key]['path']), ignore_errors=True)
+                total -= m.pop(key)['size']
+
+    # Manifest read and rewritten under a lock, as
+    # concurrent trainings share it
+    @contextmanager
+    def manifest(self):
+        with open(self.manifestFile + '.lock', 'w') as lock:
+            try:
+                import fcntl
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            except ImportError:
+                pass
+            try:
+                with open(self.manifestFile) as f:
+                    m = json.load(f)
+            except (OSError, ValueError):
+                m = {}
+            yield m
+            with open(self.manifestFile + '.tmp', 'w') as f:
+                json.dump(m, f, indent=1)
+            os.replace(self.manifestFile + '.tmp', self.manifestFile)
+
+def entrySize(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return size
+
+#**********************************************
+''' Cache key of a model '''
+#**********************************************
+# Settings not affecting the trained model
+volatileParams = ('run', 'always', 'plot', 'show', 'print', 'log', 'time', 'tb',
+    'threshold', 'valMonitor', 'config')
+
+def modelParams(defClass):
+    return {k : v for k, v in vars(defClass).items() if not k.startswith('_')
+        and not k.startswith(volatileParams)
+        and isinstance(v, (bool, int, float, str, list, tuple, dict, type(None)))}
+
+def modelKey(backend, defClass, *data):
+    h = hashlib.sha256(backend.encode())
+    for a in data:
+        a = np.asarray(a)
+        h.update(str((a.dtype.str, a.shape)).encode())
+        if a.dtype.hasobject:
+            h.update(repr(a.tolist()).encode())
+        else:
+            h.update(np.ascontiguousarray(a).data)
+    h.update(repr(sorted(modelParams(preprocDef).items())).encode())
+    h.update(repr(sorted(modelParams(defClass).items())).encode())
+    return h.hexdigest()
+
+#**********************************************
+''' Cache entry for a backend, or None
+    when the cache is disabled. The model
+    files go in entry.path; entry.commit()
+    once saved. '''
+#**********************************************
+class CachedModel():
+    def __init__(self, backend, defClass, A, Cl, A_test, Cl_test, fresh=False):
+        self.cache = ModelCache()
+        self.backend = backend
+        self.key = modelKey(backend, defClass, A, Cl, A_test, Cl_test)
+        self.path = self.cache.entry(backend, self.key, fresh)
+        print('  Model cache entry: ' + self.path + '\n')
+
+    def commit(self, info=''):
+        self.cache.commit(self.backend, self.key, self.path, info)
+
+def cachedModel(backend, defClass, A, Cl, A_test, Cl_test, fresh=False):
+    if sysDef.modelCache == False:
+        return None
+    return CachedModel(backend, defClass, A, Cl, A_test, Cl_test, fresh)
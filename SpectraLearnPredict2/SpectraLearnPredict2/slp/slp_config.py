@@ -45,6 +45,8 @@ class Configuration():
             'StandardScalerFlag' : False,
             'subsetCrossValid' : False,
             'percentCrossValid' : 0.01,
+            'kFold' : 0,
+            'stratifiedKFold' : True,
             'YnormTo' : 1,
             'YnormX' : 1600,
             'YnormXdelta' : 30,
@@ -129,6 +131,10 @@ class Configuration():
             'thresholdProbabilityPredSVM' : 3,
             'CfactorSVM' : 20,
             'kernelSVM' : "rbf",
+            'modeSVM' : "svc",
+            'calibrationSVM' : "cv",
+            'gammaSVM' : "auto",
+            'componentsSVM' : 1000,
             'showClassesSVM' : False,
             'plotMapSVM' : True,
             'classReportSVM' : False,
@@ -148,6 +154,8 @@ class Configuration():
             'numComponentsKM' : 20,
             'plotKM' : False,
             'plotMapKM' : True,
+            'miniBatchKM' : False,
+            'batchSizeKM' : 1024,
             }
 
     def tfDef(self):
@@ -182,6 +190,13 @@ class Configuration():
             'useAllCores' : False,
             'numCores' : 2,
             'fractionGPUmemory' : 1,
+            'mapChunkRows' : 4096,
+            'mapCache' : False,
+            'concurrentTraining' : False,
+            'backendCores' : {'dnntf' : 4, 'keras' : 4, 'nn' : 2, 'svm' : 1, 'tf' : 4},
+            'modelCache' : True,
+            'modelCacheDir' : 'model-cache',
+            'modelCacheSize' : 2048,
             }
 
     # Read configuration file into usable variables
@@ -204,6 +219,8 @@ class Configuration():
         self.StandardScalerFlag = self.conf.getboolean('Preprocessing','StandardScalerFlag')
         self.subsetCrossValid = self.conf.getboolean('Preprocessing','subsetCrossValid')
         self.percentCrossValid = self.conf.getfloat('Preprocessing','percentCrossValid')
+        self.kFold = self.conf.getint('Preprocessing','kFold', fallback=0)
+        self.stratifiedKFold = self.conf.getboolean('Preprocessing','stratifiedKFold', fallback=True)
         self.YnormTo = self.conf.getfloat('Preprocessing','YnormTo')
         self.YnormX = self.conf.getfloat('Preprocessing','YnormX')
         self.YnormXdelta = self.conf.getfloat('Preprocessing','YnormXdelta')
@@ -276,6 +293,10 @@ class Configuration():
         self.thresholdProbabilityPredSVM = self.conf.getfloat('SVM','thresholdProbabilityPredSVM')
         self.CfactorSVM = self.conf.getfloat('SVM','CfactorSVM')
         self.kernelSVM = self.svmDef['kernelSVM']
+        self.modeSVM = self.conf.get('SVM','modeSVM', fallback='svc')
+        self.calibrationSVM = self.conf.get('SVM','calibrationSVM', fallback='cv')
+        self.gammaSVM = self.conf.get('SVM','gammaSVM', fallback='auto')
+        self.componentsSVM = self.conf.getint('SVM','componentsSVM', fallback=1000)
         self.showClassesSVM = self.conf.getboolean('SVM','showClassesSVM')
         self.plotMapSVM = self.conf.getboolean('SVM','plotMapSVM')
         self.classReportSVM = self.conf.getboolean('SVM','classReportSVM')
@@ -289,6 +310,8 @@ class Configuration():
         self.numComponentsKM = self.conf.getint('KMeans','numComponentsKM')
         self.plotKM = self.conf.getboolean('KMeans','plotKM')
         self.plotMapKM = self.conf.getboolean('KMeans','plotMapKM')
+        self.miniBatchKM = self.conf.getboolean('KMeans','miniBatchKM', fallback=False)
+        self.batchSizeKM = self.conf.getint('KMeans','batchSizeKM', fallback=1024)
         
         self.runTF = self.conf.getboolean('TensorFlow','runTF')
         self.alwaysRetrainTF = self.conf.getboolean('TensorFlow','alwaysRetrainTF')
@@ -314,6 +337,13 @@ class Configuration():
         self.useAllCores = self.conf.getboolean('System','useAllCores')
         self.numCores = self.conf.getint('System','numCores')
         self.fractionGPUmemory = eval(self.sysDef['fractionGPUmemory'])
+        self.mapChunkRows = self.conf.getint('System','mapChunkRows', fallback=4096)
+        self.mapCache = self.conf.getboolean('System','mapCache', fallback=False)
+        self.concurrentTraining = self.conf.getboolean('System','concurrentTraining', fallback=False)
+        self.backendCores = eval(self.conf.get('System','backendCores', fallback="{}"))
+        self.modelCache = self.conf.getboolean('System','modelCache', fallback=True)
+        self.modelCacheDir = self.conf.get('System','modelCacheDir', fallback='model-cache')
+        self.modelCacheSize = self.conf.getint('System','modelCacheSize', fallback=2048)
 
     # Create configuration file
     def createConfig(self):
@@ -346,6 +376,8 @@ class preprocDef:
 
     subsetCrossValid = config.subsetCrossValid
     percentCrossValid = config.percentCrossValid  # proportion of TEST data for cross validation
+    kFold = config.kFold  # k-fold cross validation in train mode if > 1 (folds run in parallel with multiProc)
+    stratifiedKFold = config.stratifiedKFold
 
     YnormTo = config.YnormTo
     YnormX = config.YnormX
@@ -645,6 +677,15 @@ class svmDef:
     
     Cfactor = config.CfactorSVM
     kernel = config.kernelSVM
+
+    ''' mode: 'svc' (kernel SVM), 'linear', 'nystroem' or 'rff'
+        (approximate RBF features + linear SVM, for large sets)
+        calibration of probabilities: 'cv', 'holdout' or 'none'
+        (none is used when classes are too small, see fitSVM) '''
+    mode = config.modeSVM
+    calibration = config.calibrationSVM
+    gamma = config.gammaSVM
+    components = config.componentsSVM
     showClasses = config.showClassesSVM
 
     plotMap = config.plotMapSVM
@@ -673,6 +714,8 @@ class kmDef:
     numKMcomponents = config.numComponentsKM
     plotKM = config.plotKM
     plotMap = config.plotMapKM
+    miniBatchKM = config.miniBatchKM  # MiniBatchKMeans for very large maps
+    batchSizeKM = config.batchSizeKM
 
 #**********************************************
 ''' TensorFlow '''
@@ -737,4 +780,13 @@ class sysDef:
     fractionGPUmemory = config.fractionGPUmemory
     print(" GPU memory reserved (if GPU is used) = ", str(fractionGPUmemory*100), "%\n")
 
+    mapChunkRows = config.mapChunkRows  # pixels per block when streaming maps
+    mapCache = config.mapCache  # convert text maps once into a .npy cache
+    concurrentTraining = config.concurrentTraining  # train backends in parallel processes
+    backendCores = config.backendCores  # cores pinned to each backend when concurrent
+    backendThreads = 0  # thread limit of a backend process (set by concurrent training)
+    modelCache = config.modelCache  # reuse models trained on identical data and settings
+    modelCacheDir = config.modelCacheDir
+    modelCacheSize = config.modelCacheSize  # MB, least recently used models removed beyond
+
 
@@ -25,6 +25,8 @@ from os import rename
 from datetime import datetime, date
 
 from .slp_config import *
+from .slp_preprocess import *
+from .slp_cache import *
 
 #**********************************************
 ''' Format input data for Estimator '''
@@ -51,8 +53,13 @@ def trainDNNTF(A, Cl, A_test, Cl_test, Root):
     if dnntfDef.logCheckpoint == True:
         tf.logging.set_verbosity(tf.logging.INFO)
     
+    cache = None
     if dnntfDef.alwaysRetrain == False:
-        model_directory = "./DNN-TF_" + str(len(dnntfDef.hidden_layers))+"HL_"+str(dnntfDef.hidden_layers[0])
+        cache = cachedModel('dnntf', dnntfDef, A, Cl, A_test, Cl_test)
+        if cache is None:
+            model_directory = "./DNN-TF_" + str(len(dnntfDef.hidden_layers))+"HL_"+str(dnntfDef.hidden_layers[0])
+        else:
+            model_directory = os.path.join(cache.path, 'model')
         print("\n  Training model saved in: ", model_directory, "\n")
     else:
         dnntfDef.alwaysImprove = True
@@ -78,8 +85,10 @@ def trainDNNTF(A, Cl, A_test, Cl_test, Root):
         Cl2 = le.transform(Cl)
         Cl2_test = le.transform(Cl_test)
         model_le = "dnntf_le.pkl"
+        if cache is not None:
+            model_le = os.path.join(cache.path, model_le)
         print("\n Label Encoder saved in:", model_le)
-        with open(model_le, 'ab') as f:
+        with open(model_le, 'wb') as f:
             f.write(pickle.dumps(le))
     else:
         le = 0
@@ -133,7 +142,7 @@ def trainDNNTF(A, Cl, A_test, Cl_test, Root):
 
     # Use this to restrict GPU memory allocation in TF
     opts = tf.GPUOptions(per_process_gpu_memory_fraction=sysDef.fractionGPUmemory)
-    conf = tf.ConfigProto(gpu_options=opts)
+    conf = limitThreadsTF(tf.ConfigProto(gpu_options=opts))
     #conf.gpu_options.allow_growth = True
     
     ###############################
@@ -216,6 +225,8 @@ def trainDNNTF(A, Cl, A_test, Cl_test, Root):
     print("  Global step: {:.2f}\n".format(accuracy_score["global_step"]))
     print('  ==================================\n')
 
+    if cache is not None:
+        cache.commit(Root)
     return clf, le
 
 def printInfo(A):
@@ -251,49 +262,30 @@ def printInfo(A):
     model via TensorFlow '''
 #********************************************************************************
 def predDNNTF(clf, le, R, Cl):
-    import tensorflow as tf
-    #import tensorflow.contrib.learn as skflow
-    from sklearn import preprocessing
+    pred = predDNNTFBatch(clf, le, R, Cl)
+    printPrediction(pred)
+    return pred.value[0], pred.prob[0]
 
+#********************************************************************************
+''' Batch prediction - tf.estimator '''
+#********************************************************************************
+def predDNNTFBatch(clf, le, R, Cl):
+    import tensorflow as tf
     predict_input_fn = tf.estimator.inputs.numpy_input_fn(
       x={"x": R},
       num_epochs=1,
       shuffle=False)
-      
+
     predictions = list(clf.predict(input_fn=predict_input_fn))
     if dnntfDef.useRegressor == False:
-        pred_class = [p["class_ids"] for p in predictions][0][0]
-    
-        if pred_class.size >0:
-            predValue = le.inverse_transform([pred_class])[0]
-        else:
-            predValue = 0
-        prob = [p["probabilities"] for p in predictions][0]
-        predProb = round(100*prob[pred_class],2)
-        rosterPred = np.where(prob>dnntfDef.thresholdProbabilityPred/100)[0]
-        print('\n  =============================================')
-        print('  \033[1mtf.DNN Classifier-TF\033[0m - Probability >',str(dnntfDef.thresholdProbabilityPred),'%')
-        print('  =============================================')
-        print('  Prediction\tProbability [%]')
-        for i in range(rosterPred.shape[0]):
-            print(' ',str(np.unique(Cl)[rosterPred][i]),'\t\t',str('{:.4f}'.format(100*prob[rosterPred][i])))
-        print('  =============================================')
-    
-        print('\033[1m' + '\n Predicted value (tf.DNNClassifier) = ' + str(predValue) +
-            '  (probability = ' + str(predProb) + '%)\033[0m\n')
+        pred_class = np.array([p["class_ids"][0] for p in predictions])
+        prob = np.array([p["probabilities"] for p in predictions])
+        return Prediction('tf.DNNClassifier', le.inverse_transform(pred_class),
+            np.round(100*prob[np.arange(R.shape[0]),pred_class],2), prob,
+            le.classes_, dnntfDef.thresholdProbabilityPred)
     else:
-        pred = [p["predictions"] for p in predictions][0][0]
-        predProb = 0
-        if pred.size >0:
-            predValue = pred
-        else:
-            predValue = 0
-        print('\n  ==================================')
-        print('  \033[1mtf.DNN Regressor - TF\033[0m')
-        print('  ==================================')
-        print('\033[1m' + '\n Predicted value (tf.DNNRegressor) = ' + str(predValue) +'\033[0m\n')
-
-    return predValue, predProb
+        return Prediction('tf.DNNRegressor', np.array([p["predictions"][0] for p in predictions]),
+            np.zeros(R.shape[0]))
 
 #********************************************************************************
 ''' TensorFlow '''
@@ -317,8 +309,13 @@ def trainDNNTF2(A, Cl, A_test, Cl_test, Root):
     if dnntfDef.logCheckpoint ==True:
         tf.logging.set_verbosity(tf.logging.INFO)
     
+    cache = None
     if dnntfDef.alwaysRetrain == False:
-        model_directory = "./DNN-TF-SK_" + str(len(dnntfDef.hidden_layers))+"HL_"+str(dnntfDef.hidden_layers[0])
+        cache = cachedModel('dnntf-sk', dnntfDef, A, Cl, A_test, Cl_test)
+        if cache is None:
+            model_directory = "./DNN-TF-SK_" + str(len(dnntfDef.hidden_layers))+"HL_"+str(dnntfDef.hidden_layers[0])
+        else:
+            model_directory = os.path.join(cache.path, 'model')
         print("\n  Training model saved in: ", model_directory, "\n")
     else:
         dnntfDef.alwaysImprove = True
@@ -340,8 +337,10 @@ def trainDNNTF2(A, Cl, A_test, Cl_test, Root):
     Cl2 = le.transform(Cl)
     Cl2_test = le.transform(Cl_test)
     model_le = "dnntf_le.pkl"
+    if cache is not None:
+        model_le = os.path.join(cache.path, model_le)
     print("\n Label Encoder saved in:", model_le)
-    with open(model_le, 'ab') as f:
+    with open(model_le, 'wb') as f:
         f.write(pickle.dumps(le))
     
     validation_monitor = skflow.monitors.ValidationMonitor(input_fn=lambda: input_fn(A_test, Cl2_test),
@@ -360,7 +359,8 @@ def trainDNNTF2(A, Cl, A_test, Cl_test, Root):
     clf = skflow.DNNClassifier(feature_columns=feature_columns, hidden_units=dnntfDef.hidden_layers,
             optimizer=dnntfDef.optimizer, n_classes=numTotClasses,
             activation_fn=dnntfDef.activationFn, model_dir=model_directory,
-            config=tf.estimator.RunConfig().replace(save_summary_steps=dnntfDef.timeCheckpoint),
+            config=tf.estimator.RunConfig().replace(session_config=limitThreadsTF(tf.ConfigProto()),
+                save_summary_steps=dnntfDef.timeCheckpoint),
             dropout=dnntfDef.dropout_perc)
     print("\n Number of global steps:",dnntfDef.trainingSteps)
 
@@ -383,39 +383,28 @@ def trainDNNTF2(A, Cl, A_test, Cl_test, Root):
     print("  Global step: {:.2f}\n".format(accuracy_score["global_step"]))
     print('  ===================================\n')
 
+    if cache is not None:
+        cache.commit(Root)
     return clf, le
 
 #********************************************************************************
 ''' Predict using DNNClassifier model via TensorFlow-skflow '''
 #********************************************************************************
 def predDNNTF2(clf, le, R, Cl):
-    import tensorflow as tf
-    import tensorflow.contrib.learn as skflow
-    from sklearn import preprocessing
+    pred = predDNNTF2Batch(clf, le, R, Cl)
+    printPrediction(pred)
+    return pred.value[0], pred.prob[0]
 
-    #**********************************************
-    ''' Predict '''
-    #**********************************************
+#********************************************************************************
+''' Batch prediction - TensorFlow-skflow '''
+#********************************************************************************
+def predDNNTF2Batch(clf, le, R, Cl):
+    import tensorflow as tf
     def input_fn_predict():
-        x = tf.constant(R.astype(np.float32))
-        return x
-
-    pred_class = list(clf.predict_classes(input_fn=input_fn_predict))[0]
-    predValue = le.inverse_transform(pred_class)
-    prob = list(clf.predict_proba(input_fn=input_fn_predict))[0]
-    predProb = round(100*prob[pred_class],2)
-    
-    rosterPred = np.where(prob>dnntfDef.thresholdProbabilityPred/100)[0]
-    
-    print('\n  ===================================')
-    print('  \033[1msk-DNN-TF\033[0m - Probability >',str(dnntfDef.thresholdProbabilityPred),'%')
-    print('  ===================================')
-    print('  Prediction\tProbability [%]')
-    for i in range(rosterPred.shape[0]):
-        print(' ',str(np.unique(Cl)[rosterPred][i]),'\t\t',str('{:.4f}'.format(100*prob[rosterPred][i])))
-    print('  ===================================')
-    
-    print('\033[1m' + '\n Predicted value (skflow.DNNClassifier) = ' + predValue +
-          '  (probability = ' + str(predProb) + '%)\033[0m\n')
+        return tf.constant(R.astype(np.float32))
 
-    return predValue, predProb
+    prob = np.array(list(clf.predict_proba(input_fn=input_fn_predict)))
+    pred_class = np.argmax(prob, axis=1)
+    return Prediction('skflow.DNNClassifier', le.inverse_transform(pred_class),
+        np.round(100*prob[np.arange(R.shape[0]),pred_class],2), prob,
+        le.classes_, dnntfDef.thresholdProbabilityPred)
@@ -33,6 +33,8 @@ from .slp_nn import *
 from .slp_svm import *
 from .slp_pca import *
 from .slp_kmeans import *
+from .slp_predict import *
+from .slp_cache import *
 
 #**********************************************
 ''' Learn and Predict - File'''
@@ -54,35 +56,42 @@ def LearnPredictFile(learnFile, sampleFile):
     A, Cl, En, Aorig = preProcessNormLearningData(A, En, Cl, YnormXind, 0)
     R, Rorig = preProcessNormPredData(R, Rx, En, YnormXind, 0)
     
-    ''' Run Neural Network - TensorFlow'''
-    if dnntfDef.runDNNTF == True:
+    if sysDef.concurrentTraining == True:
+        ''' Train enabled backends concurrently, then predict '''
         dnntfDef.alwaysImprove = False
-        if dnntfDef.runSkflowDNNTF == False:
-            clf_dnntf, le_dnntf  = trainDNNTF(A, Cl, A, Cl, learnFileRoot)
-            predDNNTF(clf_dnntf, le_dnntf, R, Cl)
-        else:
-            clf_dnntf, le_dnntf  = trainDNNTF2(A, Cl, A, Cl, learnFileRoot)
-            predDNNTF2(clf_dnntf, le_dnntf, R, Cl)
+        models = trainConcurrent(En, A, Cl, A, Cl, learnFileRoot)
+        predictor = Predictor(models, A, Cl, learnFileRoot)
+        predictor.report(predictor.predict(R))
+    else:
+        ''' Run Neural Network - TensorFlow'''
+        if dnntfDef.runDNNTF == True:
+            dnntfDef.alwaysImprove = False
+            if dnntfDef.runSkflowDNNTF == False:
+                clf_dnntf, le_dnntf  = trainDNNTF(A, Cl, A, Cl, learnFileRoot)
+                predDNNTF(clf_dnntf, le_dnntf, R, Cl)
+            else:
+                clf_dnntf, le_dnntf  = trainDNNTF2(A, Cl, A, Cl, learnFileRoot)
+                predDNNTF2(clf_dnntf, le_dnntf, R, Cl)
     
-    ''' Run Neural Network - sklearn'''
-    if nnDef.runNN == True:
-        clf_nn, le_nn = trainNN(A, Cl, A, Cl, learnFileRoot)
-        predNN(clf_nn, A, Cl, R, le_nn)
-
-    ''' Run Support Vector Machines '''
-    if svmDef.runSVM == True:
-        clf_svm, le_svm = trainSVM(A, Cl, A, Cl, learnFileRoot)
-        predSVM(clf_svm, A, Cl, R, le_svm)
-
-    ''' Tensorflow '''
-    if tfDef.runTF == True:
-        trainTF(A, Cl, A, Cl, learnFileRoot)
-        predTF(A, Cl, R, learnFileRoot)
+        ''' Run Neural Network - sklearn'''
+        if nnDef.runNN == True:
+            clf_nn, le_nn = trainNN(A, Cl, A, Cl, learnFileRoot)
+            predNN(clf_nn, A, Cl, R, le_nn)
+
+        ''' Run Support Vector Machines '''
+        if svmDef.runSVM == True:
+            clf_svm, le_svm = trainSVM(A, Cl, A, Cl, learnFileRoot)
+            predSVM(clf_svm, A, Cl, R, le_svm)
+
+        ''' Tensorflow '''
+        if tfDef.runTF == True:
+            trainTF(A, Cl, A, Cl, learnFileRoot)
+            predTF(A, Cl, R, learnFileRoot)
     
-    ''' Keras '''
-    if kerasDef.runKeras == True:
-        model_keras, le_keras  = trainKeras(En, A, Cl, A, Cl, learnFileRoot)
-        predKeras(model_keras, le_keras, R, Cl)
+        ''' Keras '''
+        if kerasDef.runKeras == True:
+            model_keras, le_keras  = trainKeras(En, A, Cl, A, Cl, learnFileRoot)
+            predKeras(model_keras, le_keras, R, Cl)
 
     ''' Plot Training Data '''
     if plotDef.createTrainingDataPlot == True:
@@ -99,6 +108,12 @@ def trainAccuracy(learnFile, testFile):
     ''' Open and process training data '''
 
     En, Cl, A, YnormXind = readLearnFile(learnFile)
+    learnFileRoot = os.path.splitext(learnFile)[0]
+
+    if preprocDef.kFold > 1:
+        A, Cl, En, Aorig = preProcessNormLearningData(A, En, Cl, YnormXind, 0)
+        kFoldAccuracy(En, A, Cl, learnFileRoot)
+        return
     
     if preprocDef.subsetCrossValid == True:
         print(" Cross-validation training using: ",str(preprocDef.percentCrossValid*100),
@@ -112,8 +127,6 @@ def trainAccuracy(learnFile, testFile):
         print(" Cross-validation training using: provided test subset (",testFile,")\n")
         En_test, Cl_test, A_test, YnormXind2 = readLearnFile(testFile)
     
-    learnFileRoot = os.path.splitext(learnFile)[0]
-    
     ''' Plot Training Data - Raw '''
     if plotDef.createTrainingDataPlot == True:
         plotTrainData(A, En, A_test, plotDef.plotAllSpectra, learnFileRoot+"_raw")
@@ -122,32 +135,125 @@ def trainAccuracy(learnFile, testFile):
     A, Cl, En, Aorig = preProcessNormLearningData(A, En, Cl, YnormXind, 0)
     A_test, Cl_test, En_test, Aorig_test = preProcessNormLearningData(A_test, En_test, Cl_test, YnormXind, 0)
     
-    ''' Run Neural Network - TensorFlow'''
-    if dnntfDef.runDNNTF == True:
-        if dnntfDef.runSkflowDNNTF == False:
-            clf_dnntf, le_dnntf  = trainDNNTF(A, Cl, A_test, Cl_test, learnFileRoot)
-        else:
-            clf_dnntf, le_dnntf  = trainDNNTF2(A, Cl, A_test, Cl_test, learnFileRoot)
+    if sysDef.concurrentTraining == True:
+        trainConcurrent(En, A, Cl, A_test, Cl_test, learnFileRoot, load=False)
+    else:
+        ''' Run Neural Network - TensorFlow'''
+        if dnntfDef.runDNNTF == True:
+            if dnntfDef.runSkflowDNNTF == False:
+                clf_dnntf, le_dnntf  = trainDNNTF(A, Cl, A_test, Cl_test, learnFileRoot)
+            else:
+                clf_dnntf, le_dnntf  = trainDNNTF2(A, Cl, A_test, Cl_test, learnFileRoot)
             
-    if kerasDef.runKeras == True:
-        model_keras, le_keras = trainKeras(En, A, Cl, A_test, Cl_test, learnFileRoot)
+        if kerasDef.runKeras == True:
+            model_keras, le_keras = trainKeras(En, A, Cl, A_test, Cl_test, learnFileRoot)
 
-    ''' Run Neural Network - sklearn'''
-    if nnDef.runNN == True:
-        clf_nn, le_nn = trainNN(A, Cl, A_test, Cl_test, learnFileRoot)
+        ''' Run Neural Network - sklearn'''
+        if nnDef.runNN == True:
+            clf_nn, le_nn = trainNN(A, Cl, A_test, Cl_test, learnFileRoot)
     
-    ''' Run Support Vector Machines '''
-    if svmDef.runSVM == True:
-        clf_svm, le_svm = trainSVM(A, Cl, A_test, Cl_test, learnFileRoot)
+        ''' Run Support Vector Machines '''
+        if svmDef.runSVM == True:
+            clf_svm, le_svm = trainSVM(A, Cl, A_test, Cl_test, learnFileRoot)
     
-    ''' Tensorflow '''
-    if tfDef.runTF == True:
-        trainTF(A, Cl, A_test, Cl_test, learnFileRoot)
+        ''' Tensorflow '''
+        if tfDef.runTF == True:
+            trainTF(A, Cl, A_test, Cl_test, learnFileRoot)
     
+
     ''' Plot Training Data - Normalized'''
     if plotDef.createTrainingDataPlot == True:
         plotTrainData(A, En, A_test, plotDef.plotAllSpectra, learnFileRoot+"_norm")
 
+#**********************************************
+''' K-fold cross validation '''
+#**********************************************
+# Folds run in workers forked after the data is
+# preprocessed, so A and Cl are inherited read-only
+# rather than pickled per fold. Each fold trains
+# fresh models in its own directory (<root>_cv/foldN),
+# as some backends save to fixed file names.
+foldShared = {}
+
+def kFoldAccuracy(En, A, Cl, learnFileRoot):
+    from sklearn.utils.multiclass import type_of_target
+    stratified = preprocDef.stratifiedKFold
+    # Regression targets cannot be stratified
+    regressor = (kerasDef.runKeras == True and kerasDef.regressor == True) or \
+        (nnDef.runNN == True and nnDef.MLPRegressor == True) or \
+        (dnntfDef.runDNNTF == True and dnntfDef.useRegressor == True)
+    if stratified == True and (regressor or type_of_target(Cl).startswith('continuous')):
+        stratified = False
+        print(" Continuous targets or regressor enabled: folds are not stratified")
+    if stratified == True:
+        from sklearn.model_selection import StratifiedKFold as KFold
+    else:
+        from sklearn.model_selection import KFold
+    folds = list(KFold(n_splits=preprocDef.kFold, shuffle=True, random_state=42).split(A, Cl))
+    foldShared.update({'En' : En, 'A' : A, 'Cl' : np.asarray(Cl), 'folds' : folds,
+        'cvDir' : os.path.abspath(learnFileRoot + '_cv'), 'root' : os.path.basename(learnFileRoot)})
+    print(" Cross-validation training using",len(folds),"folds" +
+        (" (stratified)" if stratified == True else "") + "\n")
+
+    start = time.perf_counter()
+    if sysDef.multiProc == True and len(folds) > 1:
+        import multiprocessing as mp
+        if 'fork' in mp.get_all_start_methods():
+            with mp.get_context('fork').Pool(min(sysDef.numCores, len(folds))) as p:
+                results = p.map(runFold, range(len(folds)))
+            printKFoldSummary(results, time.perf_counter() - start)
+            return
+        print(" Multiprocessing requires fork: running folds serially\n")
+    results = [runFold(k) for k in range(len(folds))]
+    printKFoldSummary(results, time.perf_counter() - start)
+
+def runFold(k):
+    En, A, Cl = foldShared['En'], foldShared['A'], foldShared['Cl']
+    train, test = foldShared['folds'][k]
+    foldDir = os.path.join(foldShared['cvDir'], 'fold' + str(k+1))
+    os.makedirs(foldDir, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(foldDir)
+    try:
+        dnntfDef.alwaysRetrain = kerasDef.alwaysRetrain = nnDef.alwaysRetrain = True
+        svmDef.alwaysRetrain = tfDef.alwaysRetrain = True
+        start = time.perf_counter()
+        models = trainBatchModels(En, A[train], Cl[train], foldShared['root'], A[test], Cl[test])
+        trainTime = time.perf_counter() - start
+        start = time.perf_counter()
+        preds = Predictor(models, A[train], Cl[train], foldShared['root']).predict(A[test])
+        predTime = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+    # K-Means clusters are not labels: not scored
+    scores = {name : foldScore(pred, Cl[test]) for name, pred in preds.items() if name != 'KM'}
+    return scores, trainTime, predTime
+
+# Accuracy [%] for classifiers, R^2 for regressors
+def foldScore(pred, Cl_test):
+    if pred.probs is not None:
+        return 100*np.mean(pred.value == Cl_test), 'accuracy [%]'
+    Cl_test = np.asarray(Cl_test, dtype=float)
+    res = np.sum((Cl_test - pred.value)**2)
+    tot = np.sum((Cl_test - np.mean(Cl_test))**2)
+    return 1 - res/tot, 'R^2'
+
+def printKFoldSummary(results, totalTime):
+    print('\n  ==========================================================')
+    print('  \033[1mK-fold cross validation\033[0m (' + str(len(results)) + ' folds)')
+    print('  ==========================================================')
+    print('  Model\t\t| Mean\t\t| Std\t\t| Score')
+    for name in results[0][0]:
+        scores = np.array([r[0][name][0] for r in results])
+        print('  {0:s}\t\t| {1:.4f}\t| {2:.4f}\t| {3:s}'.format(name,
+            np.mean(scores), np.std(scores), results[0][0][name][1]))
+    print('  ==========================================================')
+    print('  Fold\t| Training [s]\t| Prediction [s]')
+    for k, r in enumerate(results):
+        print('  {0:d}\t| {1:.1f}\t\t| {2:.2f}'.format(k+1, r[1], r[2]))
+    print('  ==========================================================')
+    print('  Total wall time: {0:.1f}s\n'.format(totalTime))
+
 #**********************************************
 ''' Process - Batch'''
 #**********************************************
@@ -157,77 +263,246 @@ def LearnPredictBatch(learnFile):
     ''' Open and process training data '''
     En, Cl, A, YnormXind = readLearnFile(learnFile)
     A, Cl, En, Aorig = preProcessNormLearningData(A, En, Cl, YnormXind, 0)
-    
-    if sysDef.multiProc == True:
-        import multiprocessing as mp
-        p = mp.Pool(sysDef.numCores)
-        for f in glob.glob('*.txt'):
-            if (f != learnFile):
-                p.apply_async(processSingleBatch, args=(f, En, Cl, A, Aorig, YnormXind, summary_filename, learnFile))
-        p.close()
-        p.join()
-    else:
-        for f in glob.glob('*.txt'):
-            if (f != learnFile):
-                processSingleBatch(f, En, Cl, A, Aorig, YnormXind, summary_filename, learnFile)
+    learnFileRoot = os.path.splitext(learnFile)[0]
 
-def processSingleBatch(f, En, Cl, A, Aorig, YnormXind, summary_filename, learnFile):
-    print(' Processing file: \033[1m' + f + '\033[0m\n')
-    R, Rx = readPredFile(f)
-    summaryFile = [f]
-    ''' Preprocess prediction data '''
-    R, Rorig = preProcessNormPredData(R, Rx, En, YnormXind, 0)
+    files = [f for f in glob.glob('*.txt') if f != learnFile]
+    pool = batchPool(files, En, YnormXind)
+    try:
+        ''' Train (or load) each enabled model only once '''
+        models = trainBatchModels(En, A, Cl, learnFileRoot)
+        predictor = Predictor(models, A, Cl, learnFileRoot)
+
+        ''' Predict files in groups of sysDef.mapChunkRows '''
+        with open(summary_filename, "a") as sum_file:
+            csv_out=csv.writer(sum_file)
+            for i in range(0, len(files), sysDef.mapChunkRows):
+                names, R = [], []
+                for f, Rf, Rorig in readBatchFiles(files[i:i+sysDef.mapChunkRows], pool):
+                    if Rf is not None:
+                        names.append(f)
+                        R.append(Rf)
+                if len(R) == 0:
+                    continue
+                preds = predictor.predict(np.vstack(R))
+                for j, f in enumerate(names):
+                    print(' Prediction for file: \033[1m' + f + '\033[0m\n')
+                    predictor.report(preds, j)
+                    csv_out.writerow([f] + predictor.summary(preds, j))
+    finally:
+        if pool is not None:
+            pool.terminate()
 
-    learnFileRoot = os.path.splitext(learnFile)[0]
-    
-    ''' Run Neural Network - TensorFlow'''
-    if dnntfDef.runDNNTF == True:
+#**********************************************
+''' Train models used in batch mode '''
+#**********************************************
+def trainBatchModels(En, A, Cl, learnFileRoot, A_test=None, Cl_test=None, backends=None):
+    if A_test is None:
+        A_test, Cl_test = A, Cl
+    if backends is None:
+        backends = enabledBackends()
+    models = {}
+    if 'dnntf' in backends:
         if dnntfDef.runSkflowDNNTF == False:
-            clf_dnntf, le_dnntf  = trainDNNTF(A, Cl, A, Cl, learnFileRoot)
-            dnntfPred, dnntfProb = predDNNTF(clf_dnntf, le_dnntf, R, Cl)
+            models['dnntf'] = trainDNNTF(A, Cl, A_test, Cl_test, learnFileRoot)
         else:
-            clf_dnntf, le_dnntf  = trainDNNTF2(A, Cl, A, Cl, learnFileRoot)
-            dnntfPred, dnntfProb = predDNNTF2(clf_dnntf, le_dnntf, R, Cl)
-        summaryFile.extend([dnntfPred, dnntfProb])
+            models['dnntf'] = trainDNNTF2(A, Cl, A_test, Cl_test, learnFileRoot)
         dnntfDef.alwaysRetrain = False
-        
-    ''' Run Keras'''
-    if kerasDef.runKeras == True:
-        model, le_keras  = trainKeras(En, A, Cl, A, Cl, learnFileRoot)
-        kerasPred, kerasProb = predKeras(model_keras, le_keras, R, Cl)
-        summaryFile.extend([kerasPred, kerasProb])
-    
-    ''' Run Neural Network - sklearn'''
-    if nnDef.runNN == True:
-        clf_nn, le_nn = trainNN(A, Cl, A, Cl, learnFileRoot)
-        nnPred, nnProb = predNN(clf_nn, A, Cl, R, le_nn)
-        summaryFile.extend([nnPred, nnProb])
+
+    if 'keras' in backends:
+        models['keras'] = trainKeras(En, A, Cl, A_test, Cl_test, learnFileRoot)
+
+    if 'nn' in backends:
+        models['nn'] = trainNN(A, Cl, A_test, Cl_test, learnFileRoot)
         nnDef.alwaysRetrain = False
 
-    ''' Run Support Vector Machines '''
-    if svmDef.runSVM == True:
-        clf_svm, le_svm = trainSVM(A, Cl, A, Cl, learnFileRoot)
-        svmPred, svmProb = predSVM(clf_svm, A, Cl, En, R, le_svm)
-        summaryFile.extend([svmPred, svmProb])
+    if 'svm' in backends:
+        models['svm'] = trainSVM(A, Cl, A_test, Cl_test, learnFileRoot)
         svmDef.alwaysRetrain = False
 
-    ''' Tensorflow '''
-    if tfDef.runTF == True:
-        trainTF(A, Cl, A, Cl, learnFileRoot)
-        tfPred, tfProb = predTF(A, Cl, R, learnFileRoot)
-        summaryFile.extend([tfPred, tfProb, tfAccur])
-        tfDef.tfalwaysRetrain = False
+    if 'tf' in backends:
+        trainTF(A, Cl, A_test, Cl_test, learnFileRoot)
+        tfDef.alwaysRetrain = False
+        # Restored from disk at prediction
+        models['tf'] = learnFileRoot
 
-    ''' Run K-Means '''
-    if kmDef.runKM == True:
+    if 'km' in backends:
         kmDef.plotKM = False
-        kmPred = runKMmain(A, Cl, En, R, Aorig, Rorig)
-        summaryFile.extend([kmPred])
+        models['km'] = trainKM(A, Cl)
+    return models
+
+def enabledBackends():
+    flags = [('dnntf', dnntfDef.runDNNTF), ('keras', kerasDef.runKeras), ('nn', nnDef.runNN),
+        ('svm', svmDef.runSVM), ('tf', tfDef.runTF), ('km', kmDef.runKM)]
+    return [name for name, run in flags if run == True]
+
+#**********************************************
+''' Concurrent training of the backends '''
+#**********************************************
+# Each enabled backend (K-Means aside) trains in
+# its own process forked from the main one, so the
+# preprocessed data is inherited, not pickled. A
+# process is pinned to sysDef.backendCores[name]
+# cores (default: an equal share of numCores), with
+# BLAS/OpenMP and TF session threads limited to as
+# many; backends wait until enough cores are free.
+# Models are saved by the workers and loaded back
+# in the main process when load is True.
+trainShared = {}
+backendNames = {'dnntf' : 'DNN-TF', 'keras' : 'Keras', 'nn' : 'NN', 'svm' : 'svm', 'tf' : 'TF'}
+
+def trainConcurrent(En, A, Cl, A_test, Cl_test, learnFileRoot, load=True):
+    import multiprocessing as mp
+    from multiprocessing.connection import wait
+    tasks = [name for name in enabledBackends() if name != 'km']
+    if len(tasks) == 0:
+        print(" No backend to train concurrently\n")
+        return {}
+    if 'fork' not in mp.get_all_start_methods():
+        print(" Concurrent training requires fork: training serially\n")
+        return trainBatchModels(En, A, Cl, learnFileRoot, A_test, Cl_test, tasks)
+
+    trainShared.update({'En' : En, 'A' : A, 'Cl' : Cl, 'A_test' : A_test,
+        'Cl_test' : Cl_test, 'root' : learnFileRoot})
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))[:sysDef.numCores]
+    else:
+        cpus = list(range(sysDef.numCores))
+    free = list(cpus)
+    pending = list(tasks)
+    running = {}
+    results = {}
+    ctx = mp.get_context('fork')
+    start = time.perf_counter()
+    while pending or running:
+        for name in list(pending):
+            numCores = min(sysDef.backendCores.get(name, max(1, len(cpus)//len(tasks))), len(cpus))
+            if numCores <= len(free):
+                cores, free = free[:numCores], free[numCores:]
+                conn, childConn = ctx.Pipe(False)
+                p = ctx.Process(target=trainBackend, args=(name, cores, childConn))
+                p.start()
+                running[p.sentinel] = (name, p, cores, conn)
+                pending.remove(name)
+        for sentinel in wait(list(running)):
+            name, p, cores, conn = running.pop(sentinel)
+            results[name] = conn.recv() if conn.poll() else ('failed', 0, None)
+            results[name] += (len(cores),)
+            p.join()
+            free += cores
+    printConcurrentSummary(results, time.perf_counter() - start, len(cpus))
+
+    if not load:
+        return {}
+    # Load what the workers saved, without retraining
+    flags = {d : (d.alwaysRetrain, getattr(d, 'alwaysImprove', None)) for d in [dnntfDef, kerasDef, nnDef, svmDef, tfDef]}
+    for d in flags:
+        d.alwaysRetrain = False
+        if flags[d][1] is not None:
+            d.alwaysImprove = False
+    models = trainBatchModels(En, A, Cl, learnFileRoot, A_test, Cl_test,
+        [name for name in tasks if results[name][0] == 'done'])
+    for d in flags:
+        d.alwaysRetrain = flags[d][0]
+        if flags[d][1] is not None:
+            d.alwaysImprove = flags[d][1]
+    return models
+
+def trainBackend(name, cores, conn):
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    # Thread pools of numpy/sklearn (BLAS, OpenMP) are already
+    # started: limit them explicitly, and TF sessions via sysDef
+    sysDef.backendThreads = len(cores)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(len(cores))
+    except ImportError:
+        print(" threadpoolctl not found: BLAS/OpenMP threads of", name, "are only pinned, not limited")
+    sh = trainShared
+    # Models must be saved to be loaded by the main process.
+    # DNN-TF would resume from a saved checkpoint: clear it
+    if name == 'dnntf' and dnntfDef.alwaysRetrain == True:
+        clearDNNTFModel(sh['A'], sh['Cl'], sh['A_test'], sh['Cl_test'])
+    for d in [dnntfDef, kerasDef]:
+        if d.alwaysRetrain == True:
+            d.alwaysRetrain = False
+            d.alwaysImprove = True
+    try:
+        start = time.perf_counter()
+        models = trainBatchModels(sh['En'], sh['A'], sh['Cl'], sh['root'], sh['A_test'], sh['Cl_test'], [name])
+        trainTime = time.perf_counter() - start
+        pred = Predictor(models, sh['A'], sh['Cl'], sh['root']).predict(sh['A_test'])[backendNames[name]]
+        conn.send(('done', trainTime, foldScore(pred, sh['Cl_test'])))
+    except Exception as e:
+        conn.send(('failed: ' + str(e), time.perf_counter() - start, None))
+    conn.close()
+
+# Model directory as in trainDNNTF/trainDNNTF2
+def clearDNNTFModel(A, Cl, A_test, Cl_test):
+    import shutil
+    if dnntfDef.runSkflowDNNTF == False:
+        backend, prefix = 'dnntf', "./DNN-TF_"
+    else:
+        backend, prefix = 'dnntf-sk', "./DNN-TF-SK_"
+    if cachedModel(backend, dnntfDef, A, Cl, A_test, Cl_test, fresh=True) is None:
+        shutil.rmtree(prefix + str(len(dnntfDef.hidden_layers))+"HL_"+str(dnntfDef.hidden_layers[0]),
+            ignore_errors=True)
+
+def printConcurrentSummary(results, totalTime, numCores):
+    print('\n  ==========================================================')
+    print('  \033[1mConcurrent training\033[0m (' + str(numCores) + ' cores)')
+    print('  ==========================================================')
+    print('  Model\t| Cores\t| Training [s]\t| Score')
+    for name, (status, trainTime, score, cores) in results.items():
+        if score is None:
+            score = status
+        else:
+            score = '{0:.4f} ({1:s})'.format(score[0], score[1])
+        print('  {0:s}\t| {1:d}\t| {2:.1f}\t\t| {3:s}'.format(backendNames[name], cores, trainTime, score))
+    print('  ==========================================================')
+    print('  Total wall time: {0:.1f}s (sum of trainings: {1:.1f}s)\n'.format(totalTime,
+        sum(r[1] for r in results.values())))
 
-    with open(summary_filename, "a") as sum_file:
-        csv_out=csv.writer(sum_file)
-        csv_out.writerow(summaryFile)
-        sum_file.close()
+#**********************************************
+''' Read and preprocess batch files '''
+#**********************************************
+# With multiProc, files are read in workers forked
+# after the training data is preprocessed, so En,
+# YnormXind and the fitted scaler are inherited
+# rather than pickled per task. The pool is forked
+# before training: TF/Keras threads are not fork-safe.
+# Fitted models stay in the main process, where
+# predictions are made.
+batchShared = {}
+
+# Pool reading the files, or None to read them serially
+def batchPool(files, En, YnormXind):
+    batchShared['En'] = En
+    batchShared['YnormXind'] = YnormXind
+    if sysDef.multiProc == True and len(files) > 1:
+        import multiprocessing as mp
+        if 'fork' in mp.get_all_start_methods():
+            return mp.get_context('fork').Pool(sysDef.numCores)
+        print(" Multiprocessing requires fork: processing files serially\n")
+    return None
+
+def readBatchFiles(files, pool=None):
+    if pool is not None:
+        chunk = max(1, len(files)//(4*sysDef.numCores))
+        for result in pool.imap(readSingleBatch, files, chunksize=chunk):
+            yield result
+        return
+    for f in files:
+        yield readSingleBatch(f)
+
+def readSingleBatch(f):
+    print(' Processing file: \033[1m' + f + '\033[0m\n')
+    try:
+        R, Rx = readPredFile(f)
+    except:
+        return f, None, None
+    R, Rorig = preProcessNormPredData(R, Rx, batchShared['En'], batchShared['YnormXind'], 0)
+    return f, R, Rorig
 
 #**********************************************
 ''' Learn and Predict - Maps'''
@@ -237,82 +512,36 @@ def LearnPredictMap(learnFile, mapFile):
     En, Cl, A, YnormXind = readLearnFile(learnFile)
 
     learnFileRoot = os.path.splitext(learnFile)[0]
+    A, Cl, En, Aorig = preProcessNormLearningData(A, En, Cl, YnormXind, 0)
 
-    ''' Open prediction map '''
-    X, Y, R, Rx = readPredMap(mapFile)
-    type = 0
-    i = 0;
-    svmPred = nnPred = tfPred = kmPred = np.empty([X.shape[0]])
-    A, Cl, En, Aorig = preProcessNormLearningData(A, En, Cl, YnormXind, type)
-    print(' Processing map...' )
-    
-    if nnDef.runNN == True:
-        clf_nn, le_nn = trainNN(A, Cl, A, Cl, learnFileRoot)
-
-    if dnntfDef.runDNNTF == True:
-        if dnntfDef.runSkflowDNNTF == False:
-            clf_dnntf, le_dnntf  = trainDNNTF(A, Cl, A, Cl, learnFileRoot)
-        else:
-            clf_dnntf, le_dnntf  = trainDNNTF2(A, Cl, A, Cl, learnFileRoot)
-
-    if kerasDef.runKeras == True:
-        model_keras, le_keras  = trainKeras(En, A, Cl, A, Cl, learnFileRoot)
-
-    if svmDef.runSVM == True:
-        clf_svm, le_svm = trainSVM(A, Cl, A, Cl, learnFileRoot)
+    ''' Train (or load) each enabled model once '''
+    models = trainBatchModels(En, A, Cl, learnFileRoot)
 
-    for r in R[:]:
-        r, rorig = preProcessNormPredData(r, Rx, En, YnormXind, type)
+    ''' Stream the map in blocks of pixels '''
+    print(' Processing map...' )
+    Rx = readPredMapEn(mapFile)
+    X, Y, preds = [], [], {}
+    predictor = Predictor(models, A, Cl, learnFileRoot)
+    type = 0
+    for x, y, R in readPredMapChunks(mapFile):
+        R, Rorig = preProcessNormPredMatrix(R, Rx, En, YnormXind, type)
         type = 1
-        
-        ''' Run Neural Network - TensorFlow'''
-        if dnntfDef.runDNNTF == True:
-            if dnntfDef.runSkflowDNNTF == False:
-                dnntfPred[i], temp = predDNNTF(cl_dnntf, le_dnntf, r, Cl)
-            else:
-                dnntfPred[i], temp = predDNNTF2(cl_dnntf, le_dnntf, r, Cl)
-            
-            saveMap(mapFile, 'DNN-TF', 'HC', dnntfPred[i], X[i], Y[i], True)
-            dnnDef.alwaysRetrain = False
-            
-        if dnntfDef.runKeras == True:
-            kerasPred[i], temp = predKeras(model_keras, le_keras, r, Cl)
-            saveMap(mapFile, 'Keras', 'HC', kerasPred[i], X[i], Y[i], True)
-
-        ''' Run Neural Network - sklearn'''
-        if nnDef.runNN == True:
-            nnPred[i], temp = predNN(clf_nn, A, Cl, r, le_nn)
-            saveMap(mapFile, 'NN', 'HC', nnPred[i], X[i], Y[i], True)
-            nnDef.alwaysRetrain = False
-        
-        ''' Run Support Vector Machines '''
-        if svmDef.runSVM == True:
-            svmPred[i], temp = predSVM(clf_svm, A, Cl, En, r, le_svm)
-            saveMap(mapFile, 'svm', 'HC', svmPred[i], X[i], Y[i], True)
-            svmDef.alwaysRetrain = False
-
-        ''' Tensorflow '''
-        if tfDef.runTF == True:
-            trainTF(A, Cl, A, Cl, learnFileRoot)
-            tfPred, temp = predTF(A, Cl, r, learnFileRoot)
-            saveMap(mapFile, 'TF', 'HC', tfPred[i], X[i], Y[i], True)
-            tfDef.alwaysRetrain = False
-
-        ''' Run K-Means '''
-        if kmDef.runKM == True:
-            kmDef.plotKM = False
-            kmPred[i] = runKMmain(A, Cl, En, r, Aorig, rorig)
-            saveMap(mapFile, 'KM', 'HC', kmPred[i], X[i], Y[i], True)
-        i+=1
+        for name, pred in predictor.predict(R).items():
+            saveMapBatch(mapFile, name, 'HC', pred.value, x, y, True)
+            preds.setdefault(name, []).append(pred.value)
+        X.append(x)
+        Y.append(y)
+    X = np.concatenate(X)
+    Y = np.concatenate(Y)
+    preds = {name : np.concatenate(pred) for name, pred in preds.items()}
 
     if dnntfDef.plotMap == True and dnntfDef.runDNNTF == True:
-        plotMaps(X, Y, dnntfPred, 'Deep Neural networks - tensorFlow')
+        plotMaps(X, Y, preds['DNN-TF'], 'Deep Neural networks - tensorFlow')
     if nnDef.plotMap == True and nnDef.runNN == True:
-        plotMaps(X, Y, nnPred, 'Deep Neural networks - sklearn')
+        plotMaps(X, Y, preds['NN'], 'Deep Neural networks - sklearn')
     if svmDef.plotMap == True and svmDef.runSVM == True:
-        plotMaps(X, Y, svmPred, 'SVM')
+        plotMaps(X, Y, preds['svm'], 'SVM')
     if tfDef.plotMap == True and tfDef.runTF == True:
-        plotMaps(X, Y, tfPred, 'TensorFlow')
+        plotMaps(X, Y, preds['TF'], 'TensorFlow')
     if kmDef.plotMap == True and kmDef.runKM == True:
-        plotMaps(X, Y, kmPred, 'K-Means Prediction')
-
+        plotMaps(X, Y, preds['KM'], 'K-Means Prediction')
@@ -25,6 +25,8 @@ from os import rename
 from datetime import datetime, date
 
 from .slp_config import *
+from .slp_preprocess import *
+from .slp_cache import *
 
 #**********************************************
 ''' Format input data for Estimator '''
@@ -44,7 +46,7 @@ def trainKeras(En, A, Cl, A_test, Cl_test, Root):
     
     # Use this to restrict GPU memory allocation in TF
     opts = tf.GPUOptions(per_process_gpu_memory_fraction=sysDef.fractionGPUmemory)
-    conf = tf.ConfigProto(gpu_options=opts)
+    conf = limitThreadsTF(tf.ConfigProto(gpu_options=opts))
     #conf.gpu_options.allow_growth = True
     
     if kerasDef.useTFKeras:
@@ -59,7 +61,11 @@ def trainKeras(En, A, Cl, A_test, Cl_test, Root):
     from tensorflow.contrib.learn.python.learn import monitors as monitor_lib
     
     tb_directory = "keras_" + str(len(kerasDef.hidden_layers))+"HL_"+str(kerasDef.hidden_layers[0])
-    model_directory = "."
+    cache = cachedModel('keras', kerasDef, A, Cl, A_test, Cl_test, kerasDef.alwaysRetrain)
+    if cache is None:
+        model_directory = "."
+    else:
+        model_directory = cache.path
     if kerasDef.regressor:
         model_name = model_directory+"/keras_regressor_"+str(len(kerasDef.hidden_layers))+"HL_"+str(kerasDef.hidden_layers[0])+".hd5"
     else:
@@ -97,7 +103,7 @@ def trainKeras(En, A, Cl, A_test, Cl_test, Root):
         Cl2 = keras.utils.to_categorical(Cl2, num_classes=np.unique(totCl).size+1)
         Cl2_test = keras.utils.to_categorical(Cl2_test, num_classes=np.unique(totCl).size+1)
         print(" Label Encoder saved in:", model_le)
-        with open(model_le, 'ab') as f:
+        with open(model_le, 'wb') as f:
             f.write(pickle.dumps(le))
     
     if kerasDef.fullBatch == True:
@@ -195,6 +201,8 @@ def trainKeras(En, A, Cl, A_test, Cl_test, Root):
     
     score = model.evaluate(A_test, Cl2_test, batch_size=batch_size)
     printEvalSummary(model_name, score)
+    if cache is not None:
+        cache.commit(Root)
     return model, le
 
 #***********************************************
@@ -263,45 +271,20 @@ def printParamKeras(A):
 ''' Predict using Keras model '''
 #********************************************************************************
 def predKeras(model, le, R, Cl):
-    if kerasDef.useTFKeras:
-        import tensorflow.keras as keras  #tf.keras
-    else:
-        import keras   # pure keras
-    
-    from sklearn import preprocessing
-    
-    if kerasDef.regressor:
-        predictions = model.predict(R).flatten()[0]
-        print('  ========================================================')
-        print('  \033[1mKeras MLP - Regressor\033[0m - Prediction')
-        print('  ========================================================')
-        predValue = predictions
-        print('\033[1m\n  Predicted value = {0:.4f}\033[0m\n'.format(predValue))
-        print('  ========================================================\n')
-        predProb = 0
-    else:
-        predictions = model.predict(R, verbose=1)
-        pred_class = np.argmax(predictions)
-        if pred_class.size >0:
-            predValue = le.inverse_transform([pred_class])[0]
-        else:
-            predValue = 0
-
-        predProb = round(100*predictions[0][pred_class],2)
-        print('\n  ==================================')
-        print('  \033[1mKeras\033[0m - Probability >',str(kerasDef.thresholdProbabilityPred),'%')
-        print('  ==================================')
-        print('  Prediction\tProbability [%]')
-        for i in range(len(predictions[0])-1):
-            if predictions[0][i]>kerasDef.thresholdProbabilityPred:
-                print(' ',str(np.unique(Cl)[i]),'\t\t',
-                    str('{:.2f}'.format(100*predictions[0][i])))
-        print('  ==================================')
-    
-        print('\033[1m' + '\n Predicted value (Keras) = ' + str(predValue) +
-            '  (probability = ' + str(predProb) + '%)\033[0m\n')
-
-    return predValue, predProb
-
-
+    pred = predKerasBatch(model, le, R, Cl)
+    printPrediction(pred)
+    return pred.value[0], pred.prob[0]
 
+#********************************************************************************
+''' Batch prediction - Keras '''
+#********************************************************************************
+def predKerasBatch(model, le, R, Cl):
+    predictions = model.predict(R, batch_size=kerasDef.batchSize)
+    if kerasDef.regressor:
+        return Prediction('Keras', predictions.flatten(), np.zeros(R.shape[0]))
+    pred_class = np.argmax(predictions, axis=1)
+    # The last output column is not a class of the encoder
+    return Prediction('Keras', le.inverse_transform(pred_class),
+        np.round(100*predictions[np.arange(R.shape[0]),pred_class],2),
+        predictions[:,:le.classes_.size], le.classes_,
+        100*kerasDef.thresholdProbabilityPred)
@@ -24,36 +24,23 @@ from os import rename
 from datetime import datetime, date
 
 from .slp_config import *
+from .slp_preprocess import *
 
 
 #********************
 ''' Run K-Means '''
 #********************
-def runKMmain(A, Cl, En, R, Aorig, Rorig):
-    from sklearn.cluster import KMeans
+def runKMmain(A, Cl, En, R, Aorig, Rorig, kmeans=None):
     print('==========================================================================\n')
-    print(' Running K-Means...')
-    print(' Number of unique identifiers in training data: ' + str(np.unique(Cl).shape[0]))
-    if kmDef.customNumKMComp == False:
-        numKMcomp = np.unique(Cl).shape[0]
-    else:
-        numKMcomp = kmDef.numKMcomponents
-    kmeans = KMeans(n_clusters=numKMcomp, random_state=0).fit(A)
+    if kmeans is None:
+        kmeans = trainKM(A, Cl)
     prediction = kmeans.predict(R)[0]
-
-    print('\n  ==============================')
-    print('  \033[1mK-Means\033[0m - Prediction')
-    print('  ==============================')
-    print('  Class\t| Value')
-    for j in range(0,kmeans.labels_.shape[0]):
-        if kmeans.labels_[j] == prediction:
-            print("  {0:d}\t| {1:.2f}".format(prediction,Cl[j]))
-    print('  ==============================\n')
+    printKMPrediction(kmeans, Cl, prediction)
 
     if kmDef.plotKM == True:
         import matplotlib.pyplot as plt
         for j in range(0,kmeans.labels_.shape[0]):
-            if kmeans.labels_[j] == kmeans.predict(R)[0]:
+            if kmeans.labels_[j] == prediction:
                 plt.plot(En, Aorig[j,:])
         plt.plot(En, Rorig[0,:], linewidth = 2, label='Predict')
         plt.title('K-Means')
@@ -61,32 +48,114 @@ def runKMmain(A, Cl, En, R, Aorig, Rorig):
         plt.ylabel('Intensity')
         plt.legend()
         plt.show()
-    return kmeans.predict(R)[0]
+    return prediction
+
+#********************
+''' Print K-Means class members '''
+#********************
+def printKMPrediction(kmeans, Cl, prediction):
+    print('\n  ==============================')
+    print('  \033[1mK-Means\033[0m - Prediction')
+    print('  ==============================')
+    print('  Class\t| Value')
+    for value in np.asarray(Cl)[kmeans.labels_ == prediction]:
+        print("  {0:d}\t| {1:.2f}".format(prediction,value))
+    print('  ==============================\n')
+
+#********************
+''' Fit K-Means '''
+#********************
+def trainKM(A, Cl):
+    from sklearn.cluster import KMeans
+    print(' Running K-Means...')
+    print(' Number of unique identifiers in training data: ' + str(np.unique(Cl).shape[0]))
+    if kmDef.customNumKMComp == False:
+        numKMcomp = np.unique(Cl).shape[0]
+    else:
+        numKMcomp = kmDef.numKMcomponents
+    return KMeans(n_clusters=numKMcomp, random_state=0).fit(A)
 
 #**********************************************
 ''' K-Means - Maps'''
 #**********************************************
 def KmMap(mapFile, numKMcomp):
+    print(' Running K-Means...')
+    print(' Number of classes: ' + str(numKMcomp))
+    if kmDef.miniBatchKM == True:
+        KmMapStream(mapFile, numKMcomp)
+        return
+
     ''' Open prediction map '''
     X, Y, R, Rx = readPredMap(mapFile)
     type = 0
-    i = 0;
     R, Rx, Rorig = preProcessNormMap(R, Rx, type)
 
     from sklearn.cluster import KMeans
-    print(' Running K-Means...')
-    print(' Number of classes: ' + str(numKMcomp))
-    kmeans = KMeans(n_clusters=kmDef.numKMcomponents, random_state=0).fit(R)
-    kmPred = np.empty([R.shape[0]])
+    kmeans = KMeans(n_clusters=numKMcomp, random_state=0).fit(R)
 
-    for i in range(0, R.shape[0]):
-        kmPred[i] = kmeans.predict(R[i,:].reshape(1,-1))[0]
-        saveMap(mapFile, 'KM', 'Class', int(kmPred[i]), X[i], Y[i], True)
-        if kmPred[i] in kmeans.labels_:
-            if os.path.isfile(saveMapName(mapFile, 'KM', 'Class_'+ str(int(kmPred[i]))+'-'+str(np.unique(kmeans.labels_).shape[0]), False)) == False:
-                saveMap(mapFile, 'KM', 'Class_'+ str(int(kmPred[i])) + '-'+str(np.unique(kmeans.labels_).shape[0]) , '\t'.join(map(str, Rx)), ' ', ' ', False)
-            saveMap(mapFile, 'KM', 'Class_'+ str(int(kmPred[i])) + '-'+str(np.unique(kmeans.labels_).shape[0]) , '\t'.join(map(str, R[1,:])), X[i], Y[i], False)
+    ''' Labels of the fitted pixels: no per-pixel predict needed '''
+    kmPred = kmeans.labels_
+    saveMapBatch(mapFile, 'KM', 'Class', kmPred, X, Y, True)
+    saveKmClasses(mapFile, kmPred, X, Y, R, Rx, str(np.unique(kmPred).shape[0]))
 
     if kmDef.plotKM == True:
         plotMaps(X, Y, kmPred, 'K-Means')
 
+#**********************************************
+''' K-Means - Maps, streaming
+    MiniBatchKMeans fitted block by block,
+    so memory is bounded by sysDef.mapChunkRows '''
+#**********************************************
+def KmMapStream(mapFile, numKMcomp):
+    from sklearn.cluster import MiniBatchKMeans
+    print(' Using MiniBatchKMeans (batch size: ' + str(kmDef.batchSizeKM) + ')')
+    kmeans = MiniBatchKMeans(n_clusters=numKMcomp, batch_size=kmDef.batchSizeKM, random_state=0)
+    Rx = readPredMapEn(mapFile)
+    if preprocDef.enRestrictRegion == True:
+        Rx = Rx[preprocDef.enLim1:preprocDef.enLim2]
+
+    def mapChunks():
+        for x, y, R in readPredMapChunks(mapFile):
+            if preprocDef.Ynorm == True:
+                R = normalizeSpectra(R, preprocDef.YnormTo, shiftPositive=False)
+            if preprocDef.StandardScalerFlag == True:
+                R = preprocDef.scaler.transform(R)
+            if preprocDef.enRestrictRegion == True:
+                R = R[:,preprocDef.enLim1:preprocDef.enLim2]
+            yield x, y, R
+
+    if preprocDef.StandardScalerFlag == True:
+        print('  Using StandardScaler from sklearn ')
+        for x, y, R in readPredMapChunks(mapFile):
+            if preprocDef.Ynorm == True:
+                R = normalizeSpectra(R, preprocDef.YnormTo, shiftPositive=False)
+            preprocDef.scaler.partial_fit(R)
+    for x, y, R in mapChunks():
+        kmeans.partial_fit(R)
+
+    X, Y, kmPred = [], [], []
+    for x, y, R in mapChunks():
+        pred = kmeans.predict(R)
+        saveMapBatch(mapFile, 'KM', 'Class', pred, x, y, True)
+        saveKmClasses(mapFile, pred, x, y, R, Rx, str(numKMcomp))
+        X.append(x)
+        Y.append(y)
+        kmPred.append(pred)
+
+    if kmDef.plotKM == True:
+        plotMaps(np.concatenate(X), np.concatenate(Y), np.concatenate(kmPred), 'K-Means')
+
+#**********************************************
+''' One grouped write of the spectra per class '''
+#**********************************************
+def saveKmClasses(mapFile, kmPred, X, Y, R, Rx, numClasses):
+    order = np.argsort(kmPred, kind='stable')
+    classes, start = np.unique(kmPred[order], return_index=True)
+    for cl, rows in zip(classes, np.split(order, start[1:])):
+        classFile = saveMapName(mapFile, 'KM', 'Class_'+ str(int(cl)) + '-' + numClasses, False)
+        newFile = os.path.isfile(classFile) == False
+        with open(classFile, "a") as coord_file:
+            if newFile:
+                coord_file.write(' \t \t' + '\t'.join(map(str, Rx)) + '\n')
+            np.savetxt(coord_file, np.column_stack((X[rows], Y[rows], R[rows])), fmt='%s', delimiter='\t')
+
@@ -25,6 +25,8 @@ from datetime import datetime, date
 from sklearn import preprocessing
 
 from .slp_config import *
+from .slp_preprocess import *
+from .slp_cache import *
 
 #********************************************************************************
 ''' MultiLayer Perceptron - SKlearn '''
@@ -36,8 +38,10 @@ def trainNN(A, Cl, A_test, Cl_test, Root):
     from sklearn.neural_network import MLPClassifier, MLPRegressor
     from sklearn.externals import joblib
     
+    cache = cachedModel('nn', nnDef, A, Cl, A_test, Cl_test, nnDef.alwaysRetrain)
+    if cache is not None:
+        learnFile, Root = Root, os.path.join(cache.path, 'model')
     if nnDef.MLPRegressor is False:
-        Root+"/DNN-TF_"
         nnTrainedData = Root + '.nnModelC.pkl'
     else:
         nnTrainedData = Root + '.nnModelR.pkl'
@@ -93,38 +97,16 @@ def trainNN(A, Cl, A_test, Cl_test, Root):
         joblib.dump(clf, nnTrainedData)
         joblib.dump(le, model_le)
 
+    if cache is not None:
+        cache.commit(learnFile)
     return clf, le
 
 #********************************************************************************
 ''' Evaluate Neural Network - sklearn '''
 #********************************************************************************
 def predNN(clf, A, Cl, R, le):
-    if nnDef.MLPRegressor is False:
-        prob = clf.predict_proba(R)[0].tolist()
-        rosterPred = np.where(clf.predict_proba(R)[0]>nnDef.thresholdProbabilityPred/100)[0]
-        print('\n  ==============================')
-        print('  \033[1mNN\033[0m - Probability >',str(nnDef.thresholdProbabilityPred),'%')
-        print('  ==============================')
-        print('  Prediction\tProbability [%]')
-        for i in range(rosterPred.shape[0]):
-            print(' ',str(np.unique(Cl)[rosterPred][i]),'\t\t',str('{:.4f}'.format(100*clf.predict_proba(R)[0][rosterPred][i])))
-        print('  ==============================')
-        
-        R_pred = clf.predict(R)[0]
-        if R_pred.size >0:
-            predValue = le.inverse_transform(R_pred)
-        else:
-            predValue = 0
-        
-        predProb = round(100*max(prob),4)
-        print('\033[1m' + '\n Predicted classifier value (Deep Neural Networks - sklearn) = ' + str(predValue) +
-              '  (probability = ' + str(predProb) + '%)\033[0m\n')
-    else:
-        Cl = np.array(Cl,dtype=float)
-        predValue = clf.predict(R)[0]
-        predProb = clf.score(A,Cl)
-        print('\033[1m' + '\n Predicted regressor value (Deep Neural Networks - sklearn) = ' + str('{:.3f}'.format(predValue)) +
-              '  (R^2 = ' + str('{:.5f}'.format(predProb)) + ')\033[0m\n')
+    pred = predNNBatch(clf, A, Cl, R, le)
+    printPrediction(pred)
     
     #**************************************
     ''' Neural Networks Classification Report '''
@@ -138,7 +120,20 @@ def predNN(clf, A, Cl, R, le):
     #*************************
     if plotDef.showProbPlot == True:
         if nnDef.MLPRegressor is False:
-            plotProb(clf, R)
+            plotProb(pred)
 
-    return predValue, predProb
+    return pred.value[0], pred.prob[0]
 
+#********************************************************************************
+''' Batch prediction - Neural Network sklearn '''
+#********************************************************************************
+def predNNBatch(clf, A, Cl, R, le):
+    if nnDef.MLPRegressor is False:
+        prob = clf.predict_proba(R)
+        pred_class = np.argmax(prob, axis=1)
+        return Prediction('Deep Neural Networks - sklearn', le.inverse_transform(clf.classes_[pred_class]),
+            np.round(100*prob[np.arange(R.shape[0]),pred_class],4), prob,
+            le.inverse_transform(clf.classes_), nnDef.thresholdProbabilityPred)
+    score = clf.score(A,np.array(Cl,dtype=float))
+    return Prediction('Deep Neural Networks - sklearn', clf.predict(R),
+        np.full(R.shape[0], round(score,5)), scoreName='R^2')
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+**********************************************************
+*
+* SpectraLearnPredict2 - predict
+* Perform Machine Learning on Spectroscopy Data.
+*
+* Uses: Deep Neural Networks, TensorFlow, SVM, PCA, K-Means
+*
+* By: Nicola Ferralis <feranick@hotmail.com>
+*
+***********************************************************
+'''
+
+import numpy as np
+
+from .slp_config import *
+from .slp_preprocess import *
+from .slp_dnntf import *
+from .slp_tf import *
+from .slp_keras import *
+from .slp_nn import *
+from .slp_svm import *
+from .slp_kmeans import *
+
+#**********************************************
+''' Predictor
+    Runs each trained backend on an (N x P)
+    matrix of preprocessed spectra, with one
+    call per backend. Backends are those in
+    models (see trainBatchModels). predict()
+    returns a Prediction for each, keyed as in
+    the map files. Printing is left to report(). '''
+#**********************************************
+class Predictor():
+    def __init__(self, models, A, Cl, learnFileRoot):
+        self.models = models
+        self.A = A
+        self.Cl = Cl
+        self.learnFileRoot = learnFileRoot
+
+    def predict(self, R):
+        preds = {}
+        if 'dnntf' in self.models:
+            clf_dnntf, le_dnntf = self.models['dnntf']
+            if dnntfDef.runSkflowDNNTF == False:
+                preds['DNN-TF'] = predDNNTFBatch(clf_dnntf, le_dnntf, R, self.Cl)
+            else:
+                preds['DNN-TF'] = predDNNTF2Batch(clf_dnntf, le_dnntf, R, self.Cl)
+
+        if 'keras' in self.models:
+            model_keras, le_keras = self.models['keras']
+            preds['Keras'] = predKerasBatch(model_keras, le_keras, R, self.Cl)
+
+        if 'nn' in self.models:
+            clf_nn, le_nn = self.models['nn']
+            preds['NN'] = predNNBatch(clf_nn, self.A, self.Cl, R, le_nn)
+
+        if 'svm' in self.models:
+            clf_svm, le_svm = self.models['svm']
+            preds['svm'] = predSVMBatch(clf_svm, self.A, self.Cl, R, le_svm)
+
+        if 'tf' in self.models:
+            preds['TF'] = predTFBatch(self.A, self.Cl, R, self.models['tf'])
+
+        if 'km' in self.models:
+            preds['KM'] = Prediction('K-Means', self.models['km'].predict(R), np.zeros(R.shape[0]))
+        return preds
+
+    # Print the results for spectrum i
+    def report(self, preds, i=0):
+        for name, pred in preds.items():
+            if name == 'KM':
+                printKMPrediction(self.models['km'], self.Cl, pred.value[i])
+            else:
+                printPrediction(pred, i)
+
+    # Row of the batch summary for spectrum i
+    def summary(self, preds, i=0):
+        row = []
+        for name, pred in preds.items():
+            if name == 'KM':
+                row.append(pred.value[i])
+            else:
+                row.extend([pred.value[i], pred.prob[i]])
+        return row
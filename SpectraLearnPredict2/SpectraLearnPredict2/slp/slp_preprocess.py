@@ -32,10 +32,19 @@ from .slp_config import *
 def readLearnFile(learnFile):
     try:
         if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
+            # Copy-on-write memory map: pages are shared through the OS
+            # cache and only rows modified by preprocessing are copied
+            M = np.load(learnFile, mmap_mode='c')
         elif os.path.splitext(learnFile)[1] == ".h5":
             with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
+                if "M" in hf:
+                    M = hf["M"][:]
+                else:
+                    # v2 layout: En, Cl and chunked A stored separately
+                    M = np.zeros((hf["A"].shape[0]+1, hf["A"].shape[1]+1))
+                    M[0,1:] = hf["En"][:]
+                    M[1:,0] = hf["Cl"][:]
+                    hf["A"].read_direct(M, dest_sel=np.s_[1:,1:])
         else:
             with open(learnFile, 'r') as f:
                 M = np.loadtxt(f, unpack =False)
@@ -56,19 +65,7 @@ def readLearnFile(learnFile):
     Cl = M[1:,0]
 
     if preprocDef.cherryPickEnPoint == True and preprocDef.enRestrictRegion == False:
-        Atemp = A[:,range(len(preprocDef.enSel))]
-        enPoints = list(preprocDef.enSel)
-        enRange = list(preprocDef.enSel)
-
-        for i in range(0, len(preprocDef.enSel)):
-            enRange[i] = np.where((En<float(preprocDef.enSel[i]+preprocDef.enSelDelta[i])) & (En>float(preprocDef.enSel[i]-preprocDef.enSelDelta[i])))[0].tolist()
-
-            for j in range(0, A.shape[0]):
-                Atemp[j,i] = A[j,A[j,enRange[i]].tolist().index(max(A[j, enRange[i]].tolist()))+enRange[i][0]]
-
-            enPoints[i] = int(np.average(enRange[i]))
-        A = Atemp
-        En = En[enPoints]
+        A, En = cherryPick(A, En)
 
         if type == 0:
             print( ' Cheery picking points in the spectra\n')
@@ -89,6 +86,41 @@ def readLearnFile(learnFile):
     print(' Number of unique classes = ' + str(len(np.unique(Cl))) + '\n')
     return En, Cl, A, YnormXind
 
+#**********************************************************************************
+''' Cherry-picked energy points
+    The enSel/enSelDelta windows are turned into index
+    ranges once per energy axis (cached), then the maximum
+    of each window is taken for all spectra in one pass. '''
+#**********************************************************************************
+cherryPickPlans = {}
+
+def cherryPickPlan(En):
+    key = np.asarray(En).tobytes()
+    if key not in cherryPickPlans:
+        start = np.empty(len(preprocDef.enSel), dtype=int)
+        stop = np.empty(len(preprocDef.enSel), dtype=int)
+        for i in range(0, len(preprocDef.enSel)):
+            enRange = np.where((En<float(preprocDef.enSel[i]+preprocDef.enSelDelta[i])) & (En>float(preprocDef.enSel[i]-preprocDef.enSelDelta[i])))[0]
+            start[i], stop[i] = enRange[0], enRange[-1]+1
+        enPoints = ((start + stop - 1)/2).astype(int)
+        cherryPickPlans[key] = (start, stop, enPoints)
+    return cherryPickPlans[key]
+
+def cherryPick(A, En):
+    start, stop, enPoints = cherryPickPlan(En)
+    A = np.atleast_2d(A)
+    ind = np.column_stack((start, stop)).ravel()
+    if np.all(np.diff(ind) > 0):
+        # Disjoint, ordered windows: one reduceat over [start, stop) pairs
+        if ind[-1] == A.shape[1]:
+            ind = ind[:-1]
+        Atemp = np.maximum.reduceat(A, ind, axis=1)[:,::2]
+    else:
+        Atemp = np.empty((A.shape[0], start.shape[0]), dtype=A.dtype)
+        for i in range(0, start.shape[0]):
+            Atemp[:,i] = np.amax(A[:,start[i]:stop[i]], axis=1)
+    return Atemp, En[enPoints]
+
 #**********************************************
 ''' Open prediction file '''
 #**********************************************
@@ -105,19 +137,37 @@ def readPredFile(sampleFile):
     Rx=Rtot[0,:]
 
     if preprocDef.cherryPickEnPoint == True and preprocDef.enRestrictRegion == False:
-        Rtemp = R[range(len(preprocDef.enSel))]
-        enPoints = list(preprocDef.enSel)
-        enRange = list(preprocDef.enSel)
-        for i in range(0, len(preprocDef.enSel)):
-            enRange[i] = np.where((Rx<float(preprocDef.enSel[i]+preprocDef.enSelDelta[i])) & (Rx>float(preprocDef.enSel[i]-preprocDef.enSelDelta[i])))[0].tolist()
-            Rtemp[i] = R[R[enRange[i]].tolist().index(max(R[enRange[i]].tolist()))+enRange[i][0]]
-
-            enPoints[i] = int(np.average(enRange[i]))
-        R = Rtemp
-        Rx = Rx[enPoints]
+        R, Rx = cherryPick(R, Rx)
+        R = R[0]
 
     return R, Rx
 
+#**********************************************************************************
+''' Intensity normalization
+    Scales each row of A in place so its maximum within
+    YnormXind (all points if None) equals YnormTo. Rows with
+    non-positive values are first shifted above zero.
+    Float arrays (float32 included) are kept in their dtype;
+    rows are processed in blocks of chunkRows, so memory-mapped
+    matrices are normalized without loading them at once. '''
+#**********************************************************************************
+def normalizeSpectra(A, YnormTo, YnormXind=None, shiftPositive=True, chunkRows=4096):
+    if not np.issubdtype(np.asarray(A).dtype, np.floating):
+        A = np.asarray(A, dtype=float)
+    for i in range(0, A.shape[0], chunkRows):
+        a = A[i:i+chunkRows]
+        if shiftPositive == True:
+            amin = np.amin(a, axis=1)
+            neg = amin <= 0
+            if neg.any():
+                a[neg] -= (amin[neg] - 1e-8)[:,None]
+        if YnormXind is None:
+            ref = np.amax(a, axis=1)
+        else:
+            ref = np.amax(a[:,YnormXind], axis=1)
+        a *= (YnormTo/ref)[:,None].astype(a.dtype)
+    return A
+
 #**********************************************************************************
 ''' Preprocess Learning data '''
 #**********************************************************************************
@@ -140,10 +190,7 @@ def preProcessNormLearningData(A, En, Cl, YnormXind, type):
                 print('  Normalizing spectral intensity to: ' + str(preprocDef.YnormTo) + '; En = [' + str(preprocDef.YnormX-preprocDef.YnormXdelta) + ', ' + str(preprocDef.YnormX+preprocDef.YnormXdelta) + ']')
             else:
                 print('  Normalizing spectral intensity to: ' + str(preprocDef.YnormTo) + '; to max intensity in spectra')
-        for i in range(0,A.shape[0]):
-            if(np.amin(A[i]) <= 0):
-                A[i,:] = A[i,:] - np.amin(A[i,:]) + 1e-8
-            A[i,:] = np.multiply(A[i,:], preprocDef.YnormTo/A[i,A[i][YnormXind].tolist().index(max(A[i][YnormXind].tolist()))+YnormXind[0]])
+        A = normalizeSpectra(A, preprocDef.YnormTo, YnormXind)
 
     if preprocDef.StandardScalerFlag == True:
         print('  Using StandardScaler from sklearn ')
@@ -196,8 +243,7 @@ def preProcessNormPredData(R, Rx, En, YnormXind, type):
     
         if(np.amin(R) <= 0):
             print('  Spectra max below zero detected')
-            R[0,:] = R[0,:] - np.amin(R[0,:]) + 1e-8
-        R[0,:] = np.multiply(R[0,:], preprocDef.YnormTo/R[0,R[0][YnormXind].tolist().index(max(R[0][YnormXind].tolist()))+YnormXind[0]])
+        R = normalizeSpectra(R, preprocDef.YnormTo, YnormXind)
 
     if preprocDef.StandardScalerFlag == True:
         print('  Using StandardScaler from sklearn ')
@@ -222,6 +268,51 @@ def preProcessNormPredData(R, Rx, En, YnormXind, type):
                 print( '  Using full energy range: [' + str(En[0]) + ', ' + str(En[En.shape[0]-1]) + ']\n')
     return R, Rorig
 
+#**********************************************************************************
+''' Preprocess prediction data - whole matrix (maps)
+    Same steps as preProcessNormPredData, applied to
+    all rows of R at once '''
+#**********************************************************************************
+def preProcessNormPredMatrix(R, Rx, En, YnormXind, type):
+    if type == 0:
+        print(' Processing Prediction data matrix... ')
+    if(R.shape[1] != En.shape[0]) or not np.array_equal(Rx, En):
+        if type == 0:
+            print('\033[1m' + '  WARNING: Different x-axis for training (' + str(En.shape[0]) + ') and sample (' + str(R.shape[1]) + ') data.\n  Reformatting x-axis of sample data...\n' + '\033[0m')
+        R = interpMatrix(En, Rx, R)
+    else:
+        R = np.array(R, dtype=float)
+    Rorig = np.copy(R)
+
+    if preprocDef.Ynorm == True:
+        if type == 0:
+            if preprocDef.fullYnorm == False:
+                print('  Normalizing spectral intensity to: ' + str(preprocDef.YnormTo) + '; En = [' + str(preprocDef.YnormX-preprocDef.YnormXdelta) + ', ' + str(preprocDef.YnormX+preprocDef.YnormXdelta) + ']')
+            else:
+                print('  Normalizing spectral intensity to: ' + str(preprocDef.YnormTo) + '; to max intensity in spectra')
+        R = normalizeSpectra(R, preprocDef.YnormTo, YnormXind)
+
+    if preprocDef.StandardScalerFlag == True:
+        if type == 0:
+            print('  Using StandardScaler from sklearn ')
+        R = preprocDef.scaler.transform(R)
+
+    if preprocDef.enRestrictRegion == True:
+        En = En[preprocDef.enLim1:preprocDef.enLim2]
+        R = R[:,preprocDef.enLim1:preprocDef.enLim2]
+        if type == 0:
+            print( '  Restricting energy range between: [' + str(En[0]) + ', ' + str(En[En.shape[0]-1]) + ']\n')
+    elif type == 0:
+        print( '  Using full energy range: [' + str(En[0]) + ', ' + str(En[En.shape[0]-1]) + ']\n')
+    return R, Rorig
+
+# Linear interpolation of every row of R from Rx onto En
+# (equivalent to np.interp applied row by row)
+def interpMatrix(En, Rx, R):
+    idx = np.clip(np.searchsorted(Rx, En), 1, len(Rx)-1)
+    w = np.clip((En - Rx[idx-1])/(Rx[idx] - Rx[idx-1]), 0, 1)
+    return R[:,idx-1]*(1-w) + R[:,idx]*w
+
 #**********************************************************************************
 ''' Preprocess prediction data '''
 #**********************************************************************************
@@ -243,8 +334,7 @@ def preProcessNormMap(A, En, type):
     if preprocDef.Ynorm == True:
         if type == 0:
             print(' Normalizing spectral intensity to: ' + str(preprocDef.YnormTo) + '; En = [' + str(preprocDef.YnormX-preprocDef.YnormXdelta) + ', ' + str(preprocDef.YnormX+preprocDef.YnormXdelta) + ']')
-        for i in range(0,A.shape[0]):
-            A[i,:] = np.multiply(A[i,:], preprocDef.YnormTo/np.amax(A[i]))
+        A = normalizeSpectra(A, preprocDef.YnormTo, shiftPositive=False)
 
 
     if preprocDef.StandardScalerFlag == True:
@@ -280,19 +370,115 @@ def formatSubset(A, Cl, percent):
 ####################################################################
 def readPredMap(mapFile):
     try:
-        with open(mapFile, 'r') as f:
-            En = np.array(f.readline().split(), dtype=np.dtype(float))
-            A = np.loadtxt(f, unpack =False)
+        M = loadPredMapCache(mapFile)
+        if M is not None:
+            X, Y, A, En = M[1:,0], M[1:,1], M[1:,2:], M[0,2:]
+        else:
+            En = readPredMapEn(mapFile)
+            numRows = countPredMapRows(mapFile)
+            X = np.empty(numRows)
+            Y = np.empty(numRows)
+            A = np.empty((numRows, En.shape[0]))
+            i = 0
+            for x, y, a in readPredMapChunks(mapFile):
+                X[i:i+x.shape[0]], Y[i:i+x.shape[0]], A[i:i+x.shape[0]] = x, y, a
+                i += x.shape[0]
     except:
         print('\033[1m' + ' Map data file not found \n' + '\033[0m')
         return
 
-    X = A[:,0]
-    Y = A[:,1]
-    A = np.delete(A, np.s_[0:2], 1)
     print(' Shape map: ' + str(A.shape))
     return X, Y, A, En
 
+#**********************************************
+''' Streaming map reader
+    Yields (X, Y, spectra) in blocks of
+    sysDef.mapChunkRows pixels. With
+    sysDef.mapCache, the text map is converted
+    once into a memory-mappable .npy file
+    (row 0: [0, 0, En]; rows 1..: [X, Y, spectrum])
+    that is reused while newer than the map. '''
+#**********************************************
+def readPredMapChunks(mapFile, chunkRows=None):
+    if chunkRows is None:
+        chunkRows = sysDef.mapChunkRows
+    M = loadPredMapCache(mapFile)
+    if M is not None:
+        for i in range(1, M.shape[0], chunkRows):
+            block = np.array(M[i:i+chunkRows])
+            yield block[:,0], block[:,1], block[:,2:]
+        return
+    for block in readPredMapText(mapFile, chunkRows):
+        yield block[:,0], block[:,1], block[:,2:]
+
+def readPredMapText(mapFile, chunkRows):
+    from itertools import islice
+    with open(mapFile, 'r') as f:
+        numCols = len(f.readline().split()) + 2
+        while True:
+            lines = list(islice(f, chunkRows))
+            if not lines:
+                break
+            block = np.fromstring(''.join(lines), sep=' ')
+            if block.size % numCols != 0:
+                block = np.loadtxt(lines, ndmin=2)
+            yield block.reshape(-1, numCols)
+
+def readPredMapEn(mapFile):
+    M = openPredMapCache(mapFile)
+    if M is not None:
+        return np.array(M[0,2:])
+    with open(mapFile, 'r') as f:
+        return np.array(f.readline().split(), dtype=np.dtype(float))
+
+def countPredMapRows(mapFile):
+    with open(mapFile, 'r') as f:
+        f.readline()
+        return sum(1 for line in f if line.strip())
+
+def predMapCacheName(mapFile):
+    return os.path.splitext(mapFile)[0] + '_map-cache.npy'
+
+# Existing cache, if newer than the map, else None
+def openPredMapCache(mapFile):
+    cacheFile = predMapCacheName(mapFile)
+    if os.path.isfile(cacheFile) and os.path.getmtime(cacheFile) >= os.path.getmtime(mapFile):
+        return np.load(cacheFile, mmap_mode='c')
+    return None
+
+# Existing cache, or a new one when sysDef.mapCache is set
+def loadPredMapCache(mapFile):
+    M = openPredMapCache(mapFile)
+    if M is None and sysDef.mapCache == True:
+        M = makePredMapCache(mapFile)
+    return M
+
+def makePredMapCache(mapFile):
+    cacheFile = predMapCacheName(mapFile)
+    print(' Converting map into binary cache: ' + cacheFile)
+    En = readPredMapEn(mapFile)
+    numRows = countPredMapRows(mapFile)
+    # Filled under a temporary name, so that an interrupted
+    # conversion never leaves a cache of zero rows
+    tmpFile = cacheFile + '.tmp'
+    try:
+        M = np.lib.format.open_memmap(tmpFile, mode='w+', dtype=np.float64,
+            shape=(numRows+1, En.shape[0]+2))
+        M[0,:2] = 0
+        M[0,2:] = En
+        i = 1
+        for block in readPredMapText(mapFile, sysDef.mapChunkRows):
+            M[i:i+block.shape[0]] = block
+            i += block.shape[0]
+        M.flush()
+        del M
+        os.replace(tmpFile, cacheFile)
+    except BaseException:
+        if os.path.exists(tmpFile):
+            os.remove(tmpFile)
+        raise
+    return np.load(cacheFile, mmap_mode='c')
+
 ####################################################################
 ''' Save map files '''
 ####################################################################
@@ -309,6 +495,14 @@ def saveMap(file, type, extension, s, x1, y1, comma):
         coord_file.write('{:}\n'.format(s))
         coord_file.close()
 
+# Write a whole map column in a single buffered write
+def saveMapBatch(file, type, extension, s, X, Y, comma):
+    inputFile = saveMapName(file, type, extension, comma)
+    sep = ',' if comma==True else '\t'
+    with open(inputFile, "a") as coord_file:
+        coord_file.write(''.join(['{:}{sep}{:}{sep}{:}\n'.format(x1, y1, s1, sep=sep)
+            for x1, y1, s1 in zip(X, Y, s)]))
+
 def saveMapName(file, type, extension, comma):
     if comma==True:
         extension2 = '_map.csv'
@@ -320,16 +514,15 @@ def saveMapName(file, type, extension, comma):
 #************************************
 ''' Plot Probabilities'''
 #************************************
-def plotProb(clf, R):
-    prob = clf.predict_proba(R)[0].tolist()
+def plotProb(pred, i=0):
+    prob = 100*pred.probs[i]
     print(' Probabilities of this sample within each class: \n')
-    for i in range(0,clf.classes_.shape[0]):
-        print(' ' + str(clf.classes_[i]) + ': ' + str(round(100*prob[i],2)) + '%')
+    for j in range(0,pred.classes.shape[0]):
+        print(' ' + str(pred.classes[j]) + ': ' + str(round(prob[j],2)) + '%')
     import matplotlib.pyplot as plt
     print('\n Stand by: Plotting probabilities for each class... \n')
     plt.title('Probability density per class')
-    for i in range(0, clf.classes_.shape[0]):
-        plt.scatter(clf.classes_[i], round(100*prob[i],2), label='probability', c = 'red')
+    plt.scatter(pred.classes, np.round(prob,2), label='probability', c = 'red')
     plt.grid(True)
     plt.xlabel('Class')
     plt.ylabel('Probability [%]')
@@ -413,6 +606,58 @@ def runClassReport(clf, A, Cl):
           ' sample will be correctly classified for a given class. f1-score combines both \n' +
           ' accuracy and precision to give a single measure of relevancy of the classifier results.\n')
 
+#************************************
+''' Batched predictions
+    Results of one backend for N spectra:
+    value: predicted label (or value)
+    prob: probability [%] of value (score
+        for regressors, 0 if none)
+    probs: N x C probabilities, columns
+        ordered as classes (None for
+        regressors) '''
+#************************************
+class Prediction():
+    def __init__(self, name, value, prob, probs=None, classes=None,
+            threshold=0, scoreName='probability'):
+        self.name = name
+        self.value = np.asarray(value)
+        self.prob = np.asarray(prob)
+        self.probs = probs
+        self.classes = None if classes is None else np.asarray(classes)
+        self.threshold = threshold
+        self.scoreName = scoreName
+
+    def __len__(self):
+        return self.value.shape[0]
+
+    # Top k classes and probabilities [%], best first
+    def topk(self, k=5):
+        if self.probs is None:
+            return self.value[:,None], self.prob[:,None]
+        k = min(k, self.probs.shape[1])
+        ind = np.argsort(-self.probs, axis=1)[:,:k]
+        return self.classes[ind], 100*np.take_along_axis(self.probs, ind, axis=1)
+
+#************************************
+''' Print prediction of spectrum i '''
+#************************************
+def printPrediction(pred, i=0):
+    if pred.probs is not None:
+        rosterPred = np.where(100*pred.probs[i] > pred.threshold)[0]
+        print('\n  ==============================')
+        print('  \033[1m'+pred.name+'\033[0m - Probability >',str(pred.threshold),'%')
+        print('  ==============================')
+        print('  Prediction\tProbability [%]')
+        for j in rosterPred:
+            print(' ',str(pred.classes[j]),'\t\t',str('{:.4f}'.format(100*pred.probs[i][j])))
+        print('  ==============================')
+    if pred.prob[i] != 0:
+        print('\033[1m' + '\n Predicted value (' + pred.name + ') = ' + str(pred.value[i]) +
+            '  (' + pred.scoreName + ' = ' + str(pred.prob[i]) +
+            ('%' if pred.probs is not None else '') + ')\033[0m\n')
+    else:
+        print('\033[1m' + '\n Predicted value (' + pred.name + ') = ' + str(pred.value[i]) + '\033[0m\n')
+
 #************************************
 ''' Introduce Noise in Data '''
 #************************************
@@ -421,3 +666,14 @@ def scrambleNoise(A, offset):
     for i in range(A.shape[1]):
         A[:,i] += offset*uniform(-1,1)
 
+
+#************************************
+''' Threads of TensorFlow sessions
+    Limited to sysDef.backendThreads
+    when set (concurrent training) '''
+#************************************
+def limitThreadsTF(conf):
+    if sysDef.backendThreads > 0:
+        conf.intra_op_parallelism_threads = sysDef.backendThreads
+        conf.inter_op_parallelism_threads = 1
+    return conf
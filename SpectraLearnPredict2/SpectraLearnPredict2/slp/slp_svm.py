@@ -24,6 +24,8 @@ from os import rename
 from datetime import datetime, date
 
 from .slp_config import *
+from .slp_preprocess import *
+from .slp_cache import *
 
 #********************************************************************************
 ''' Support Vector Machines - SVM '''
@@ -37,9 +39,15 @@ def trainSVM(A, Cl, A_test, Cl_test, Root):
     from sklearn import preprocessing
     
     print('==========================================================================\n')
-    print('\033[1m Running Support Vector Machine (kernel: ' + svmDef.kernel + ')\033[0m')
+    print('\033[1m Running Support Vector Machine (mode: ' + svmDef.mode + ', kernel: ' + svmDef.kernel + ')\033[0m')
     
-    svmTrainedData = Root + '.svmModel.pkl'
+    cache = cachedModel('svm', svmDef, A, Cl, A_test, Cl_test, svmDef.alwaysRetrain)
+    if cache is not None:
+        learnFile, Root = Root, os.path.join(cache.path, 'model')
+    if svmDef.mode == 'svc':
+        svmTrainedData = Root + '.svmModel.pkl'
+    else:
+        svmTrainedData = Root + '.svmModel-' + svmDef.mode + '.pkl'
     model_le = Root + '.svmLabelEnc.pkl'
 
     le = preprocessing.LabelEncoder()
@@ -62,46 +70,125 @@ def trainSVM(A, Cl, A_test, Cl_test, Root):
         ''' Retrain training model if not available'''
         #**********************************************
         print('  Retraining SVM data...')
-        clf = svm.SVC(C = svmDef.Cfactor, decision_function_shape = 'ovr', probability=True, gamma='auto')
-        
         print("  Training on the full training dataset\n")
-        clf.fit(A,Cl2)
+        clf = fitSVM(A, Cl2)
         accur = clf.score(A_test,Cl2_test)
         print('  Mean accuracy: ',100*accur,'%')
 
-        Z = clf.decision_function(A)
-        print('\n  Number of classes = ' + str(Z.shape[1]))
+        print('\n  Number of classes = ' + str(clf.classes_.shape[0]))
         joblib.dump(clf, svmTrainedData)
         joblib.dump(le, model_le)
         if svmDef.showClasses == True:
             print('  List of classes: ' + str(clf.classes_))
 
+    if cache is not None:
+        cache.commit(learnFile)
     print('==========================================================================\n')
     return clf, le
 
 #********************************************************************************
-''' Predict using SVM '''
+''' Build and fit the SVM selected by svmDef.mode
+    svc: kernel SVM (scales ~quadratically with spectra)
+    linear: linear SVM
+    nystroem, rff: approximate RBF kernel features
+        (Nystroem, random Fourier) with a linear SVM
+    Probabilities (svmDef.calibration):
+    cv: Platt scaling, k-fold (SVC: internal 5-fold)
+    holdout: Platt scaling on a held-out split, one fit
+    none: softmax of the decision function
+    Calibration needs spectra of each class in every
+    split: with fewer than 3 per class, cv uses as many
+    folds as the smallest class allows; with a single
+    spectrum in a class, cv (linear modes) and holdout
+    fall back to none. '''
 #********************************************************************************
-def predSVM(clf, A, Cl, R, le):
-    R_pred_le = clf.predict(R)
-    prob = clf.predict_proba(R)[0].tolist()
+def fitSVM(A, Cl2):
+    from sklearn import svm
+    from sklearn.pipeline import make_pipeline
+    from sklearn.calibration import CalibratedClassifierCV
+
+    gamma = svmDef.gamma
+    if gamma == 'auto':
+        gamma = 1/A.shape[1]
+    else:
+        gamma = float(gamma)
+
+    calibration, cv = svmDef.calibration, 3
+    minClass = np.unique(Cl2, return_counts=True)[1].min()
+    splitCalibration = calibration == 'holdout' or (calibration == 'cv' and svmDef.mode != 'svc')
+    if splitCalibration and minClass == 1:
+        calibration = 'none'
+        print('  Smallest class has 1 spectrum: too few for calibration (' +
+            svmDef.calibration + '), using softmax of the decision function')
+    elif calibration == 'cv' and svmDef.mode != 'svc' and minClass == 2:
+        cv = 2
+        print('  Smallest class has 2 spectra: calibrating with 2 folds')
 
-    if R_pred_le.size >0:
-        R_pred = le.inverse_transform(R_pred_le)
+    if svmDef.mode == 'svc':
+        base = svm.SVC(C = svmDef.Cfactor, kernel = svmDef.kernel, decision_function_shape = 'ovr',
+            probability = calibration == 'cv', gamma = gamma)
+        if calibration == 'cv':
+            return base.fit(A,Cl2)
     else:
-        R_pred = 0
-    rosterPred = np.where(clf.predict_proba(R)[0]>svmDef.thresholdProbabilitySVMPred/100)[0]
-
-    print('  ================================')
-    print('  \033[1mSVM\033[0m - Probability >',str(svmDef.thresholdProbabilitySVMPred),'%')
-    print('  ================================')
-    print('  Prediction\t| Probability [%]')
-    for i in range(rosterPred.shape[0]):
-        print("  {0:.2f}\t\t| {1:.1f}".format(np.unique(Cl)[rosterPred][i],100*clf.predict_proba(R)[0][rosterPred][i]))
-    print('  ================================')
-
-    print('\033[1m' + '\n Predicted value (SVM) = ' + str(R_pred[0]) + ' (probability = ' +
-      str(round(100*max(prob),1)) + '%)\033[0m\n')
+        # Features seen by the linear SVM
+        numFeatures = A.shape[1]
+        if svmDef.mode == 'nystroem':
+            numFeatures = min(svmDef.components, A.shape[0])
+        elif svmDef.mode == 'rff':
+            numFeatures = svmDef.components
+        base = svm.LinearSVC(C = svmDef.Cfactor, dual = A.shape[0] <= numFeatures)
+        if svmDef.mode == 'nystroem':
+            from sklearn.kernel_approximation import Nystroem
+            base = make_pipeline(Nystroem(gamma=gamma, n_components=svmDef.components, random_state=0), base)
+        elif svmDef.mode == 'rff':
+            from sklearn.kernel_approximation import RBFSampler
+            base = make_pipeline(RBFSampler(gamma=gamma, n_components=svmDef.components, random_state=0), base)
+        if calibration == 'cv':
+            return CalibratedClassifierCV(base, method='sigmoid', cv=cv).fit(A,Cl2)
+
+    if calibration == 'holdout':
+        # Fit on 80% of the spectra (at least one per class), calibrate on the rest
+        ind = np.random.RandomState(0).permutation(A.shape[0])
+        first = np.zeros(ind.size, dtype=bool)
+        first[np.unique(Cl2[ind], return_index=True)[1]] = True
+        ind = np.concatenate((ind[first], ind[~first]))
+        split = max(int(0.8*A.shape[0]), int(first.sum()))
+        base.fit(A[ind[:split]],Cl2[ind[:split]])
+        return CalibratedClassifierCV(base, method='sigmoid', cv='prefit').fit(A[ind[split:]],Cl2[ind[split:]])
+    return SoftmaxSVM(base.fit(A,Cl2))
+
+#********************************************************************************
+''' Probabilities as softmax of the decision function
+    of a fitted classifier (no calibration fit) '''
+#********************************************************************************
+class SoftmaxSVM():
+    def __init__(self, clf):
+        self.clf = clf
+        self.classes_ = clf.classes_
+
+    def decision_function(self, A):
+        Z = self.clf.decision_function(A)
+        if Z.ndim == 1:
+            Z = np.vstack((-Z, Z)).T
+        return Z
+
+    def predict_proba(self, A):
+        Z = self.decision_function(A)
+        Z = np.exp(Z - np.amax(Z, axis=1, keepdims=True))
+        return Z/np.sum(Z, axis=1, keepdims=True)
+
+    def predict(self, A):
+        return self.classes_[np.argmax(self.decision_function(A), axis=1)]
+
+    def score(self, A, Cl2):
+        return np.mean(self.predict(A) == Cl2)
+
+#********************************************************************************
+''' Predict using SVM '''
+#********************************************************************************
+def predSVM(clf, A, Cl, R, le):
+    pred = predSVMBatch(clf, A, Cl, R, le)
+    printPrediction(pred)
     
     #**************************************
     ''' SVM Classification Report '''
@@ -114,9 +201,19 @@ def predSVM(clf, A, Cl, R, le):
     ''' Plot probabilities '''
     #*************************
     if plotDef.showProbPlot == True:
-        plotProb(clf, R)
+        plotProb(pred)
 
-    return R_pred[0], round(100*max(prob),1)
+    return pred.value[0], pred.prob[0]
+
+#********************************************************************************
+''' Batch prediction - SVM '''
+#********************************************************************************
+def predSVMBatch(clf, A, Cl, R, le):
+    prob = clf.predict_proba(R)
+    pred_class = np.argmax(prob, axis=1)
+    return Prediction('SVM', le.inverse_transform(clf.classes_[pred_class]),
+        np.round(100*prob[np.arange(R.shape[0]),pred_class],1), prob,
+        le.inverse_transform(clf.classes_), svmDef.thresholdProbabilitySVMPred)
 
 #********************************************************************************
 ''' Run PCA '''
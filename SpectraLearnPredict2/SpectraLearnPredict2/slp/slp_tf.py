@@ -25,6 +25,7 @@ from os import rename
 from datetime import datetime, date
 
 from .slp_config import *
+from .slp_preprocess import *
 
 #********************************************************************************
 ''' TensorFlow '''
@@ -83,7 +84,7 @@ def trainTF(A, Cl, A_test, Cl_test, Root):
         print(' Using fix learning rate:', tfDef.learnRate, '\n')
         train_step = tf.train.GradientDescentOptimizer(tfDef.learnRate).minimize(cross_entropy)
 
-    sess = tf.InteractiveSession()
+    sess = tf.InteractiveSession(config=limitThreadsTF(tf.ConfigProto()))
     tf.global_variables_initializer().run()
     
     if tfDef.enableTensorboard == True:
@@ -141,39 +142,34 @@ def trainTF(A, Cl, A_test, Cl_test, Root):
 def predTF(A, Cl, R, Root):
     print('==========================================================================\n')
     print('\033[1m Running Basic TensorFlow Prediction...\033[0m')
-    
+    pred = predTFBatch(A, Cl, R, Root)
+    printPrediction(pred)
+    return pred.value[0], pred.prob[0]
+
+#**********************************************
+''' Batch prediction - basic Tensorflow '''
+#**********************************************
+def predTFBatch(A, Cl, R, Root):
     import tensorflow as tf
-    import tensorflow.contrib.learn as skflow
-    from sklearn import preprocessing
-    
     if tfDef.logCheckpoint == True:
         tf.logging.set_verbosity(tf.logging.INFO)
-    
     tfTrainedData = Root + '.tfmodel'
 
     x,y,y_ = setupTFmodel(A, Cl)
-    sess = tf.InteractiveSession()
+    sess = tf.InteractiveSession(config=limitThreadsTF(tf.ConfigProto()))
     tf.global_variables_initializer().run()
     print(' Opening TF training model from:', tfTrainedData)
     saver = tf.train.Saver()
     saver.restore(sess, './' + tfTrainedData)
-    
     res1 = sess.run(y, feed_dict={x: R})
-    res2 = sess.run(tf.argmax(y, 1), feed_dict={x: R})
-    
     sess.close()
-    
-    rosterPred = np.where(res1[0]>tfDef.thresholdProbabilityTFPred)[0]
-    print('\n  ==============================')
-    print('  \033[1mTF\033[0m - Probability >',str(tfDef.thresholdProbabilityTFPred),'%')
-    print('  ==============================')
-    print('  Prediction\tProbability [%]')
-    for i in range(rosterPred.shape[0]):
-        print(' ',str(np.unique(Cl)[rosterPred][i]),'\t\t',str('{:.1f}'.format(res1[0][rosterPred][i])))
-    print('  ==============================\n')
-    
-    print('\033[1m Predicted value (TF): ' + str(np.unique(Cl)[res2][0]) + ' (Probability: ' + str('{:.1f}'.format(res1[0][res2][0])) + '%)\n' + '\033[0m' )
-    return np.unique(Cl)[res2][0], res1[0][res2][0]
+
+    # The model outputs logits: softmax to probabilities
+    prob = np.exp(res1 - np.amax(res1, axis=1, keepdims=True))
+    prob /= np.sum(prob, axis=1, keepdims=True)
+    res2 = np.argmax(prob, axis=1)
+    return Prediction('TF', np.unique(Cl)[res2], np.round(100*prob[np.arange(R.shape[0]),res2],1),
+        prob, np.unique(Cl), tfDef.thresholdProbabilityTFPred)
 
 #**********************************************
 ''' Setup Tensorflow Model'''
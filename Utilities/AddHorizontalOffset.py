@@ -16,6 +16,7 @@ print(__doc__)
 
 import numpy as np
 import sys, os.path, h5py, csv
+from libSpectraData import openLearnFile, writeLearnFile, LearnFileBuilder, shiftSpectra
 
 #************************************
 ''' Main '''
@@ -35,16 +36,15 @@ def main():
     En, M = readLearnFile(sys.argv[1])
     newFile = os.path.splitext(sys.argv[1])[0] + '_n' + sys.argv[2]+ '_oH' + sys.argv[3]
 
-    if os.path.exists(newFile) == False:
-        newTrain = np.append([0], En)
-        newTrain = np.vstack((newTrain, M))
-    else:
-        newTrain = M
+    learnData = LearnFileBuilder(En, M.shape[0]*(int(sys.argv[2])+1))
+    learnData.append(M[:,0], M[:,1:])
 
     print(' Adding', sys.argv[2],'sets with horizontal offset:', sys.argv[3], '\n')
 
     for j in range(int(sys.argv[2])):
-        newTrain = np.vstack((newTrain, horizontalOffset(En, M, float(sys.argv[3]))))
+        S = horizontalOffset(En, M, float(sys.argv[3]))
+        learnData.append(S[:,0], S[:,1:])
+    newTrain = learnData.getMatrix()
 
     if defParam.Ynorm ==True:
         print(" Normalizing Learning + Noisy Spectra to:",defParam.YnormTo,"\n")
@@ -58,14 +58,7 @@ def main():
 def readLearnFile(learnFile):
     print(" Opening learning file: "+learnFile+"\n")
     try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        M = openLearnFile(learnFile, writable=True)
     except:
         print("\033[1m" + " Learning file not found \n" + "\033[0m")
         return
@@ -87,20 +80,17 @@ def saveLearnFile(M, learnFile):
     else:
         learnFile += '.h5'
         print(" Saving new training file (hdf5) in: "+learnFile+"\n")
-        with h5py.File(learnFile, 'w') as hf:
-            hf.create_dataset("M",  data=M)
+        writeLearnFile(learnFile, M)
 
 #*******************************************
 ''' Introduce Horizontal Offset in Data '''
 #*******************************************
 def horizontalOffset(En, M, offset):
-    newM = np.copy(M)
-    for i in range(0, M.shape[0]):
-        if defParam.randOffset:
-            newEn = np.add(En, offset*np.random.uniform(-1,1))
-        else:
-            newEn = np.add(En, offset)
-        newM[i,1:] = np.interp(En, newEn, M[i,1:], left = 0, right = 0)
+    newM = np.empty(M.shape)
+    newM[:,0] = M[:,0]
+    if defParam.randOffset:
+        offset = offset*np.random.uniform(-1,1, size=M.shape[0])
+    shiftSpectra(M[:,1:], En, offset, out=newM[:,1:])
     return newM
 
 #************************************
@@ -18,6 +18,7 @@ print(__doc__)
 
 import numpy as np
 import sys, os.path, h5py
+from libSpectraData import openLearnFile, writeLearnFile, LearnFileBuilder
 #************************************
 ''' Main '''
 #************************************
@@ -56,14 +57,13 @@ def main():
     #newFile += '.txt'
     En, M = readLearnFile(sys.argv[1])
 
-    if os.path.exists(newFile) == False:
-        newTrain = np.append([0], En)
-        newTrain = np.vstack((newTrain, M))
-    else:
-        newTrain = M
+    learnData = LearnFileBuilder(En, M.shape[0]*(int(sys.argv[2])+1))
+    learnData.append(M[:,0], M[:,1:])
 
     for j in range(int(sys.argv[2])):
-        newTrain = np.vstack((newTrain, linBackground(En, M, float(sys.argv[3]))))
+        S = linBackground(En, M, float(sys.argv[3]))
+        learnData.append(S[:,0], S[:,1:])
+    newTrain = learnData.getMatrix()
 
     if defParam.Ynorm ==True:
         print(" Normalizing Learning + Noisy Spectra to:",defParam.YnormTo,"\n")
@@ -77,14 +77,7 @@ def main():
 def readLearnFile(learnFile):
     print(" Opening learning file: "+learnFile+"\n")
     try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        M = openLearnFile(learnFile, writable=True)
     except:
         print("\033[1m" + " Learning file not found \n" + "\033[0m")
         return
@@ -106,8 +99,7 @@ def saveLearnFile(M, learnFile):
     else:
         learnFile += '.h5'
         print(" Saving new training file (hdf5) in: "+learnFile+"\n")
-        with h5py.File(learnFile, 'w') as hf:
-            hf.create_dataset("M",  data=M)
+        writeLearnFile(learnFile, M)
 
 #************************************
 ''' Introduce Noise in Data '''
@@ -19,6 +19,7 @@ print(__doc__)
 
 import numpy as np
 import sys, os.path, h5py
+from libSpectraData import openLearnFile, augmentSpectra, shiftSpectra
 
 #************************************
 ''' Main '''
@@ -26,6 +27,7 @@ import sys, os.path, h5py
 class defParam:
     saveAsTxt = False
     addToFlatland = False
+    seed = None     # set to the printed noise seed to reproduce a run
 
 def main():
     if len(sys.argv) < 5:
@@ -46,18 +48,14 @@ def main():
 
     En, M = readLearnFile(sys.argv[1])
 
-    if os.path.exists(newFile) == False:
-        newTrain = np.append([0], En)
-        newTrain = np.vstack((newTrain, M))
-    else:
-        newTrain = M
-
-    for j in range(int(sys.argv[2])):
-        newTrain = np.vstack((newTrain,
-                    scrambleNoise(horizontalOffset(En, M, float(sys.argv[3]), True),
-                    float(sys.argv[3]))))
-
-    saveLearnFile(newTrain, newFile)
+    offset = float(sys.argv[3])
+    horOffset = float(sys.argv[4])
+    attrs = {'noiseCopies' : int(sys.argv[2]), 'noiseRelOffset' : offset,
+        'horOffset' : horOffset}
+    learnData = augmentSpectra(En, M[:,0], M[:,1:], int(sys.argv[2]),
+        lambda rng, A: horNoise(rng, En, A, horOffset, offset),
+        defParam.seed, streamFile(newFile), attrs)
+    saveLearnFile(learnData, newFile)
 
 #************************************
 ''' Open Learning Data '''
@@ -65,14 +63,7 @@ def main():
 def readLearnFile(learnFile):
     print(" Opening learning file: "+learnFile+"\n")
     try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        M = openLearnFile(learnFile, writable=True)
     except:
         print("\033[1m" + " Learning file not found \n" + "\033[0m")
         return
@@ -85,50 +76,47 @@ def readLearnFile(learnFile):
 #***************************************
 ''' Save new learning Data '''
 #***************************************
-def saveLearnFile(M, learnFile):
+def streamFile(learnFile):
+    if defParam.saveAsTxt == True:
+        return None
+    return learnFile + '.h5'
+
+def saveLearnFile(learnData, learnFile):
     if defParam.saveAsTxt == True:
         learnFile += '.txt'
         print(" Saving new training file (txt) in:", learnFile+"\n")
         with open(learnFile, 'ab') as f:
-            np.savetxt(f, M, delimiter='\t', fmt='%10.6f')
+            np.savetxt(f, learnData.getMatrix(), delimiter='\t', fmt='%10.6f')
     else:
-        learnFile += '.h5'
-        print(" Saving new training file (hdf5) in: "+learnFile+"\n")
-        with h5py.File(learnFile, 'w') as hf:
-            hf.create_dataset("M",  data=M)
+        learnData.close()
+        print(" New training file (hdf5) saved in: "+learnData.learnFile+"\n")
 
 #************************************
 ''' Introduce Noise in Data '''
 #************************************
-def scrambleNoise(M, offset):
-    from random import uniform
-    for j in range(0, M.shape[0]):
-        for i in range(1, M.shape[1]):
-            if defParam.addToFlatland == False:
-                M[j,i] += offset*uniform(-1,1)*np.amax(M[j,:])
-            else:
-                if M[j,i].any() == 0:
-                    M[j,i] += offset*uniform(-1,1)*np.amax(M[j,:])
-    return M
+def scrambleNoise(rng, S, offset):
+    noise = offset*rng.uniform(-1,1, size=S.shape)*np.amax(S, axis=1)[:,None]
+    if defParam.addToFlatland == True:
+        noise[S != 0] = 0
+    S += noise
+    return S
 
 #*******************************************
 ''' Introduce Horizontal Offset in Data '''
 #*******************************************
-def horizontalOffset(En, M, offset, rand):
-    
-    newM = np.zeros(M.shape)
-    newM[:,0] = M[:,0]
-    newEn = np.zeros(En.shape)
-    
-    for i in range(0, M.shape[0]):
-        if rand is True:
-            from random import uniform
-            newEn = En + offset*uniform(-1,1)
-        else:
-            newEn = En + offset
-        newM[i,1:] = np.interp(En, newEn, M[i,1:], left = 0, right = 0)
-    
-    return newM
+def horizontalOffset(rng, En, S, offset, rand):
+    if rand is True:
+        offset = offset*rng.uniform(-1,1, size=S.shape[0])
+    return shiftSpectra(S, En, offset, out=S)
+
+# Shifts for the whole set are drawn first, so
+# the noise stream does not depend on the blocks
+def horNoise(rng, En, A, horOffset, offset):
+    shifts = horOffset*rng.uniform(-1,1, size=A.shape[0])
+    def addNoise(S, i):
+        horizontalOffset(rng, En, S, shifts[i:i+S.shape[0]], False)
+        return scrambleNoise(rng, S, offset)
+    return addNoise
 
 #************************************
 ''' Main initialization routine '''
@@ -17,6 +17,8 @@ print(__doc__)
 
 import numpy as np
 import sys, os.path, h5py
+from libSpectraData import openLearnFile, augmentSpectra
+from libSpectraData import normalizeSpectra as normalizeRows
 #************************************
 ''' Main '''
 #************************************
@@ -25,6 +27,7 @@ class defParam:
     addToFlatland = False
     Ynorm = True
     YnormTo = 1
+    seed = None     # set to the printed noise seed to reproduce a run
 
 def main():
     if len(sys.argv) < 4:
@@ -53,25 +56,21 @@ def main():
 
     En, M = readLearnFile(sys.argv[1])
     
+    YnormTo = None
     if defParam.Ynorm ==True:
         print(" Normalizing Learning Spectra to:",defParam.YnormTo)
-        M = normalizeSpectra(M)
+        normalizeRows(M[:,1:], defParam.YnormTo)
         newFile += '_norm1'
-
-    if os.path.exists(newFile) == False:
-        newTrain = np.append([0], En)
-        newTrain = np.vstack((newTrain, M))
-    else:
-        newTrain = M
-
-    for j in range(int(sys.argv[2])):
-        newTrain = np.vstack((newTrain, scrambleNoise(M, float(sys.argv[3]))))
-
-    if defParam.Ynorm ==True:
         print(" Normalizing Learning + Noisy Spectra to:",defParam.YnormTo,"\n")
-        newTrain = normalizeSpectra(newTrain)
+        YnormTo = defParam.YnormTo
 
-    saveLearnFile(newTrain, newFile)
+    offset = float(sys.argv[3])
+    attrs = {'Ynorm' : defParam.Ynorm, 'YnormTo' : defParam.YnormTo,
+        'noiseCopies' : int(sys.argv[2]), 'noiseRelOffset' : offset}
+    learnData = augmentSpectra(En, M[:,0], M[:,1:], int(sys.argv[2]),
+        lambda rng, A: scrambleNoise(rng, A, offset), defParam.seed,
+        streamFile(newFile), attrs, YnormTo)
+    saveLearnFile(learnData, newFile)
 
 #************************************
 ''' Open Learning Data '''
@@ -79,14 +78,7 @@ def main():
 def readLearnFile(learnFile):
     print(" Opening learning file: "+learnFile+"\n")
     try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        M = openLearnFile(learnFile, writable=True)
     except:
         print("\033[1m" + " Learning file not found \n" + "\033[0m")
         return
@@ -97,27 +89,35 @@ def readLearnFile(learnFile):
     return En, A
 
 #***************************************
-''' Save new learning Data '''
+''' Save new learning Data
+    HDF5 output is streamed while the noisy
+    copies are generated '''
 #***************************************
-def saveLearnFile(M, learnFile):
+def streamFile(learnFile):
+    if defParam.saveAsTxt == True:
+        return None
+    return learnFile + '.h5'
+
+def saveLearnFile(learnData, learnFile):
     if defParam.saveAsTxt == True:
         learnFile += '.txt'
         print(" Saving new training file (txt) in:", learnFile+"\n")
         with open(learnFile, 'ab') as f:
-            np.savetxt(f, M, delimiter='\t', fmt='%10.6f')
+            np.savetxt(f, learnData.getMatrix(), delimiter='\t', fmt='%10.6f')
     else:
-        learnFile += '.h5'
-        print(" Saving new training file (hdf5) in: "+learnFile+"\n")
-        with h5py.File(learnFile, 'w') as hf:
-            hf.create_dataset("M",  data=M)
+        learnData.close()
+        print(" New training file (hdf5) saved in: "+learnData.learnFile+"\n")
 
 #************************************
 ''' Introduce Noise in Data '''
 #************************************
-def scrambleNoise(M, offset):
-    M[:,1:] = np.multiply(M[:,1:],
-        np.abs(np.multiply(np.random.uniform(-1,1, size=(1,M.shape[1]-1)),0.01*offset*np.amax(M[:,1:], axis = 0))))
-    return M
+# One factor vector per copy, relative to the maxima of the whole set
+def scrambleNoise(rng, A, offset):
+    noise = np.abs(rng.uniform(-1,1, size=(1,A.shape[1]))*0.01*offset*np.amax(A, axis = 0))
+    def addNoise(S, i):
+        S *= noise
+        return S
+    return addNoise
 '''
 def scrambleNoiseOld(M, offset):
     from random import uniform
@@ -132,17 +132,6 @@ def scrambleNoiseOld(M, offset):
                     M[j,i] *= abs(0.01*offset*uniform(-1,1)*np.amax(M[j,:]))
     return M
 '''
-#************************************
-''' Normalize '''
-#************************************
-def normalizeSpectra(M):
-    for i in range(1,M.shape[0]):
-        if(np.amin(M[i]) <= 0):
-            M[i,1:] = M[i,1:] - np.amin(M[i,1:]) + 1e-8
-        #M[i,1:] = np.multiply(M[i,1:], defParam.YnormTo/max(M[i][1:]))
-    M[1:,1:] = np.multiply(M[1:,1:], np.array([float(defParam.YnormTo)/np.amax(M[1:,1:], axis = 1)]).T)
-    return M
-
 #************************************
 ''' Main initialization routine '''
 #************************************
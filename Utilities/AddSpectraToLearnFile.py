@@ -17,6 +17,7 @@ print(__doc__)
 
 import numpy as np
 import sys, os, os.path, h5py
+from libSpectraData import openLearnFile, writeLearnFile, readSpectrumFile, readSpectraFiles
 from datetime import datetime, date
 
 #**********************************************
@@ -25,9 +26,11 @@ from datetime import datetime, date
 def main():
     try:
         if sys.argv[3] == ".":
-            for ind, f in enumerate(sorted(os.listdir("."))):
-                if f != sys.argv[1] and f != sys.argv[2] and os.path.splitext(f)[-1] == ".txt":
-                    makeFile(sys.argv[1], sys.argv[2], f, sys.argv[4])
+            files = [f for f in sorted(os.listdir(".")) if f != sys.argv[1] and \
+                f != sys.argv[2] and os.path.splitext(f)[-1] == ".txt"]
+            spectra = readSpectraFiles(files)
+            for f, spectrum in zip(files, spectra):
+                makeFile(sys.argv[1], sys.argv[2], f, sys.argv[4], spectrum)
         else:
             makeFile(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
     except:
@@ -37,37 +40,21 @@ def main():
 #**********************************************
 ''' Make Training file '''
 #**********************************************
-def makeFile(learnFile, sampleTag, sampleFile, param):
+def makeFile(learnFile, sampleTag, sampleFile, param, spectrum=None):
     #**********************************************
     ''' Open and process training data '''
     #**********************************************
     try:
-        firstline = open(sampleFile).readline()
-        with open(sampleFile, 'r') as f:
-            if firstline[:7] == "##NAMES":
-                En = np.loadtxt(f, unpack = True, usecols=range(0,1), delimiter = ',', skiprows = 10)
-            else:
-                En = np.loadtxt(f, unpack = True, usecols=range(0,1))
-            print(' Number of points in \"' + sampleFile + '\": ' + str(En.shape[0]))
+        if spectrum is None:
+            spectrum = readSpectrumFile(sampleFile)
+        En, R = spectrum
+        print(' Number of points in \"' + sampleFile + '\": ' + str(En.shape[0]))
     except:
         print('\033[1m' + ' Sample data file not found \n' + '\033[0m')
         return
 
-    with open(sampleFile, 'r') as f:
-        if firstline[:7] == "##NAMES":
-            R = np.loadtxt(f, unpack = True, usecols=range(1,2), delimiter = ',', skiprows = 10)
-        else:
-            R = np.loadtxt(f, unpack = True, usecols=range(1,2))
-
     if os.path.exists(learnFile):
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        M = openLearnFile(learnFile)
             
         sampleSize = M.shape[0]+1
         print(' Number of samples in \"' + learnFile + '\": ' + str(sampleSize))
@@ -113,8 +100,7 @@ def saveLearnFile(M, learnFile):
             np.savetxt(f, M, delimiter='\t', fmt='%10.6f')
     elif os.path.splitext(sys.argv[1])[1] == '.h5':
         print(" Saving updated training file (hdf5) in: "+learnFile+"\n")
-        with h5py.File(learnFile, 'w') as hf:
-            hf.create_dataset("M",  data=M)
+        writeLearnFile(learnFile, M)
     elif os.path.splitext(sys.argv[1])[1] == '.npy':
         print(" Saving updated training file (npy) in: "+learnFile+"\n")
         with open(learnFile, 'ab') as f:
@@ -16,6 +16,7 @@ print(__doc__)
 
 import numpy as np
 import sys, os.path, csv, h5py
+from libSpectraData import openLearnFile, writeLearnFile, LearnFileBuilder
 #************************************
 ''' Main '''
 #************************************
@@ -31,16 +32,15 @@ def main():
     En, M = readLearnFile(sys.argv[1])
     newFile = os.path.splitext(sys.argv[1])[0] + '_n' + sys.argv[2]+ '_oV' + sys.argv[3]
 
-    if os.path.exists(newFile) == False:
-        newTrain = np.append([0], En)
-        newTrain = np.vstack((newTrain, M))
-    else:
-        newTrain = M
+    learnData = LearnFileBuilder(En, M.shape[0]*(int(sys.argv[2])+1))
+    learnData.append(M[:,0], M[:,1:])
 
     print(' Adding', sys.argv[2],'sets with vertical offset:', sys.argv[3], '\n')
 
     for j in range(int(sys.argv[2])):
-        newTrain = np.vstack((newTrain, verticalOffset(M, float(sys.argv[3]))))
+        S = verticalOffset(M, float(sys.argv[3]))
+        learnData.append(S[:,0], S[:,1:])
+    newTrain = learnData.getMatrix()
 
     saveLearnFile(newTrain, newFile)
 
@@ -50,14 +50,7 @@ def main():
 def readLearnFile(learnFile):
     print(" Opening learning file: "+learnFile+"\n")
     try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        M = openLearnFile(learnFile, writable=True)
     except:
         print("\033[1m" + " Learning file not found \n" + "\033[0m")
         return
@@ -79,8 +72,7 @@ def saveLearnFile(M, learnFile):
     else:
         learnFile += '.h5'
         print(" Saving new training file (hdf5) in: "+learnFile+"\n")
-        with h5py.File(learnFile, 'w') as hf:
-            hf.create_dataset("M",  data=M)
+        writeLearnFile(learnFile, M)
 
 #************************************
 ''' Introduce Noise in Data '''
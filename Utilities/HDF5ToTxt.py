@@ -15,6 +15,7 @@
 print(__doc__)
 import numpy as np
 import sys, os.path, h5py
+from libSpectraData import openLearnFile
 
 #************************************
 ''' Main '''
@@ -38,8 +39,7 @@ def convertLearnFile(learnFile):
     
     try:
         print(" Opening training file (hdf5): "+learnFile)
-        with h5py.File(learnFile, 'r') as hf:
-            M = hf["M"][:]
+        M = np.asarray(openLearnFile(learnFile))
     except:
         print(" Training file (hdf5) not found\n")
         return
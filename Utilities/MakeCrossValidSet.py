@@ -16,6 +16,7 @@ print(__doc__)
 
 import numpy as np
 import sys, os.path, h5py
+from libSpectraData import openLearnFile, writeLearnFile, LearnFileBuilder
 #************************************
 ''' Main '''
 #************************************
@@ -60,15 +61,13 @@ def main():
         print(" Training or cross validation test files exist. Exiting.\n")
         return
         
-    L = L.reshape(-1,1)
-    newTest = np.append([0], En)
+    L = L.astype(int)
     
     print(" Sorting spectra for training and testing according to list...")
-    for i in L:
-        newTest = np.vstack((newTest, M[int(i)]))
-    newTrain = M
-    for i in L:
-        newTrain = np.delete(newTrain, int(i), 0)
+    learnData = LearnFileBuilder(En, L.size)
+    learnData.append(M[L,0], M[L,1:])
+    newTest = learnData.getMatrix()
+    newTrain = np.delete(np.asarray(M), L, 0)
 
     saveCVFiles(newTrain, newTest, trainFile, testFile)
 
@@ -80,14 +79,7 @@ def main():
 def readLearnFile(learnFile):
     print(" Opening learning file: "+learnFile+"\n")
     try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        M = openLearnFile(learnFile)
     except:
         print("\033[1m" + " Learning file not found \n" + "\033[0m")
         return
@@ -111,11 +103,9 @@ def saveCVFiles(newTrain, newTest, trainFile, testFile):
             np.savetxt(f, newTest, delimiter='\t', fmt='%10.6f')
     else:
         print("\n Saving new training file (hdf5) in: "+trainFile)
-        with h5py.File(trainFile, 'w') as hf:
-            hf.create_dataset("M",  data=newTrain)
+        writeLearnFile(trainFile, newTrain)
         print(" Saving new cross validation file (hfd5) in:"+testFile+"\n")
-        with h5py.File(testFile, 'w') as hf:
-            hf.create_dataset("M",  data=newTest)
+        writeLearnFile(testFile, newTest)
 
 #************************************
 ''' Open Index File '''
@@ -15,6 +15,7 @@ print(__doc__)
 
 import numpy as np
 import sys, os.path, h5py
+from libSpectraData import openLearnFile, writeLearnFile, LearnFileBuilder
 #************************************
 ''' Main '''
 #************************************
@@ -32,20 +33,20 @@ def main():
 
     En, M1 = readLearnFile(sys.argv[1])
     En2, M2 = readLearnFile(sys.argv[2])
-    M = np.append([0], En)
+    learnData = LearnFileBuilder(En, M1.shape[0]+M2.shape[0])
+    learnData.append(M1[:,0], M1[:,1:])
 
     if En.shape[0] == En2.shape[0]:
         print(" Number of points in the learning datasets:", En.size)
-        M = np.vstack((M,np.vstack((M1,M2))))
+        learnData.append(M2[:,0], M2[:,1:])
     else:
         print(" Number of points per spectra (1):", En.size)
         print(" Number of points per spectra (2):", En2.size)
         print(" Converting number of points per spectra (2) into that of spectra (1)...")
-        M = np.vstack((M,M1))
         for i in range(M2.shape[0]):
-            R = np.append(float(M2[i,0]), np.interp(En, En2, M2[i,1:], left = 0, right = 0))
-            M = np.vstack((M,R))
+            learnData.append(float(M2[i,0]), np.interp(En, En2, M2[i,1:], left = 0, right = 0))
         print(" Number of points per spectra (merged):", En.size)
+    M = learnData.getMatrix()
 
     print("\n Original number of unique classes (1):", np.unique(M1[:,0]).size)
     print(" Original number of unique classes (2):", np.unique(M2[:,0]).size)
@@ -63,14 +64,7 @@ def main():
 def readLearnFile(learnFile):
     print(" Opening learning file: "+learnFile+"\n")
     try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        M = openLearnFile(learnFile)
     except:
         print("\033[1m" + " Learning file not found \n" + "\033[0m")
         return
@@ -92,8 +86,7 @@ def saveLearnFile(M, learnFile):
     else:
         learnFile += '.h5'
         print(" Saving new training file (hdf5) in: "+learnFile+"\n")
-        with h5py.File(learnFile, 'w') as hf:
-            hf.create_dataset("M",  data=M)
+        writeLearnFile(learnFile, M)
 
 #************************************
 ''' Main initialization routine '''
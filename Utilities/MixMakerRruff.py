@@ -16,6 +16,7 @@ print(__doc__)
 
 import numpy as np
 import sys, os.path, glob, csv, re, h5py
+from libSpectraData import writeLearnFile, readSpectraFiles
 from datetime import datetime, date
 import matplotlib.pyplot as plt
 
@@ -55,48 +56,48 @@ def main():
     index = 0
     first = True
 
-    for ind, file in enumerate(sorted(os.listdir("."))):
+    files = [file for file in sorted(os.listdir(".")) if file[:7] != "mixture" and \
+        os.path.splitext(file)[-1] == ".txt" and file[-10:] != "_ASCII.txt"]
+    spectra = readSpectraFiles(files)
+
+    for file, spectrum in zip(files, spectra):
         try:
-            if file[:7] != "mixture" and os.path.splitext(file)[-1] == ".txt" and file[-10:] != "_ASCII.txt":
-                with open(file, 'r') as f:
-                    En = np.loadtxt(f, unpack = True, usecols=range(0,1), delimiter = ',', skiprows = 10)
-                with open(file, 'r') as f:
-                    R = np.loadtxt(f, unpack = True, usecols=range(1,2), delimiter = ',', skiprows = 10)
+            En, R = spectrum
                     
-                R[R<float(threshold)*np.amax(R)/100] = 0
-                print('\n' + file + '\n File OK, converting to ASCII...')
+            R[R<float(threshold)*np.amax(R)/100] = 0
+            print('\n' + file + '\n File OK, converting to ASCII...')
 
-                EnT = np.arange(float(enInit), float(enFin), float(enStep), dtype=np.float)
+            EnT = np.arange(float(enInit), float(enFin), float(enStep), dtype=np.float)
             
-                if EnT.shape[0] == En.shape[0]:
-                    print(' Number of points in the learning dataset: ' + str(EnT.shape[0]))
-                else:
-                    print('\033[1m' + ' Mismatch in datapoints: ' + str(EnT.shape[0]) + '; sample = ' +  str(En.shape[0]) + '\033[0m')
-
-                # Interpolate to new axis
-                R = np.interp(EnT, En, R, left = R[0], right = 0)
-                # Renormalize offset by min R
-                R = R - np.amin(R)
-                # Renormalize to max of R
-                R = R/np.amax(R)
-                    
-                if first:
-                    mixR = R
-                    first = False
-                else:
-                    mixR = (mixR*index + R)/(index+1)
-                index += 1
+            if EnT.shape[0] == En.shape[0]:
+                print(' Number of points in the learning dataset: ' + str(EnT.shape[0]))
+            else:
+                print('\033[1m' + ' Mismatch in datapoints: ' + str(EnT.shape[0]) + '; sample = ' +  str(En.shape[0]) + '\033[0m')
+
+            # Interpolate to new axis
+            R = np.interp(EnT, En, R, left = R[0], right = 0)
+            # Renormalize offset by min R
+            R = R - np.amin(R)
+            # Renormalize to max of R
+            R = R/np.amax(R)
+                
+            if first:
+                mixR = R
+                first = False
+            else:
+                mixR = (mixR*index + R)/(index+1)
+            index += 1
 
-                print('\033[1m' + ' Mismatch corrected: datapoints in sample: ' + str(R.shape[0]) + '\033[0m')
+            print('\033[1m' + ' Mismatch corrected: datapoints in sample: ' + str(R.shape[0]) + '\033[0m')
 
-                if defParam.saveAsASCII == True:
-                    saveAsASCII(EnT,R,file)
-                
-                label = re.search('(.+?)__',file).group(1)
-                with open(summaryMixFile, "a") as sum_file:
-                    sum_file.write(str(index) + ',,,' + label + ','+file+'\n')
+            if defParam.saveAsASCII == True:
+                saveAsASCII(EnT,R,file)
+            
+            label = re.search('(.+?)__',file).group(1)
+            with open(summaryMixFile, "a") as sum_file:
+                sum_file.write(str(index) + ',,,' + label + ','+file+'\n')
     
-                plt.plot(EnT,R,label=label)
+            plt.plot(EnT,R,label=label)
         except:
             print("\n Skipping: ",file)
 
@@ -128,8 +129,7 @@ def saveMixFile(M, learnFile):
     else:
         learnFile += '.h5'
         print("\n Saving mixture file (hdf5) in:\033[1m"+learnFile+"\033[0m \n")
-        with h5py.File(learnFile, 'w') as hf:
-            hf.create_dataset("M",  data=M)
+        writeLearnFile(learnFile, M)
 
 #***************************************
 ''' Save mixture file in ASCII '''
@@ -16,6 +16,8 @@ print(__doc__)
 
 import numpy as np
 import sys, os.path, h5py, time
+from libSpectraData import openLearnFile, writeLearnFile
+from libSpectraData import normalizeSpectra as normalizeRows
 #************************************
 ''' Main '''
 #************************************
@@ -47,14 +49,7 @@ def main():
 def readLearnFile(learnFile):
     print(" Opening learning file: "+learnFile+"\n")
     try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        M = openLearnFile(learnFile, writable=True)
     except:
         print("\033[1m" + " Learning file not found \n" + "\033[0m")
         return
@@ -73,19 +68,15 @@ def saveLearnFile(M, learnFile):
     else:
         learnFile += '.h5'
         print(" Saving new training file (hdf5) in: "+learnFile+"\n")
-        with h5py.File(learnFile, 'w') as hf:
-            hf.create_dataset("M",  data=M)
+        writeLearnFile(learnFile, M, attrs={'Ynorm' : True,
+            'YnormTo' : float(defParam.YnormTo)})
 
 #************************************
 ''' Normalize '''
 #************************************
 def normalizeSpectra(M):
     print(" Normalizing max spectral intensity to:",defParam.YnormTo,"\n")
-    for i in range(1,M.shape[0]):
-        if(np.amin(M[i]) <= 0):
-            M[i,1:] = M[i,1:] - np.amin(M[i,1:]) + 1e-8
-        #M[i,1:] = np.multiply(M[i,1:], float(defParam.YnormTo)/max(M[i,1:]))
-    M[1:,1:] = np.multiply(M[1:,1:], np.array([float(defParam.YnormTo)/np.amax(M[1:,1:], axis = 1)]).T)
+    normalizeRows(M[1:,1:], float(defParam.YnormTo))
     return M
 
 #************************************
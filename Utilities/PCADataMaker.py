@@ -15,6 +15,7 @@ print(__doc__)
 
 import numpy as np
 import sys, os.path, glob
+from libSpectraData import readSpectraFiles, LearnFileBuilder
 
 #**********************************************
 ''' main '''
@@ -36,45 +37,49 @@ def main():
 ''' Open and process inividual files '''
 #**********************************************
 def processMultiFile(pcaFile, param):
-    for f in glob.glob('*.txt'):
-        if (f != pcaFile):
-            makeFile(f, pcaFile, param)
-    
+    files = [f for f in glob.glob('*.txt') if f != pcaFile]
+    spectra = readSpectraFiles(files)
+
+    # Only the energy axis (first row) of an existing file is needed
+    newFile = not os.path.exists(pcaFile)
+    if newFile:
+        print('\n\033[1m' + ' Train data file not found. Creating...' + '\033[0m')
+        EnT = next((s[0] for s in spectra if s is not None), None)
+        if EnT is None:
+            return
+    else:
+        with open(pcaFile, 'r') as f:
+            EnT = np.array(f.readline().split(), dtype=float)[1:]
+
+    pcaData = LearnFileBuilder(EnT, len(files))
+    for f, spectrum in zip(files, spectra):
+        makeFile(f, spectrum, EnT, pcaData, param)
+
+    with open(pcaFile, 'ab') as f:
+        if newFile:
+            np.savetxt(f, pcaData.getMatrix(), delimiter='\t', fmt='%10.6f')
+        else:
+            np.savetxt(f, pcaData.getMatrix()[1:], delimiter='\t', fmt='%10.6f')
+    print('\n Added', len(pcaData), 'spectra to \"' + pcaFile + '\"\n')
+
 #**********************************************
 ''' Add data to PCA file '''
 #**********************************************
-def makeFile(sampleFile, pcaFile, param):
+def makeFile(sampleFile, spectrum, EnT, pcaData, param):
     try:
-        with open(sampleFile, 'r') as f:
-            En = np.loadtxt(f, unpack = True, usecols=range(0,1))
-            print(' Number of points in \"' + sampleFile + '\": ' + str(En.shape[0]))
+        En, R = spectrum
+        print(' Number of points in \"' + sampleFile + '\": ' + str(En.shape[0]))
     except:
         print('\033[1m' + ' Sample data file not found \n' + '\033[0m')
         return
 
-    with open(sampleFile, 'r') as f:
-        R = np.loadtxt(f, unpack = True, usecols=range(1,2))
-
-    if os.path.exists(pcaFile):
-        with open(pcaFile, 'r') as f:
-            M = np.loadtxt(f, unpack =False)
-            EnT = np.delete(np.array(M[0,:]),np.s_[0:1],0)
-            if EnT.shape[0] == En.shape[0]:
-                print(' Number of points in the pca dataset: ' + str(EnT.shape[0]))
-            else:
-                print('\033[1m' + ' Mismatch in datapoints: ' + str(EnT.shape[0]) + '; sample = ' +  str(En.shape[0]) + '\033[0m')
-                R = np.interp(EnT, En, R, left = 0, right = 0)
-                print('\033[1m' + ' Mismatch corrected: datapoints in sample: ' + str(R.shape[0]) + '\033[0m')
-            print('\n Added spectra to \"' + pcaFile + '\"\n')
-            newTrain = np.append(float(param),R).reshape(1,-1)
+    if EnT.shape[0] == En.shape[0]:
+        print(' Number of points in the pca dataset: ' + str(EnT.shape[0]))
     else:
-        print('\n\033[1m' + ' Train data file not found. Creating...' + '\033[0m')
-        newTrain = np.append([0], En)
-        print(' Added spectra to \"' + pcaFile + '\"\n')
-        newTrain = np.vstack((newTrain, np.append(float(param),R)))
-
-    with open(pcaFile, 'ab') as f:
-        np.savetxt(f, newTrain, delimiter='\t', fmt='%10.6f')
+        print('\033[1m' + ' Mismatch in datapoints: ' + str(EnT.shape[0]) + '; sample = ' +  str(En.shape[0]) + '\033[0m')
+        R = np.interp(EnT, En, R, left = 0, right = 0)
+        print('\033[1m' + ' Mismatch corrected: datapoints in sample: ' + str(R.shape[0]) + '\033[0m')
+    pcaData.append(float(param), R)
 
 #************************************
 ''' Lists the program usage '''
@@ -11,6 +11,7 @@
 print(__doc__)
 import numpy as np
 import sys, os.path, random, h5py
+from libSpectraData import openLearnFile
 import matplotlib.pyplot as plt
 
 def main():
@@ -33,14 +34,7 @@ def main():
 def readLearnFile(learnFile):
     print(" Opening learning file: "+learnFile+"\n")
     try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        M = openLearnFile(learnFile)
     except:
         print("\033[1m" + " Learning file not found \n" + "\033[0m")
         return
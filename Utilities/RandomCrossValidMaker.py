@@ -16,6 +16,7 @@ print(__doc__)
 
 import numpy as np
 import sys, os, csv, h5py
+from libSpectraData import openLearnFile, writeLearnFile, LearnFileBuilder
 
 class defParam:
     saveAsTxt = False
@@ -58,14 +59,7 @@ def main():
 def readLearnFile(learnFile):
     print(" Opening learning file: "+learnFile+"\n")
     try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        M = openLearnFile(learnFile)
     except:
         print("\033[1m" + " Learning file not found \n" + "\033[0m")
         return
@@ -82,16 +76,15 @@ def readLearnFile(learnFile):
 def writeFile(File, En, A, Cl):
     print(' Number of datapoints:', str(A.shape[0]))
     
-    newMatrix = np.append([0], En).reshape(1,-1)
-    for i in range(len(Cl)):
-        newMatrix = np.vstack((newMatrix, np.append(Cl[i], A[i])))
+    learnData = LearnFileBuilder(En, len(Cl))
+    learnData.append(Cl, A)
+    newMatrix = learnData.getMatrix()
     
     if defParam.saveAsTxt == True:
         with open(File, 'ab') as f:
             np.savetxt(f, newMatrix, delimiter='\t', fmt='%10.6f')
     else:
-        with h5py.File(File, 'w') as hf:
-            hf.create_dataset("M",  data=newMatrix)
+        writeLearnFile(File, newMatrix)
 
 #************************************
 ''' Format subset '''
@@ -15,6 +15,7 @@
 print(__doc__)
 import numpy as np
 import sys, os.path, h5py
+from libSpectraData import openLearnFile
 
 #************************************
 ''' Main '''
@@ -36,14 +37,9 @@ def main():
 def readLearnFile(learnFile):
 
     with h5py.File(learnFile, 'r') as hf:
-        #En = hf["En"][:]
-        #A = hf["A"][:]
-        #Cl = hf["Cl"][:].astype('<U4')
-        M = hf["M"][:]
-        
-    #print("En: ", En)
-    #print("A: ",A)
-    #print("Cl: ",Cl)
+        for key, value in hf.attrs.items():
+            print(" "+key+":", value)
+    M = np.asarray(openLearnFile(learnFile))
     print("M: ", M)
     return 0
 #************************************
@@ -15,6 +15,7 @@ print(__doc__)
 
 import numpy as np
 import sys, os.path, h5py, pickle
+from libSpectraData import openLearnFile, writeLearnFile
 from random import uniform
 from bisect import bisect_left
 
@@ -47,14 +48,7 @@ def main():
 def readLearnFile(learnFile):
     print("\n  Opening learning file: "+learnFile+"\n")
     try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        M = openLearnFile(learnFile)
     except:
         print("\033[1m" + "  Learning file not found \n" + "\033[0m")
         return
@@ -74,8 +68,7 @@ def saveLearnFile(M, learnFile):
     else:
         learnFile += '.h5'
         print(" Saving new training file (hdf5) in: "+learnFile+"\n")
-        with h5py.File(learnFile, 'w') as hf:
-            hf.create_dataset("M",  data=M)
+        writeLearnFile(learnFile, M)
 
 #************************************
 # Main initialization routine
@@ -16,6 +16,7 @@ print(__doc__)
 
 import numpy as np
 import sys, os.path, h5py
+from libSpectraData import openLearnFile, writeLearnFile, LearnFileBuilder
 #************************************
 ''' Main '''
 #************************************
@@ -33,8 +34,6 @@ def main():
     learnFileExt = os.path.splitext(sys.argv[1])[1]
 
     En, M = readLearnFile(sys.argv[1])
-    newTrain = np.append([0], En)
-    exclTrain = np.append([0], En)
 
     numClasses = np.unique(M[:,0]).size
     indClass = np.zeros((numClasses))
@@ -71,13 +70,17 @@ def main():
 
     # create new training set above threshold
     print(" Creating new training dataset with included spectra...")
-    for i in np.where(rosterSpectra == 1.)[0]:
-        newTrain = np.vstack((newTrain,M[i,:]))
+    ind = np.where(rosterSpectra == 1.)[0]
+    learnData = LearnFileBuilder(En, ind.size)
+    learnData.append(M[ind,0], M[ind,1:])
+    newTrain = learnData.getMatrix()
 
     # create new training set below threshold
     print(" Creating new training dataset with the excluded spectra... \n")
-    for i in np.where(rosterSpectra == 0.)[0]:
-        exclTrain = np.vstack((exclTrain,M[i,:]))
+    ind = np.where(rosterSpectra == 0.)[0]
+    learnData = LearnFileBuilder(En, ind.size)
+    learnData.append(M[ind,0], M[ind,1:])
+    exclTrain = learnData.getMatrix()
 
     saveLearnFile(newTrain, newFile)
     saveLearnFile(exclTrain, exclFile)
@@ -88,14 +91,7 @@ def main():
 def readLearnFile(learnFile):
     print(" Opening training file: "+learnFile+"\n")
     try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        M = openLearnFile(learnFile)
     except:
         print("\033[1m" + " Learning file not found \n" + "\033[0m")
         return
@@ -117,8 +113,7 @@ def saveLearnFile(M, learnFile):
     else:
         learnFile += '.h5'
         print(" Saving new training file (hdf5) in: "+learnFile+"\n")
-        with h5py.File(learnFile, 'w') as hf:
-            hf.create_dataset("M",  data=M)
+        writeLearnFile(learnFile, M)
 
 #************************************
 ''' Main initialization routine '''
@@ -16,6 +16,7 @@ print(__doc__)
 
 import numpy as np
 import sys, os.path, h5py
+from libSpectraData import openLearnFile, writeLearnFile, readSpectraFiles, LearnFileBuilder
 from datetime import datetime, date
 
 #**********************************************
@@ -81,36 +82,47 @@ def processMultiFile(learnFile, enInit, enFin, enStep, threshold):
             ",enInit="+str(enInit)+",enFin="+str(enFin)+",enStep="+str(enStep)+\
             ",threshold="+str(threshold)+"\n"
     
+    files = [f for f in sorted(os.listdir(".")) if f != learnFile and os.path.splitext(f)[-1] == ".txt"]
+
     # Read, if exisiting, learnFile
     if os.path.exists(learnFile):
         print('\n\033[1m' + ' Train data file found. Opening...' + '\033[0m')
         EnT, M = readLearnFile(learnFile)
+        learnData = LearnFileBuilder(EnT, M.shape[0]-1+len(files))
+        learnData.append(M[1:,0], M[1:,1:])
     else:
         print('\n\033[1m' + ' Train data file not found. Creating...' + '\033[0m')
         EnT = np.arange(float(enInit), float(enFin), float(enStep), dtype=np.float)
-        M = np.append([0], EnT)
-
-    # process sample data
-    for ind, f in enumerate(sorted(os.listdir("."))):
-        if (f != learnFile and os.path.splitext(f)[-1] == ".txt"):
-            try:
-                index = compound.index(f.partition("_")[0])
-            except:
-                compound.append(f.partition("_")[0])
-                index = len(compound)-1
-            
-            success, M = makeFile(f, EnT, M, index, threshold)
-            if success == True:
-                summary += str(index) + ',,,' + f +'\n'
-                size = size + 1
-            else:
-                summary += str(index) + ',,,' + f +'\n'
+        if defParam.saveAsTxt == True:
+            learnData = LearnFileBuilder(EnT, len(files))
+        else:
+            # Stream spectra straight to disk
+            learnData = LearnFileBuilder(EnT, learnFile=learnFileRoot+'.h5')
+
+    spectra = readSpectraFiles(files)
+    for f, spectrum in zip(files, spectra):
+        try:
+            index = compound.index(f.partition("_")[0])
+        except:
+            compound.append(f.partition("_")[0])
+            index = len(compound)-1
+        
+        success = makeFile(f, spectrum, EnT, learnData, index, threshold)
+        if success == True:
+            summary += str(index) + ',,,' + f +'\n'
+            size = size + 1
+        else:
+            summary += str(index) + ',,,' + f +'\n'
 
     print('\n Energy scale: [', str(enInit),',',
             str(enFin), ']; Step:', str(enStep),
             '; Threshold:', str(threshold),'\n')
 
-    saveLearningFile(M, os.path.splitext(learnFile)[0])
+    if learnData.learnFile is None:
+        saveLearningFile(learnData.getMatrix(), learnFileRoot)
+    else:
+        learnData.close()
+        print(" Saving new training file (hdf5) in: "+learnData.learnFile+"\n")
     
     with open(summary_filename, "a") as sum_file:
         sum_file.write(summary)
@@ -128,22 +140,19 @@ def processMultiFile(learnFile, enInit, enFin, enStep, threshold):
 #**********************************************
 ''' Add data to Training file '''
 #**********************************************
-def makeFile(sampleFile, EnT, M, param, threshold):
+def makeFile(sampleFile, spectrum, EnT, learnData, param, threshold):
     print('\n Process file in class #: ' + str(param))
     try:
-        with open(sampleFile, 'r') as f:
-            En = np.loadtxt(f, unpack = True, usecols=range(0,1), delimiter = ',', skiprows = 10)
-            if(En.size == 0):
-                print('\n Empty file \n' )
-                return False, M
-        with open(sampleFile, 'r') as f:
-            R = np.loadtxt(f, unpack = True, usecols=range(1,2), delimiter = ',', skiprows = 10)
+        En, R = spectrum
+        if(En.size == 0):
+            print('\n Empty file \n' )
+            return False
         R[R<float(threshold)*np.amax(R)/100] = 0
         print(' Number of points in \"' + sampleFile + '\": ' + str(En.shape[0]))
         print(' Setting datapoints below ', threshold, '% of max (',str(np.amax(R)),')')
     except:
         print('\033[1m' + sampleFile + ' file not found \n' + '\033[0m')
-        return False, M
+        return False
 
     if EnT.shape[0] == En.shape[0]:
         print(' Number of points in the learning dataset: ' + str(EnT.shape[0]))
@@ -160,8 +169,8 @@ def makeFile(sampleFile, EnT, M, param, threshold):
         R = np.interp(EnT, En, R, left = defParam.leftBoundary, right = defParam.rightBoundary)
         print('\033[1m' + ' Mismatch corrected: datapoints in sample: ' + str(R.shape[0]) + '\033[0m')
 
-    M = np.vstack((M,np.append(float(param),R)))
-    return True, M
+    learnData.append(float(param), R)
+    return True
 
 #***************************************
 ''' Save learning file '''
@@ -174,8 +183,7 @@ def saveLearningFile(M, learnFileRoot):
             np.savetxt(f, M, delimiter='\t', fmt='%10.6f')
     else:
         learnFile = learnFileRoot+'.h5'
-        with h5py.File(learnFile, 'w') as hf:
-            hf.create_dataset("M",  data=M)
+        writeLearnFile(learnFile, M)
         print(" Saving new training file (hdf5) in: "+learnFile+"\n")
 
 #************************************
@@ -184,14 +192,8 @@ def saveLearningFile(M, learnFileRoot):
 def readLearnFile(learnFile):
     print(" Opening learning file: "+learnFile+"\n")
     try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        # Copied in memory: the file is rewritten when saving
+        M = openLearnFile(learnFile, writable=True)
     except:
         print("\033[1m" + " Learning file not found \n" + "\033[0m")
         return
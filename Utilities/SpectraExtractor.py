@@ -18,6 +18,7 @@ import numpy as np
 from sklearn import svm
 from sklearn.externals import joblib
 import sys, os.path
+from libSpectraData import LearnFileBuilder, readMapEn, readMapChunks
 
 #**********************************************
 ''' Options '''
@@ -25,6 +26,7 @@ import sys, os.path
 phaseColumn = 8
 selPhase = 6
 labelColumn = 2
+chunkRows = 4096  # map pixels read at a time
 
 #**********************************************
 ''' Main '''
@@ -48,15 +50,10 @@ def spectraExtractor(mapFile, clustFile, newMapFile):
     print(' Reading data and cluster files... \n')
 
     try:
-        with open(mapFile, 'r') as f:
-            En = np.array(f.readline().split(), dtype=np.dtype(float))
-            A = np.loadtxt(f, unpack =False)
+        En = readMapEn(mapFile)
     except:
         print('\033[1m' + ' Map data file not found \n' + '\033[0m')
         return
-    
-    A = np.delete(A, np.s_[0:2], 1)
-    print(' Shape map: ' + str(A.shape))
 
     try:
         with open(clustFile, 'r') as f:
@@ -75,12 +72,14 @@ def spectraExtractor(mapFile, clustFile, newMapFile):
     ''' Create new map file '''
     #**********************************************
     print('\n Creating new map file: ' + newMapFile)
-    phaseMap = np.append([0], En)
-
-    for i in range(0,A.shape[0]):
-        if Cl[i] == selPhase:
-            temp = np.append(L[i], A[i,:])
-            phaseMap = np.vstack((phaseMap, temp))
+    phaseData = LearnFileBuilder(En, np.count_nonzero(Cl == selPhase))
+    numPixels = 0
+    for X, Y, A in readMapChunks(mapFile, chunkRows):
+        ind = np.where(Cl[numPixels:numPixels+A.shape[0]] == selPhase)[0]
+        phaseData.append(L[numPixels+ind], A[ind,:])
+        numPixels += A.shape[0]
+    print(' Shape map: ' + str((numPixels, En.shape[0])))
+    phaseMap = phaseData.getMatrix()
 
     print(' Shape new map: ' + str(phaseMap.shape) + '\n')
 
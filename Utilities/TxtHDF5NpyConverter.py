@@ -15,12 +15,14 @@ print(__doc__)
 
 import numpy as np
 import sys, os.path, h5py
+from libSpectraData import openLearnFile, writeLearnFile
 
 #**********************************************
 ''' main '''
 #**********************************************
 class defParam:
     saveAsTxt = False
+    numLabels = 1   # label columns in the learning file
 def main():
     
     if len(sys.argv) < 2:
@@ -45,8 +47,7 @@ def text2bin(learnFile):
         with open(learnFile, 'r') as f:
             M = np.loadtxt(f, unpack =False)
     elif os.path.splitext(sys.argv[1])[1] == '.h5':
-        with h5py.File(learnFile, 'r') as hf:
-            M = hf["M"][:]
+        M = np.asarray(openLearnFile(learnFile))
     else:
         print("File format not recognized")
         return
@@ -66,8 +67,7 @@ def bin2text(learnFile):
             np.savetxt(f, M, delimiter='\t', fmt='%10.6f')
         print("Learning file converted to \033[1min\033[0m:", learnFileRoot+".txt\n")
     else:
-        with h5py.File(learnFileRoot+'.h5', 'w') as hf:
-            hf.create_dataset("M",  data=M)
+        writeLearnFile(learnFileRoot+'.h5', M, numLabels=defParam.numLabels)
         print(" Learning file converted to \033[1mhdf5\033[0m: "+learnFileRoot+".h5\n")
 
 #************************************
@@ -16,6 +16,7 @@ print(__doc__)
 
 import numpy as np
 import h5py, sys, os.path, getopt
+from libSpectraData import writeLearnFile, normalizeSpectra
 
 #************************************
 ''' Main '''
@@ -24,17 +25,21 @@ class defParam:
     Ynorm = False
     YnormTo = 1
     saveNormAsTxt = False
+    numLabels = 1   # label columns in the learning file
 
 def main():
     try:
         opts, args = getopt.getopt(sys.argv[1:],
-                                   "nkh:", ["norm", "key", "help"])
+                                   "nkl:h:", ["norm", "key", "labels=", "help"])
         if len(sys.argv) < 2:
             usage()
             return
         else:
             if "-n" in [x[0] for x in opts] :
                 defParam.Ynorm = True
+            for o, a in opts:
+                if o in ("-l", "--labels"):
+                    defParam.numLabels = int(a)
             file =  args[0]
         saveLearnFile(file)
     except:
@@ -63,12 +68,7 @@ def saveLearnFile(learnFile):
 
     if defParam.Ynorm ==True:
         print(" Normalizing spectra to:",defParam.YnormTo)
-        A = M[1:,1:]
-        for i in range(0,A.shape[0]):
-            if(np.amin(A[i]) <= 0):
-                A[i,:] = A[i,:] - np.amin(A[i,:]) + 1e-8
-            A[i,:] = np.multiply(A[i,:], defParam.YnormTo/max(A[i][:]))
-        M[1:,1:] = A
+        normalizeSpectra(M[1:,defParam.numLabels:], defParam.YnormTo)
 
         if defParam.saveNormAsTxt == True:
             if os.path.isfile(learnFileNorm+'.txt') is False:
@@ -80,11 +80,8 @@ def saveLearnFile(learnFile):
         learnFileRoot = learnFileNorm
 
     if os.path.isfile(learnFileRoot+'.h5') is False:
-        with h5py.File(learnFileRoot+'.h5', 'w') as hf:
-            #hf.create_dataset("En",  data=En)
-            hf.create_dataset("M",  data=M)
-            #hf.create_dataset("Cl",  data=Cl.astype('|S9'))
-            #hf.create_dataset("A",  data=A)
+        writeLearnFile(learnFileRoot+'.h5', M, attrs={'Ynorm' : defParam.Ynorm,
+            'YnormTo' : defParam.YnormTo}, numLabels=defParam.numLabels)
         print(" Learning file converted to hdf5: "+learnFileRoot+".h5\n")
 
     else:
@@ -96,6 +93,7 @@ def saveLearnFile(learnFile):
 def usage():
     print(' Usage:\n  python3 TxtToHDF5.py <Learning File DataMaker>\n')
     print(' With Normalization:\n  python3 TxtToHDF5.py -n <Learning File prepared with DataMaker>\n')
+    print(' Multi-label learning file (N label columns):\n  python3 TxtToHDF5.py -l <N> <Learning File DataMaker>\n')
     print(' Requires python 3.x. Not compatible with python 2.x\n')
 
 #************************************
@@ -11,6 +11,7 @@
 print(__doc__)
 import numpy as np
 import sys, os.path, random, h5py
+from libSpectraData import openLearnFile, writeLearnFile, LearnFileBuilder
 import matplotlib.pyplot as plt
 
 #************************************
@@ -42,14 +43,7 @@ def main():
 def readLearnFile(learnFile):
     print(" Opening learning file: "+learnFile+"\n")
     try:
-        if os.path.splitext(learnFile)[1] == ".npy":
-            M = np.load(learnFile)
-        elif os.path.splitext(learnFile)[1] == ".h5":
-            with h5py.File(learnFile, 'r') as hf:
-                M = hf["M"][:]
-        else:
-            with open(learnFile, 'r') as f:
-                M = np.loadtxt(f, unpack =False)
+        M = openLearnFile(learnFile)
     except:
         print("\033[1m" + " Learning file not found \n" + "\033[0m")
         return
@@ -79,10 +73,9 @@ def resize(En, M, min, max):
 ''' Save New Learning Data '''
 #************************************
 def saveNewLearnFile(En,Cl,M,learnFile):
-    newTrain = np.append([0], En)
-    
-    for i in range(0,M.shape[0]):
-        newTrain = np.vstack((newTrain, np.append(float(Cl[i]),M[i,:])))
+    learnData = LearnFileBuilder(En, M.shape[0])
+    learnData.append(Cl, M)
+    newTrain = learnData.getMatrix()
 
     if defParam.saveAsTxt == True:
         learnFile += '.txt'
@@ -92,8 +85,7 @@ def saveNewLearnFile(En,Cl,M,learnFile):
     else:
         learnFile += '.h5'
         print(" Saving new training file (hdf5) in: "+learnFile+"\n")
-        with h5py.File(learnFile, 'w') as hf:
-            hf.create_dataset("M",  data=newTrain)
+        writeLearnFile(learnFile, newTrain)
 
 #************************************
 ''' Plot data '''
@@ -0,0 +1,538 @@
+# -*- coding: utf-8 -*-
+'''
+*********************************************
+*
+* libSpectraData
+* Shared I/O for learning files
+*
+* version: 20190201a
+*
+* By: Nicola Ferralis <feranick@hotmail.com>
+*
+***********************************************
+'''
+import numpy as np
+import sys, os.path, h5py
+import multiprocessing as mp
+from numpy.lib.stride_tricks import sliding_window_view
+from datetime import datetime
+
+#************************************
+''' HDF5 learning file layout '''
+#************************************
+class h5Param:
+    # v1: single "M" dataset (En in row 0, Cl in column 0)
+    # v2: separate "En", "Cl" and row-chunked, compressed "A";
+    #     Cl is (N,) or (N, numLabels), see attribute numLabels
+    version = 2
+    compression = 'lzf'     # 'lzf' (fast), 'gzip' or None
+    gzipLevel = 4
+    float32 = False
+    chunkRows = 256
+
+#************************************
+''' Lazy view on HDF5 learning data '''
+#************************************
+class LazyMatrix(object):
+    ''' Read-only 2D view on an HDF5 dataset. Only the rows that are
+        indexed are read from disk; nothing is copied at opening. '''
+    def __init__(self, dset, rowOffset=0, colOffset=0, hf=None):
+        self.dset = dset
+        self.hf = hf
+        self.rowOffset = rowOffset
+        self.colOffset = colOffset
+        self.shape = (dset.shape[0]-rowOffset, dset.shape[1]-colOffset)
+        self.dtype = dset.dtype
+        self.ndim = 2
+        self.size = self.shape[0]*self.shape[1]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows = key[0]
+            cols = key[1] if len(key) > 1 else slice(None)
+        else:
+            rows = key
+            cols = slice(None)
+
+        if isinstance(rows, (int, np.integer)):
+            ind = range(self.shape[0])[rows] + self.rowOffset
+            return self.dset[ind, self.colOffset:][cols]
+
+        if isinstance(rows, slice) and (rows.step is None or rows.step > 0):
+            start, stop, step = rows.indices(self.shape[0])
+            sel = slice(start+self.rowOffset, max(start, stop)+self.rowOffset, step)
+            return self.dset[sel, self.colOffset:][:, cols]
+
+        # HDF5 point selections must be sorted and unique
+        ind = np.arange(self.shape[0])[rows]
+        if ind.size == 0:
+            return np.empty((0, self.shape[1]), dtype=self.dtype)[:, cols]
+        uniq, inv = np.unique(ind, return_inverse=True)
+        return self.dset[uniq+self.rowOffset, self.colOffset:][inv][:, cols]
+
+    def __array__(self, dtype=None, copy=None):
+        M = self[:]
+        if dtype is not None:
+            M = M.astype(dtype, copy=False)
+        return M
+
+    def offset(self, rowOffset, colOffset):
+        return LazyMatrix(self.dset, self.rowOffset+rowOffset,
+            self.colOffset+colOffset, self.hf)
+
+#************************************
+''' M-layout view on v2 learning files '''
+#************************************
+class LearnMatrix(object):
+    ''' Presents En, Cl and A of a v2 file as the classic M matrix
+        (En in row 0, Cl in column 0) so that scripts written for the
+        v1 layout keep working. A is only read for the rows and
+        columns requested. '''
+    def __init__(self, En, Cl, A, hf=None):
+        self.En = En
+        self.Cl = Cl
+        self.A = A
+        self.hf = hf
+        self.numLabels = Cl.shape[1] if Cl.ndim == 2 else 1
+        self.shape = (A.shape[0]+1, A.shape[1]+self.numLabels)
+        self.dtype = np.result_type(A.dtype, Cl.dtype, En.dtype)
+        self.ndim = 2
+        self.size = self.shape[0]*self.shape[1]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows = key[0]
+            cols = key[1] if len(key) > 1 else slice(None)
+        else:
+            rows = key
+            cols = slice(None)
+
+        if isinstance(rows, (int, np.integer)):
+            return self._rows(np.array([range(self.shape[0])[rows]]), cols)[0]
+        return self._rows(np.arange(self.shape[0])[rows], cols)
+
+    def _rows(self, ind, cols):
+        nl = self.numLabels
+        colInd = np.arange(self.shape[1])[cols]
+        out = np.zeros((ind.size, self.shape[1]), dtype=self.dtype)
+        head = ind == 0
+        out[head, nl:] = self.En
+        sel = ind[~head]-1
+        if sel.size > 0:
+            out[~head, :nl] = self.Cl[sel].reshape(sel.size, nl)
+            if np.any(np.atleast_1d(colInd) >= nl):
+                out[~head, nl:] = self.A[sel]
+        return out[:, colInd]
+
+    def __array__(self, dtype=None, copy=None):
+        M = self[:]
+        if dtype is not None:
+            M = M.astype(dtype, copy=False)
+        return M
+
+#************************************
+''' Open learning file '''
+#************************************
+def openLearnFile(learnFile, writable=False):
+    ''' Return the full learning matrix M (energy axis in row 0,
+        labels in column 0) without loading it in memory when possible:
+        .npy is memory-mapped (pages shared through the OS cache, and
+        copy-on-write when writable), .h5 is opened lazily. Text files
+        are parsed only as a last resort. '''
+    ext = os.path.splitext(learnFile)[1]
+    if ext == ".npy":
+        if writable:
+            return np.load(learnFile, mmap_mode='c')
+        return np.load(learnFile, mmap_mode='r')
+    elif ext == ".h5":
+        hf = h5py.File(learnFile, 'r')
+        if "M" in hf:
+            if writable:
+                M = hf["M"][:]
+                hf.close()
+                return M
+            return LazyMatrix(hf["M"], hf=hf)
+        M = LearnMatrix(hf["En"][:], hf["Cl"][:], LazyMatrix(hf["A"]), hf=hf)
+        if writable:
+            M = np.asarray(M)
+            hf.close()
+        return M
+    else:
+        with open(learnFile, 'r') as f:
+            return np.loadtxt(f, unpack =False)
+
+#************************************
+''' Read learning file '''
+#************************************
+def readLearnFile(learnFile, writable=False):
+    ''' Return En, Cl, A. A is a view (memory map or lazy HDF5) and
+        is not copied unless writable is set for HDF5 files. '''
+    if os.path.splitext(learnFile)[1] == ".h5":
+        hf = h5py.File(learnFile, 'r')
+        if "A" in hf:
+            En = hf["En"][:]
+            Cl = hf["Cl"][:]
+            if writable:
+                A = hf["A"][:]
+                hf.close()
+            else:
+                A = LazyMatrix(hf["A"], hf=hf)
+            return En, Cl, A
+        hf.close()
+
+    M = openLearnFile(learnFile, writable)
+    En = np.asarray(M[0,1:])
+    Cl = np.asarray(M[1:,0])
+    if isinstance(M, LazyMatrix):
+        A = M.offset(1,1)
+    else:
+        A = M[1:,1:]
+    return En, Cl, A
+
+#************************************
+''' Read subsets of learning file '''
+#************************************
+def readLearnRows(learnFile, start, stop):
+    ''' Return En, Cl, A for rows [start, stop) of the spectra. With v2
+        files only the chunks covering those rows are decompressed. '''
+    En, Cl, A = readLearnFile(learnFile)
+    return En, Cl[start:stop], np.asarray(A[start:stop])
+
+def readLearnLabels(learnFile, labels):
+    ''' Return En, Cl, A restricted to spectra whose label is in labels '''
+    En, Cl, A = readLearnFile(learnFile)
+    ind = np.where(np.isin(Cl, labels))[0]
+    return En, Cl[ind], np.asarray(A[ind])
+
+#************************************
+''' Learning file builder '''
+#************************************
+class LearnFileBuilder(object):
+    ''' Assemble a learning matrix row by row in linear time. Rows go in
+        a buffer preallocated for numRows (grown geometrically if more
+        come in). When learnFile (.h5) is given, rows are instead streamed
+        in blocks of h5Param.chunkRows to a resizable v2 dataset, so that
+        memory stays bounded whatever the number of spectra. Spectra have
+        numLabels labels (the first numLabels columns of M). '''
+    def __init__(self, En, numRows=0, learnFile=None, attrs=None, numLabels=1):
+        self.En = np.asarray(En, dtype=np.float64)
+        self.numRows = 0
+        self.learnFile = learnFile
+        self.numLabels = numLabels
+        P = self.En.shape[0]
+        if learnFile is None:
+            self.M = np.empty((max(numRows, 1)+1, P+numLabels))
+            self.M[0,:numLabels] = 0
+            self.M[0,numLabels:] = self.En
+        else:
+            dtype = np.float32 if h5Param.float32 else np.float64
+            kw = createParamH5((h5Param.chunkRows, P), dtype)
+            self.hf = h5py.File(learnFile, 'w')
+            self.hf.create_dataset("En", data=self.En)
+            clShape = (0,) if numLabels == 1 else (0, numLabels)
+            self.hf.create_dataset("Cl", shape=clShape, maxshape=(None,)+clShape[1:],
+                chunks=(h5Param.chunkRows,)+clShape[1:], dtype=np.float64)
+            self.hf.create_dataset("A", shape=(0,P), maxshape=(None,P), **kw)
+            writeAttrsH5(self.hf, attrs, numLabels)
+            self.M = np.empty((h5Param.chunkRows+1, P+numLabels))
+            self.numStored = 0
+
+    def __len__(self):
+        return self.numRows
+
+    def append(self, Cl, A):
+        ''' Add one spectrum (scalar Cl, 1D A) or a block of them.
+            With numLabels > 1, Cl has numLabels values per spectrum. '''
+        Cl = np.reshape(Cl, (-1, self.numLabels))
+        A = np.atleast_2d(A)
+        n = A.shape[0]
+        if self.learnFile is not None:
+            i = 0
+            while i < n:
+                room = self.M.shape[0]-1-(self.numRows-self.numStored)
+                k = min(room, n-i)
+                self._store(Cl[i:i+k], A[i:i+k])
+                i += k
+                if self.numRows-self.numStored == self.M.shape[0]-1:
+                    self.flush()
+            return
+        if self.numRows+n > self.M.shape[0]-1:
+            self._grow(self.numRows+n)
+        self._store(Cl, A)
+
+    def _store(self, Cl, A):
+        start = self.numRows+1
+        if self.learnFile is not None:
+            start -= self.numStored
+        self.M[start:start+A.shape[0], :self.numLabels] = Cl
+        self.M[start:start+A.shape[0], self.numLabels:] = A
+        self.numRows += A.shape[0]
+
+    def _grow(self, numRows):
+        M = np.empty((max(numRows, 2*(self.M.shape[0]-1))+1, self.M.shape[1]))
+        M[:self.numRows+1] = self.M[:self.numRows+1]
+        self.M = M
+
+    def flush(self):
+        n = self.numRows-self.numStored
+        if self.learnFile is None or n == 0:
+            return
+        nl = self.numLabels
+        self.hf["Cl"].resize(self.numRows, axis=0)
+        self.hf["A"].resize(self.numRows, axis=0)
+        self.hf["Cl"][self.numStored:] = self.M[1:n+1, 0] if nl == 1 else self.M[1:n+1, :nl]
+        self.hf["A"][self.numStored:] = self.M[1:n+1, nl:]
+        self.numStored = self.numRows
+
+    def getMatrix(self):
+        ''' Return M (En in row 0, Cl in column 0) for in-memory builders '''
+        return self.M[:self.numRows+1]
+
+    def close(self):
+        if self.learnFile is not None:
+            self.flush()
+            self.hf.close()
+
+#************************************
+''' Read spectrum files '''
+#************************************
+def readSpectrumFile(sampleFile):
+    ''' Return En, R of a single spectrum. The file is read once and the
+        format detected from its content: RRUFF (##-header, comma
+        separated), Xmu (#-comments) or plain two-column text. '''
+    with open(sampleFile, 'r') as f:
+        lines = f.read().splitlines()
+
+    start = 0
+    while start < len(lines) and not isNumericLine(lines[start]):
+        start += 1
+    stop = start
+    while stop < len(lines) and lines[stop][:1] != '#':
+        stop += 1
+    while stop > start and lines[stop-1].strip() == '':
+        stop -= 1
+    if stop == start:
+        return np.empty(0), np.empty(0)
+
+    delimiter = ',' if ',' in lines[start] else None
+    body = '\n'.join(lines[start:stop])
+    ncols = len(lines[start].replace(',', ' ').split())
+    if delimiter == ',':
+        body = body.replace(',', ' ')
+    S = np.fromstring(body, sep=' ')
+    if S.size != ncols*(stop-start):
+        # Irregular rows: fall back to the line-by-line parser
+        S = np.loadtxt(lines[start:stop], delimiter=delimiter, usecols=(0,1))
+        return S[:,0].copy(), S[:,1].copy()
+    S = S.reshape(-1, ncols)
+    return S[:,0].copy(), S[:,1].copy()
+
+def isNumericLine(line):
+    try:
+        float(line.replace(',', ' ').split()[0])
+        return True
+    except:
+        return False
+
+def readSpectrumFileSafe(sampleFile):
+    try:
+        return readSpectrumFile(sampleFile)
+    except:
+        return None
+
+def readSpectraFiles(files, processes=None):
+    ''' Read a list of spectra files across a process pool. Returns a list
+        (in the same order) of (En, R) tuples, or None for files that
+        could not be read. '''
+    if processes is None:
+        processes = mp.cpu_count()
+    if processes < 2 or len(files) < 2*processes:
+        return [readSpectrumFileSafe(f) for f in files]
+    chunksize = max(1, len(files)//(4*processes))
+    with mp.Pool(processes) as p:
+        return p.map(readSpectrumFileSafe, files, chunksize)
+
+#************************************
+''' Read map files in blocks
+    (Horiba LabSpec: En in row 0,
+    then X, Y, spectrum per pixel) '''
+#************************************
+def readMapEn(mapFile):
+    with open(mapFile, 'r') as f:
+        return np.array(f.readline().split(), dtype=np.dtype(float))
+
+def readMapChunks(mapFile, chunkRows=4096):
+    from itertools import islice
+    with open(mapFile, 'r') as f:
+        numCols = len(f.readline().split()) + 2
+        while True:
+            lines = list(islice(f, chunkRows))
+            if not lines:
+                break
+            block = np.fromstring(''.join(lines), sep=' ')
+            if block.size % numCols != 0:
+                block = np.loadtxt(lines, ndmin=2)
+            block = block.reshape(-1, numCols)
+            yield block[:,0], block[:,1], block[:,2:]
+
+#************************************
+''' Intensity normalization
+    In place, block by block: each row
+    of A is scaled so its maximum within
+    YnormXind (all points if None) is
+    YnormTo. Rows with non-positive values
+    are shifted above zero first. '''
+#************************************
+def normalizeSpectra(A, YnormTo, YnormXind=None, shiftPositive=True, chunkRows=4096):
+    if not np.issubdtype(np.asarray(A).dtype, np.floating):
+        A = np.asarray(A, dtype=float)
+    for i in range(0, A.shape[0], chunkRows):
+        a = A[i:i+chunkRows]
+        if shiftPositive == True:
+            amin = np.amin(a, axis=1)
+            neg = amin <= 0
+            if neg.any():
+                a[neg] -= (amin[neg] - 1e-8)[:,None]
+        if YnormXind is None:
+            ref = np.amax(a, axis=1)
+        else:
+            ref = np.amax(a[:,YnormXind], axis=1)
+        a *= (YnormTo/ref)[:,None].astype(a.dtype)
+    return A
+
+#************************************
+''' Horizontal shift
+    Shifts each row of A along En by its own
+    amount (or one scalar for all rows), as
+    np.interp(En, En+shift, row, left=0, right=0).
+    On a regular axis each row needs only an
+    integer offset and a weight, so a chunk of
+    rows is resampled at once from a padded
+    window view. out may be A. '''
+#************************************
+def shiftSpectra(A, En, shifts, out=None, chunkRows=4096):
+    En = np.asarray(En, dtype=float)
+    shifts = np.broadcast_to(np.asarray(shifts, dtype=float), (A.shape[0],))
+    if out is None:
+        out = np.empty(A.shape, dtype=np.result_type(A.dtype, np.float32))
+    P = En.size
+    dE = (En[-1] - En[0])/(P-1)
+    if not np.allclose(np.diff(En), dE, rtol=1e-9, atol=0):
+        # Irregular energy axis: interpolate row by row
+        for i in range(A.shape[0]):
+            out[i] = np.interp(En, En+shifts[i], A[i], left = 0, right = 0)
+        return out
+    cols = np.arange(P)
+    for i in range(0, A.shape[0], chunkRows):
+        # Tables: whole-point offset k, weight f, valid columns [lo,hi)
+        q = -shifts[i:i+chunkRows]/dE
+        k = np.clip(np.floor(q), -P, P).astype(int)
+        f = (q - k)[:,None]
+        lo = np.clip(np.ceil(-q), 0, P)[:,None]
+        hi = np.clip(np.floor(P-1-q)+1, 0, P)[:,None]
+        K = int(np.abs(k).max())+1
+        Ap = np.zeros((k.size, P+2*K), dtype=out.dtype)
+        Ap[:,K:K+P] = A[i:i+chunkRows]
+        V = sliding_window_view(Ap, P, axis=1)
+        rows = np.arange(k.size)
+        S = V[rows,K+k]
+        S1 = V[rows,K+k+1]
+        S1 -= S
+        S1 *= f
+        S += S1
+        S[(cols < lo) | (cols >= hi)] = 0
+        out[i:i+chunkRows] = S
+    return out
+
+#************************************
+''' Noise augmentation
+    Builds the original spectra followed by
+    copies noisy versions of them. The output
+    is allocated once (or streamed to learnFile,
+    see LearnFileBuilder), noisy blocks are made
+    in place in a single scratch buffer, and
+    each copy draws from its own Generator
+    stream spawned from seed, so runs are
+    reproducible. noise(rng, A) is called once
+    per copy with the full set, drawing what
+    spans rows (e.g. a noise vector, column
+    maxima), and returns add(S, i) modifying
+    the block S (rows from i) in place. Output
+    does not depend on chunkRows. '''
+#************************************
+def augmentSpectra(En, Cl, A, copies, noise, seed=None, learnFile=None,
+        attrs=None, YnormTo=None, chunkRows=4096):
+    ss = np.random.SeedSequence(seed)
+    print(" Noise seed:", ss.entropy)
+    attrs = dict(attrs or {}, noiseSeed=str(ss.entropy))
+    learnData = LearnFileBuilder(En, A.shape[0]*(copies+1), learnFile, attrs)
+    learnData.append(Cl, A)
+    S = np.empty((min(chunkRows, A.shape[0]), A.shape[1]))
+    for child in ss.spawn(copies):
+        addNoise = noise(np.random.default_rng(child), A)
+        for i in range(0, A.shape[0], chunkRows):
+            s = S[:min(chunkRows, A.shape[0]-i)]
+            np.copyto(s, A[i:i+chunkRows])
+            addNoise(s, i)
+            if YnormTo is not None:
+                normalizeSpectra(s, YnormTo)
+            learnData.append(Cl[i:i+chunkRows], s)
+    return learnData
+
+#************************************
+''' Write learning file '''
+#************************************
+def writeLearnFile(learnFile, M, attrs=None, numLabels=1):
+    ''' Save M (En in row 0, Cl in the first numLabels columns) according
+        to the extension of learnFile. HDF5 files are written with the v2
+        layout. '''
+    ext = os.path.splitext(learnFile)[1]
+    if ext == ".h5":
+        M = np.asarray(M)
+        writeLearnFileH5(learnFile, M[0,numLabels:], M[1:,:numLabels], M[1:,numLabels:],
+            attrs, numLabels)
+    elif ext == ".npy":
+        np.save(learnFile, M)
+    else:
+        with open(learnFile, 'ab') as f:
+            np.savetxt(f, M, delimiter='\t', fmt='%10.6f')
+
+def writeLearnFileH5(learnFile, En, Cl, A, attrs=None, numLabels=1):
+    ''' Write En, Cl and A as separate datasets. Cl is (N,) for a single
+        label, (N, numLabels) otherwise. A is chunked by rows and
+        compressed; provenance and any extra attrs (e.g. preprocessing
+        parameters) are stored as file attributes. '''
+    dtype = np.float32 if h5Param.float32 else np.asarray(A).dtype
+    kw = createParamH5(A.shape, dtype)
+    Cl = np.asarray(Cl).reshape((-1,) if numLabels == 1 else (-1, numLabels))
+    with h5py.File(learnFile, 'w') as hf:
+        hf.create_dataset("En", data=En)
+        hf.create_dataset("Cl", data=Cl)
+        hf.create_dataset("A", data=np.asarray(A, dtype=dtype), **kw)
+        writeAttrsH5(hf, attrs, numLabels)
+
+def createParamH5(shape, dtype):
+    kw = {'dtype' : dtype,
+        'chunks' : (max(1, min(h5Param.chunkRows, shape[0])), shape[1]),
+        'compression' : h5Param.compression}
+    if h5Param.compression == 'gzip':
+        kw['compression_opts'] = h5Param.gzipLevel
+    if h5Param.compression is not None:
+        kw['shuffle'] = True
+    return kw
+
+def writeAttrsH5(hf, attrs=None, numLabels=1):
+    hf.attrs['version'] = h5Param.version
+    hf.attrs['numLabels'] = numLabels
+    hf.attrs['created'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    hf.attrs['source'] = os.path.basename(sys.argv[0])
+    hf.attrs['command'] = ' '.join(sys.argv)
+    if attrs is not None:
+        for key, value in attrs.items():
+            hf.attrs[key] = value